@@ -0,0 +1,358 @@
+"""
+Host micro-benchmarks for the dnet messaging package.
+
+Covers MessageCodec encode/decode/validate per message type and wire form,
+ServiceRegistry ingest rates, find_service latency against registry size
+and memory per registry entry (tracemalloc). Results are written as JSON;
+with --baseline each timing is compared against an earlier run and
+regressions beyond --threshold percent are listed.
+
+    python dnet/bench/messaging_bench.py --output bench.json
+    python dnet/bench/messaging_bench.py --baseline bench.json --fail-on-regression
+
+Runs on CPython only; timings are nanoseconds per operation (best of
+--repeat runs), so compare runs from the same machine.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "code"))
+
+# The package announces itself on import; keep stdout clean for the JSON.
+_stdout, sys.stdout = sys.stdout, sys.stderr
+try:
+    from messaging import MessageCodec, Schema, ServiceRegistry  # noqa: E402
+    from messaging.delta import diff_profiles  # noqa: E402
+finally:
+    sys.stdout = _stdout
+
+
+FORMAT_VERSION = 1
+NODE_ID = "a1b2c3d4e5f6"
+PEER_ID = "d4f5aa10e0ab"
+REGISTRY_SIZES = (10, 100, 1000, 10000)
+SERVICES_PER_NODE = 4
+SERVICE_POOL = 64
+
+
+def _node_id(index):
+    return "{:012x}".format(0xA00000000000 + index)
+
+
+def _profile_services(service_ids):
+    return [
+        {
+            Schema.F_SERVICE_ID: sid,
+            "name": "svc/{}.run:1".format(sid),
+            "class": "actuator" if sid % 2 else "sensor",
+            "in": {"value": {"type": "int", "min": 0, "max": 180}},
+        }
+        for sid in service_ids
+    ]
+
+
+def _services_for(index):
+    return [(index * 7 + k * 13) % SERVICE_POOL + 1000 for k in range(SERVICES_PER_NODE)]
+
+
+def _sample_messages(codec):
+    """{name: (encode callable, version)} for every message type and wire form."""
+    services = [1201, 2201, 3301]
+    profile = {
+        Schema.F_PROFILE_HASH: "9c21a7f2",
+        Schema.F_SERVICES: _profile_services(services),
+        Schema.F_META: {"bus": "i2c", "mount": "front_center"},
+    }
+    new_profile = {
+        Schema.F_PROFILE_HASH: "9c21a7f3",
+        Schema.F_SERVICES: _profile_services(services[:2] + [4401]),
+        Schema.F_META: {"bus": "i2c", "mount": "rear"},
+    }
+    delta = diff_profiles(profile, new_profile)
+    binary = Schema.PROTOCOL_VERSION_BINARY
+    samples = [[i * 3, -i, 2512, i % 7, 128, -320] for i in range(20)]
+    entries = [[_node_id(i), "9c21a7f2", 1200, [1201, 2201]] for i in range(4)]
+    builders = {
+        "advertise": lambda v: codec.encode_advertise(NODE_ID, "9c21a7f2", services, version=v),
+        "query": lambda v: codec.encode_query(NODE_ID, 1201, version=v, request_id=7),
+        "query_result": lambda v: codec.encode_query_result(NODE_ID, 1201, [PEER_ID, NODE_ID], version=v, request_id=7),
+        "get_profile": lambda v: codec.encode_get_profile(NODE_ID, PEER_ID, version=v, request_id=7),
+        "profile": lambda v: codec.encode_profile(
+            NODE_ID,
+            profile[Schema.F_PROFILE_HASH],
+            profile[Schema.F_SERVICES],
+            name="servo-distance-node",
+            role="actuator_sensor",
+            firmware="1.2.0",
+            meta=profile[Schema.F_META],
+        ),
+        "profile_delta": lambda v: codec.encode_profile_delta(NODE_ID, **delta),
+        "gossip_digest": lambda v: codec.encode_gossip_digest(NODE_ID, "A" * 86 + "=="),
+        "gossip_pull": lambda v: codec.encode_gossip_pull(NODE_ID, 0x0F0F),
+        "gossip_entries": lambda v: codec.encode_gossip_entries(NODE_ID, entries),
+        "subscribe": lambda v: codec.encode_subscribe(NODE_ID, ["imu", "bump"], 60),
+        "publish": lambda v: codec.encode_publish(NODE_ID, [["imu", {"x": i}] for i in range(8)]),
+        "telemetry": lambda v: codec.encode_telemetry(NODE_ID, 1, 42, 123456, 5000, samples, frac_bits=8, version=v),
+        "call": lambda v: codec.encode_call(NODE_ID, 1201, 7, args=[90, 180], deadline_ms=250, version=v),
+        "call_reply": lambda v: codec.encode_call_reply(
+            NODE_ID, 7, result={"ok": True, "applied_angle_deg": 90}, version=v
+        ),
+    }
+    binary_types = ("advertise", "query", "query_result", "get_profile", "telemetry", "call", "call_reply")
+    cases = {}
+    for name, build in builders.items():
+        # A full telemetry block only fits a packet in binary.
+        if name != "telemetry":
+            cases[name + ".json"] = (build, None)
+        if name in binary_types:
+            cases[name + ".bin"] = (build, binary)
+    return cases
+
+
+def _time_ns(func, repeat, min_time_s):
+    """Best-of-repeat nanoseconds per call, each run lasting about min_time_s."""
+    loops = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= min_time_s * 1e9 or loops >= 1 << 24:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(min_time_s * 1e9 / elapsed) + 1))
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter_ns() - start) / loops)
+    return best
+
+
+def bench_codec(results, repeat, min_time_s):
+    codec = MessageCodec()
+    for name, (build, version) in _sample_messages(codec).items():
+        payload = build(version)
+        decoded = codec.decode(payload)
+        results["codec.encode." + name] = _result(_time_ns(lambda: build(version), repeat, min_time_s), len(payload))
+        results["codec.decode." + name] = _result(_time_ns(lambda: codec.decode(payload), repeat, min_time_s))
+        results["codec.validate." + name] = _result(_time_ns(lambda: codec.validate(decoded), repeat, min_time_s))
+        results["codec.peek_type." + name] = _result(_time_ns(lambda: codec.peek_type(payload), repeat, min_time_s))
+
+
+def bench_registry_ingest(results, repeat, min_time_s, nodes=1000):
+    codec = MessageCodec()
+    adverts = [codec.decode(codec.encode_advertise(_node_id(i), "{:08x}".format(i), _services_for(i))) for i in range(nodes)]
+    profiles = [
+        codec.decode(codec.encode_profile(_node_id(i), "{:08x}".format(i), _profile_services(_services_for(i)), role="r"))
+        for i in range(nodes)
+    ]
+    clock = [0]
+
+    def ingest(messages, register):
+        def run():
+            clock[0] += 1
+            for message in messages:
+                register(message)
+
+        return run
+
+    for label, messages, method in (
+        ("advertise", adverts, "register_advertisement"),
+        ("profile", profiles, "register_profile"),
+    ):
+        registry = ServiceRegistry(clock=lambda: clock[0])
+        register = getattr(registry, method)
+        # First pass creates the nodes; timed passes are steady-state refreshes.
+        ingest(messages, register)()
+        per_batch = _time_ns(ingest(messages, register), repeat, min_time_s)
+        results["registry.ingest.{}.refresh".format(label)] = _result(per_batch / nodes)
+
+        def fresh():
+            target = ServiceRegistry(clock=lambda: clock[0])
+            target_register = getattr(target, method)
+            for message in messages:
+                target_register(message)
+
+        results["registry.ingest.{}.new".format(label)] = _result(_time_ns(fresh, repeat, min_time_s) / nodes)
+
+
+def bench_find_service(results, repeat, min_time_s, sizes=REGISTRY_SIZES):
+    codec = MessageCodec()
+    for size in sizes:
+        registry = _filled_registry(codec, size)
+        sid = _services_for(0)[0]
+
+        def cold(limit):
+            # Drop the memos so every call pays for the index scan.
+            registry._find_cache = {}
+            registry._members_cache = {}
+            registry.find_service(sid, limit)
+
+        results["registry.find_service.n{}".format(size)] = _result(
+            _time_ns(lambda: cold(None), repeat, min_time_s), len(registry.find_service(sid))
+        )
+        results["registry.find_service.limit8.n{}".format(size)] = _result(
+            _time_ns(lambda: cold(8), repeat, min_time_s)
+        )
+        results["registry.find_service.memo.n{}".format(size)] = _result(
+            _time_ns(lambda: registry.find_service(sid, 8), repeat, min_time_s)
+        )
+        # A re-sighting invalidates limited memos (their top k follows
+        # recency), so on a busy mesh each limited lookup rescans.
+        advert = codec.decode(codec.encode_advertise(_node_id(1), "{:08x}".format(1), _services_for(1)))
+
+        def churn():
+            registry.register_advertisement(advert)
+            registry.find_service(sid, 8)
+
+        results["registry.find_service.churn.n{}".format(size)] = _result(_time_ns(churn, repeat, min_time_s))
+
+
+def bench_memory(memory, sizes=REGISTRY_SIZES):
+    codec = MessageCodec()
+    for size in sizes:
+        for label, profiles in (("advertise", False), ("profile", True)):
+            messages = _registry_messages(codec, size, profiles)
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            registry = ServiceRegistry(clock=lambda: 0)
+            register = registry.register_profile if profiles else registry.register_advertisement
+            for message in messages:
+                register(message)
+            used = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            memory["registry.{}.n{}".format(label, size)] = {
+                "bytes_total": used,
+                "bytes_per_node": round(used / size, 1),
+            }
+            del registry
+
+
+def _registry_messages(codec, size, profiles):
+    if profiles:
+        return [
+            codec.decode(codec.encode_profile(_node_id(i), "{:08x}".format(i), _profile_services(_services_for(i)), role="r"))
+            for i in range(size)
+        ]
+    return [codec.decode(codec.encode_advertise(_node_id(i), "{:08x}".format(i), _services_for(i))) for i in range(size)]
+
+
+def _filled_registry(codec, size):
+    registry = ServiceRegistry(clock=lambda: 0)
+    for message in _registry_messages(codec, size, False):
+        registry.register_advertisement(message)
+    return registry
+
+
+def _result(ns_per_op, size=None):
+    result = {"ns_per_op": round(ns_per_op, 1), "ops_per_s": round(1e9 / ns_per_op) if ns_per_op else None}
+    if size is not None:
+        result["size"] = size
+    return result
+
+
+def compare(results, baseline, threshold_pct):
+    """Per-benchmark change against baseline results; positive is slower."""
+    comparison = {}
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous or not previous.get("ns_per_op"):
+            continue
+        change = 100.0 * (result["ns_per_op"] - previous["ns_per_op"]) / previous["ns_per_op"]
+        comparison[name] = {"baseline_ns_per_op": previous["ns_per_op"], "change_pct": round(change, 1)}
+        if change > threshold_pct:
+            regressions.append(name)
+    return comparison, regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="write JSON results to this file (default: stdout)")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 when a benchmark regresses")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05, help="seconds per timing run")
+    parser.add_argument("--quick", action="store_true", help="registry sizes up to 1000 and shorter runs")
+    parser.add_argument("--only", choices=("codec", "registry", "memory"), action="append")
+    args = parser.parse_args(argv)
+
+    sizes = REGISTRY_SIZES[:-1] if args.quick else REGISTRY_SIZES
+    repeat = 3 if args.quick else args.repeat
+    min_time_s = min(args.min_time, 0.02) if args.quick else args.min_time
+    selected = set(args.only or ("codec", "registry", "memory"))
+
+    results = {}
+    memory = {}
+    if "codec" in selected:
+        bench_codec(results, repeat, min_time_s)
+    if "registry" in selected:
+        bench_registry_ingest(results, repeat, min_time_s)
+        bench_find_service(results, repeat, min_time_s, sizes)
+    if "memory" in selected:
+        bench_memory(memory, sizes)
+
+    report = {
+        "format": FORMAT_VERSION,
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "revision": _git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "repeat": repeat,
+            "min_time_s": min_time_s,
+        },
+        "results": results,
+        "memory": memory,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        comparison, regressions = compare(results, baseline.get("results", {}), args.threshold)
+        report["baseline"] = {
+            "path": args.baseline,
+            "revision": baseline.get("meta", {}).get("revision"),
+            "threshold_pct": args.threshold,
+            "comparison": comparison,
+            "regressions": regressions,
+        }
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(text + "\n")
+    else:
+        print(text)
+    if regressions:
+        sys.stderr.write("{} benchmark(s) regressed more than {}%:\n".format(len(regressions), args.threshold))
+        for name in regressions:
+            sys.stderr.write("  {} {:+.1f}%\n".format(name, report["baseline"]["comparison"][name]["change_pct"]))
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
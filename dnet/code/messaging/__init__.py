@@ -11,8 +11,10 @@ from .codec import (
     MessageCodec,
     MessageValidationError,
 )
+from .profile_cache import ProfileCache
 from .protocol import MessagingEndpoint
-from .registry import ServiceRegistry
+from .registry import NodeRecord, ServiceRegistry
+from .trickle import AdvertiseScheduler, TrickleTimer
 
 __all__ = [
     "MAX_SHORT_PACKET_BYTES",
@@ -20,5 +22,9 @@ __all__ = [
     "MessageCodec",
     "MessageValidationError",
     "MessagingEndpoint",
+    "NodeRecord",
+    "ProfileCache",
     "ServiceRegistry",
+    "TrickleTimer",
+    "AdvertiseScheduler",
 ]
@@ -0,0 +1,425 @@
+"""
+Compact binary wire format for DistNet capability messages.
+
+Selected per message by protocol version 2. Every frame starts with
+version(1) + type(1) + raw 6-byte MAC node id; JSON frames start with "{"
+so both forms can share a channel. Full profiles stay JSON-only.
+Queries, query results and get_profile frames may end in an optional
+u16 request id.
+
+Telemetry frames carry a block of fixed-point samples after the header:
+
+    u8 stream, u16 seq, u32 time_base_ms, u32 period_us, u8 frac_bits,
+    u8 encoding, u8 channels, u8 count, sample data
+
+Sample data is either int16 big-endian values (TELEMETRY_RAW16) or, for
+TELEMETRY_DELTA, the first sample followed by per-channel differences
+from the previous sample, all as zigzag varints, so slowly changing
+signals cost about one byte per value.
+
+Calls carry u16 service id, u16 request id, u16 deadline ms (0 = none)
+and, when present, the packed args. Call replies carry u16 request id,
+u8 status (0 ok, 1 error), the packed error code string on error, then
+the packed result when present. Packed values are a tag byte followed by
+the value: None, False, True, int (zigzag varint), float (f32), str and
+dict keys (varint length + utf-8), list and dict (varint count).
+"""
+
+try:
+    import ustruct as struct
+except Exception:
+    import struct
+try:
+    import ubinascii
+except Exception:
+    import binascii as ubinascii
+
+from .schema import Schema
+
+
+_HEADER = ">BB6s"
+_HEADER_BYTES = 8
+_MAC_BYTES = 6
+_MAX_LIST = 255
+_HEX_CHARS = "0123456789abcdefABCDEF"
+_REQUEST_ID_TYPES = (Schema.TYPE_QUERY, Schema.TYPE_QUERY_RESULT, Schema.TYPE_GET_PROFILE)
+
+_TELEMETRY_HEAD = ">BHIIBBBB"
+_TELEMETRY_HEAD_BYTES = 15
+TELEMETRY_RAW16 = 0
+TELEMETRY_DELTA = 1
+TELEMETRY_HEADER_BYTES = _HEADER_BYTES + _TELEMETRY_HEAD_BYTES
+# Time bases are MicroPython ticks_ms values, which wrap at 2**30.
+TELEMETRY_TICKS_PERIOD = 0x40000000
+
+_TAG_NONE = 0
+_TAG_FALSE = 1
+_TAG_TRUE = 2
+_TAG_INT = 3
+_TAG_FLOAT = 4
+_TAG_STR = 5
+_TAG_LIST = 6
+_TAG_DICT = 7
+_MAX_DEPTH = 8
+
+
+class BinaryWireError(ValueError):
+    pass
+
+
+def node_id_to_mac(node_id):
+    if not isinstance(node_id, str) or len(node_id) != 12:
+        raise BinaryWireError("binary wire needs a 12-hex-char MAC node id, got {}".format(node_id))
+    try:
+        return ubinascii.unhexlify(node_id)
+    except Exception:
+        raise BinaryWireError("node id is not hex: {}".format(node_id))
+
+
+def mac_to_node_id(mac):
+    return ubinascii.hexlify(mac).decode()
+
+
+def profile_hash_to_bytes(profile_hash):
+    """4-byte hash; 8-hex-char hashes round-trip, others are digested (FNV-1a)."""
+    if _is_hex8(profile_hash):
+        return ubinascii.unhexlify(profile_hash)
+    value = 0x811C9DC5
+    for byte in str(profile_hash).encode("utf-8"):
+        value = ((value ^ byte) * 0x01000193) & 0xFFFFFFFF
+    return struct.pack(">I", value)
+
+
+def canonical_profile_hash(profile_hash):
+    """
+    The 8 lowercase hex char form both wire forms carry. MessageCodec
+    applies it when encoding and decoding, so a profile hash compares equal
+    whichever form it travelled in.
+    """
+    if _is_hex8(profile_hash):
+        return profile_hash.lower()
+    return mac_to_node_id(profile_hash_to_bytes(profile_hash))
+
+
+def _is_hex8(value):
+    if not isinstance(value, str) or len(value) != 8:
+        return False
+    for char in value:
+        if char not in _HEX_CHARS:
+            return False
+    return True
+
+
+def encode(msg):
+    mtype = msg[Schema.F_TYPE]
+    head = struct.pack(_HEADER, Schema.PROTOCOL_VERSION_BINARY, ord(mtype), node_id_to_mac(msg[Schema.F_NODE_ID]))
+    if mtype == Schema.TYPE_ADVERTISE:
+        services = msg[Schema.F_SERVICES]
+        _check_count(len(services))
+        body = profile_hash_to_bytes(msg[Schema.F_PROFILE_HASH]) + struct.pack(
+            ">B{}H".format(len(services)), len(services), *services
+        )
+    elif mtype == Schema.TYPE_QUERY:
+        body = struct.pack(">H", msg[Schema.F_SERVICE_ID])
+    elif mtype == Schema.TYPE_QUERY_RESULT:
+        providers = msg[Schema.F_PROVIDERS]
+        _check_count(len(providers))
+        body = struct.pack(">HB", msg[Schema.F_SERVICE_ID], len(providers))
+        body += b"".join(node_id_to_mac(p) for p in providers)
+    elif mtype == Schema.TYPE_GET_PROFILE:
+        body = node_id_to_mac(msg[Schema.F_TARGET])
+    elif mtype == Schema.TYPE_TELEMETRY:
+        body = _encode_telemetry(msg)
+    elif mtype == Schema.TYPE_CALL:
+        out = bytearray(
+            struct.pack(">HHH", msg[Schema.F_SERVICE_ID], msg[Schema.F_REQUEST_ID], msg.get(Schema.F_DEADLINE, 0))
+        )
+        if Schema.F_ARGS in msg:
+            _pack_value(out, msg[Schema.F_ARGS], 0)
+        body = bytes(out)
+    elif mtype == Schema.TYPE_CALL_REPLY:
+        error = msg.get(Schema.F_ERROR)
+        out = bytearray(struct.pack(">HB", msg[Schema.F_REQUEST_ID], 0 if error is None else 1))
+        if error is not None:
+            _pack_value(out, error, 0)
+        if Schema.F_RESULT in msg:
+            _pack_value(out, msg[Schema.F_RESULT], 0)
+        body = bytes(out)
+    else:
+        raise BinaryWireError("message type '{}' has no binary form".format(mtype))
+    if Schema.F_REQUEST_ID in msg and mtype in _REQUEST_ID_TYPES:
+        body += struct.pack(">H", msg[Schema.F_REQUEST_ID])
+    return head + body
+
+
+def decode(raw):
+    if len(raw) < _HEADER_BYTES:
+        raise BinaryWireError("binary frame too short ({} bytes)".format(len(raw)))
+    version, type_code, mac = struct.unpack_from(_HEADER, raw, 0)
+    mtype = chr(type_code)
+    msg = {
+        Schema.F_VERSION: version,
+        Schema.F_TYPE: mtype,
+        Schema.F_NODE_ID: mac_to_node_id(mac),
+    }
+    offset = _HEADER_BYTES
+    try:
+        if mtype == Schema.TYPE_ADVERTISE:
+            msg[Schema.F_PROFILE_HASH] = ubinascii.hexlify(raw[offset:offset + 4]).decode()
+            count = raw[offset + 4]
+            msg[Schema.F_SERVICES] = list(struct.unpack_from(">{}H".format(count), raw, offset + 5))
+        elif mtype == Schema.TYPE_QUERY:
+            msg[Schema.F_SERVICE_ID] = struct.unpack_from(">H", raw, offset)[0]
+            offset += 2
+        elif mtype == Schema.TYPE_QUERY_RESULT:
+            sid, count = struct.unpack_from(">HB", raw, offset)
+            offset += 3
+            if offset + count * _MAC_BYTES > len(raw):
+                raise BinaryWireError("truncated provider list")
+            msg[Schema.F_SERVICE_ID] = sid
+            msg[Schema.F_PROVIDERS] = [
+                mac_to_node_id(raw[offset + i * _MAC_BYTES:offset + (i + 1) * _MAC_BYTES])
+                for i in range(count)
+            ]
+            offset += count * _MAC_BYTES
+        elif mtype == Schema.TYPE_GET_PROFILE:
+            if len(raw) < offset + _MAC_BYTES:
+                raise BinaryWireError("truncated target id")
+            msg[Schema.F_TARGET] = mac_to_node_id(raw[offset:offset + _MAC_BYTES])
+            offset += _MAC_BYTES
+        elif mtype == Schema.TYPE_TELEMETRY:
+            _decode_telemetry(raw, offset, msg)
+        elif mtype == Schema.TYPE_CALL:
+            sid, request_id, deadline = struct.unpack_from(">HHH", raw, offset)
+            offset += 6
+            msg[Schema.F_SERVICE_ID] = sid
+            msg[Schema.F_REQUEST_ID] = request_id
+            if deadline:
+                msg[Schema.F_DEADLINE] = deadline
+            if offset < len(raw):
+                msg[Schema.F_ARGS], offset = _unpack_value(raw, offset, 0)
+        elif mtype == Schema.TYPE_CALL_REPLY:
+            request_id, status = struct.unpack_from(">HB", raw, offset)
+            offset += 3
+            msg[Schema.F_REQUEST_ID] = request_id
+            if status:
+                msg[Schema.F_ERROR], offset = _unpack_value(raw, offset, 0)
+            if offset < len(raw):
+                msg[Schema.F_RESULT], offset = _unpack_value(raw, offset, 0)
+        if mtype in _REQUEST_ID_TYPES and len(raw) >= offset + 2:
+            msg[Schema.F_REQUEST_ID] = struct.unpack_from(">H", raw, offset)[0]
+    except BinaryWireError:
+        raise
+    except Exception as exc:
+        # struct.error is not a ValueError on CPython.
+        raise BinaryWireError("malformed binary '{}' frame: {}".format(mtype, exc))
+    return msg
+
+
+def telemetry_sample_bytes(sample, previous, encoding):
+    """Encoded size of one sample (a sequence of ints) following previous."""
+    if encoding == TELEMETRY_RAW16:
+        return 2 * len(sample)
+    size = 0
+    for channel, value in enumerate(sample):
+        if previous is not None:
+            value -= previous[channel]
+        size += _varint_size(_zigzag(value))
+    return size
+
+
+def _encode_telemetry(msg):
+    samples = msg[Schema.F_SAMPLES]
+    encoding = msg.get(Schema.F_ENCODING, TELEMETRY_DELTA)
+    channels = len(samples[0]) if samples else 0
+    _check_count(len(samples))
+    _check_count(channels)
+    head = struct.pack(
+        _TELEMETRY_HEAD,
+        msg[Schema.F_STREAM],
+        msg[Schema.F_SEQ],
+        msg[Schema.F_TIME_BASE],
+        msg[Schema.F_PERIOD_US],
+        msg.get(Schema.F_FRAC_BITS, 0),
+        encoding,
+        channels,
+        len(samples),
+    )
+    if encoding == TELEMETRY_RAW16:
+        flat = []
+        for sample in samples:
+            flat.extend(sample)
+        try:
+            return head + struct.pack(">{}h".format(len(flat)), *flat)
+        except Exception:
+            raise BinaryWireError("raw16 telemetry values must fit in int16")
+    if encoding != TELEMETRY_DELTA:
+        raise BinaryWireError("unknown telemetry encoding {}".format(encoding))
+    out = bytearray(head)
+    previous = None
+    for sample in samples:
+        for channel, value in enumerate(sample):
+            _write_varint(out, _zigzag(value - previous[channel] if previous is not None else value))
+        previous = sample
+    return bytes(out)
+
+
+def _decode_telemetry(raw, offset, msg):
+    stream, seq, time_base, period_us, frac_bits, encoding, channels, count = struct.unpack_from(
+        _TELEMETRY_HEAD, raw, offset
+    )
+    offset += _TELEMETRY_HEAD_BYTES
+    msg[Schema.F_STREAM] = stream
+    msg[Schema.F_SEQ] = seq
+    msg[Schema.F_TIME_BASE] = time_base
+    msg[Schema.F_PERIOD_US] = period_us
+    msg[Schema.F_FRAC_BITS] = frac_bits
+    msg[Schema.F_ENCODING] = encoding
+    samples = []
+    if encoding == TELEMETRY_RAW16:
+        total = channels * count
+        if offset + 2 * total > len(raw):
+            raise BinaryWireError("truncated telemetry block")
+        flat = struct.unpack_from(">{}h".format(total), raw, offset)
+        for index in range(count):
+            samples.append(list(flat[index * channels:(index + 1) * channels]))
+    elif encoding == TELEMETRY_DELTA:
+        previous = None
+        for _ in range(count):
+            sample = []
+            for channel in range(channels):
+                value, offset = _read_varint(raw, offset)
+                value = _unzigzag(value)
+                if previous is not None:
+                    value += previous[channel]
+                sample.append(value)
+            samples.append(sample)
+            previous = sample
+    else:
+        raise BinaryWireError("unknown telemetry encoding {}".format(encoding))
+    msg[Schema.F_SAMPLES] = samples
+
+
+def _pack_value(out, value, depth):
+    if depth > _MAX_DEPTH:
+        raise BinaryWireError("packed value nested too deeply")
+    if value is None:
+        out.append(_TAG_NONE)
+    elif value is True:
+        out.append(_TAG_TRUE)
+    elif value is False:
+        out.append(_TAG_FALSE)
+    elif isinstance(value, int):
+        out.append(_TAG_INT)
+        _write_varint(out, _zigzag(value))
+    elif isinstance(value, float):
+        out.append(_TAG_FLOAT)
+        out.extend(struct.pack(">f", value))
+    elif isinstance(value, str):
+        out.append(_TAG_STR)
+        _pack_str(out, value)
+    elif isinstance(value, (list, tuple)):
+        out.append(_TAG_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _pack_value(out, item, depth + 1)
+    elif isinstance(value, dict):
+        out.append(_TAG_DICT)
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            _pack_str(out, str(key))
+            _pack_value(out, item, depth + 1)
+    else:
+        raise BinaryWireError("cannot pack value of type {}".format(type(value).__name__))
+
+
+def _pack_str(out, text):
+    data = text.encode("utf-8")
+    _write_varint(out, len(data))
+    out.extend(data)
+
+
+def _unpack_value(raw, offset, depth):
+    if depth > _MAX_DEPTH:
+        raise BinaryWireError("packed value nested too deeply")
+    if offset >= len(raw):
+        raise BinaryWireError("truncated packed value")
+    tag = raw[offset]
+    offset += 1
+    if tag == _TAG_NONE:
+        return None, offset
+    if tag == _TAG_FALSE:
+        return False, offset
+    if tag == _TAG_TRUE:
+        return True, offset
+    if tag == _TAG_INT:
+        value, offset = _read_varint(raw, offset)
+        return _unzigzag(value), offset
+    if tag == _TAG_FLOAT:
+        return struct.unpack_from(">f", raw, offset)[0], offset + 4
+    if tag == _TAG_STR:
+        return _unpack_str(raw, offset)
+    if tag == _TAG_LIST:
+        count, offset = _read_varint(raw, offset)
+        items = []
+        for _ in range(count):
+            item, offset = _unpack_value(raw, offset, depth + 1)
+            items.append(item)
+        return items, offset
+    if tag == _TAG_DICT:
+        count, offset = _read_varint(raw, offset)
+        items = {}
+        for _ in range(count):
+            key, offset = _unpack_str(raw, offset)
+            items[key], offset = _unpack_value(raw, offset, depth + 1)
+        return items, offset
+    raise BinaryWireError("unknown packed value tag {}".format(tag))
+
+
+def _unpack_str(raw, offset):
+    size, offset = _read_varint(raw, offset)
+    if offset + size > len(raw):
+        raise BinaryWireError("truncated packed string")
+    return bytes(raw[offset:offset + size]).decode(), offset + size
+
+
+def _zigzag(value):
+    return (value << 1) ^ -1 if value < 0 else value << 1
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _varint_size(value):
+    size = 1
+    while value >= 0x80:
+        value >>= 7
+        size += 1
+    return size
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(raw, offset):
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(raw):
+            raise BinaryWireError("truncated telemetry varint")
+        byte = raw[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _check_count(count):
+    if count > _MAX_LIST:
+        raise BinaryWireError("binary lists hold at most {} entries".format(_MAX_LIST))
@@ -1,29 +1,96 @@
 import json
 
+from . import binary
+from . import service_set
 from .schema import Schema
 
 
 MAX_SHORT_PACKET_BYTES = Schema.SHORT_PACKET_MAX_BYTES
 
+# Type peeking looks for '"t":"' near the start of JSON frames.
+PEEK_WINDOW = 32
+_PEEK_KEY_STR = '"{}":"'.format(Schema.F_TYPE)
+_PEEK_KEY_BYTES = _PEEK_KEY_STR.encode("utf-8")
+_PEEK_KEY_LEN = len(_PEEK_KEY_STR)
+
+
+# Profile hashes are normalised to binary.canonical_profile_hash on both
+# encode and decode so JSON and binary peers agree on them.
+_HASH_FIELDS = (Schema.F_PROFILE_HASH, Schema.F_PREV_HASH)
+
 
 class MessageValidationError(ValueError):
     pass
 
 
 class MessageCodec:
-    def __init__(self, max_short_packet_bytes=MAX_SHORT_PACKET_BYTES):
+    """
+    Encode/decode capability messages.
+
+    wire_version picks the default wire form for short messages
+    (Schema.PROTOCOL_VERSION for JSON, PROTOCOL_VERSION_BINARY for packed
+    binary); each encode_* call can override it with version=. Full profiles
+    are always JSON. decode() accepts either form.
+
+    Validators are compiled once from the Schema field tables into a
+    type-keyed dispatch table. validate_outgoing=False skips validating
+    messages the codec builds itself (trusted local callers); decoded
+    messages are always validated.
+    """
+
+    _validators = None
+
+    def __init__(
+        self,
+        max_short_packet_bytes=MAX_SHORT_PACKET_BYTES,
+        wire_version=Schema.PROTOCOL_VERSION,
+        validate_outgoing=True,
+    ):
+        if MessageCodec._validators is None:
+            MessageCodec._validators = self._compile_validators()
         self.max_short_packet_bytes = int(max_short_packet_bytes)
+        self.validate_outgoing = bool(validate_outgoing)
+        if wire_version not in Schema.SUPPORTED_VERSIONS:
+            raise MessageValidationError("unsupported wire version: {}".format(wire_version))
+        self.wire_version = wire_version
 
-    def encode_advertise(self, node_id, profile_hash, service_ids):
+    def encode_advertise(self, node_id, profile_hash, service_ids, version=None):
+        """
+        JSON advertisements carry the smallest exact service set encoding
+        (plain, ranges or bitmap) and fall back to a Bloom digest sized to
+        the packet budget when no exact form fits. Binary advertisements
+        list every id, so sets too large for that are sent as JSON.
+        """
+        service_ids = list(service_ids)
         msg = {
-            Schema.F_VERSION: Schema.PROTOCOL_VERSION,
+            Schema.F_VERSION: version or self.wire_version,
             Schema.F_TYPE: Schema.TYPE_ADVERTISE,
             Schema.F_NODE_ID: str(node_id),
-            Schema.F_PROFILE_HASH: str(profile_hash),
-            Schema.F_SERVICES: list(service_ids),
+            Schema.F_PROFILE_HASH: binary.canonical_profile_hash(str(profile_hash)),
+            Schema.F_SERVICES: service_ids,
         }
-        self.validate(msg)
+        self._validate_outgoing(msg)
+        if msg[Schema.F_VERSION] == Schema.PROTOCOL_VERSION_BINARY:
+            try:
+                encoded = self.dumps(msg)
+            except MessageValidationError:
+                encoded = None
+            if encoded is None or len(encoded) > self.max_short_packet_bytes:
+                # Binary lists every id; large sets fall back to the JSON
+                # form, whose compact and Bloom encodings fit the budget.
+                return self.encode_advertise(node_id, profile_hash, service_ids, version=Schema.PROTOCOL_VERSION)
+            return encoded
+        msg[Schema.F_SERVICES] = service_set.compact(service_ids)
         encoded = self.dumps(msg)
+        if len(encoded) > self.max_short_packet_bytes:
+            services_len = len(self.dumps(msg[Schema.F_SERVICES]))
+            budget = self.max_short_packet_bytes - (len(encoded) - services_len)
+            try:
+                msg[Schema.F_SERVICES] = service_set.encode_bloom(service_ids, budget)
+            except ValueError:
+                pass
+            else:
+                encoded = self.dumps(msg)
         if len(encoded) > self.max_short_packet_bytes:
             raise MessageValidationError(
                 "short advertise exceeds {} bytes (got {})".format(
@@ -32,35 +99,41 @@ class MessageCodec:
             )
         return encoded
 
-    def encode_query(self, node_id, service_id):
+    def encode_query(self, node_id, service_id, version=None, request_id=None):
         msg = {
-            Schema.F_VERSION: Schema.PROTOCOL_VERSION,
+            Schema.F_VERSION: version or self.wire_version,
             Schema.F_TYPE: Schema.TYPE_QUERY,
             Schema.F_NODE_ID: str(node_id),
             Schema.F_SERVICE_ID: int(service_id),
         }
-        self.validate(msg)
+        if request_id is not None:
+            msg[Schema.F_REQUEST_ID] = int(request_id)
+        self._validate_outgoing(msg)
         return self.dumps(msg)
 
-    def encode_query_result(self, node_id, service_id, providers):
+    def encode_query_result(self, node_id, service_id, providers, version=None, request_id=None):
         msg = {
-            Schema.F_VERSION: Schema.PROTOCOL_VERSION,
+            Schema.F_VERSION: version or self.wire_version,
             Schema.F_TYPE: Schema.TYPE_QUERY_RESULT,
             Schema.F_NODE_ID: str(node_id),
             Schema.F_SERVICE_ID: int(service_id),
             Schema.F_PROVIDERS: [str(p) for p in providers],
         }
-        self.validate(msg)
+        if request_id is not None:
+            msg[Schema.F_REQUEST_ID] = int(request_id)
+        self._validate_outgoing(msg)
         return self.dumps(msg)
 
-    def encode_get_profile(self, node_id, target_node_id):
+    def encode_get_profile(self, node_id, target_node_id, version=None, request_id=None):
         msg = {
-            Schema.F_VERSION: Schema.PROTOCOL_VERSION,
+            Schema.F_VERSION: version or self.wire_version,
             Schema.F_TYPE: Schema.TYPE_GET_PROFILE,
             Schema.F_NODE_ID: str(node_id),
             Schema.F_TARGET: str(target_node_id),
         }
-        self.validate(msg)
+        if request_id is not None:
+            msg[Schema.F_REQUEST_ID] = int(request_id)
+        self._validate_outgoing(msg)
         return self.dumps(msg)
 
     def encode_profile(
@@ -72,12 +145,13 @@ class MessageCodec:
         role=None,
         firmware=None,
         meta=None,
+        request_id=None,
     ):
         msg = {
             Schema.F_VERSION: Schema.PROTOCOL_VERSION,
             Schema.F_TYPE: Schema.TYPE_PROFILE,
             Schema.F_NODE_ID: str(node_id),
-            Schema.F_PROFILE_HASH: str(profile_hash),
+            Schema.F_PROFILE_HASH: binary.canonical_profile_hash(str(profile_hash)),
             Schema.F_SERVICES: list(services),
         }
         if name is not None:
@@ -90,123 +164,413 @@ class MessageCodec:
             if not isinstance(meta, dict):
                 raise MessageValidationError("meta must be a dict")
             msg[Schema.F_META] = meta
-        self.validate(msg)
+        if request_id is not None:
+            msg[Schema.F_REQUEST_ID] = int(request_id)
+        self._validate_outgoing(msg)
+        return self.dumps(msg)
+
+    def encode_profile_delta(
+        self,
+        node_id,
+        prev_hash,
+        profile_hash,
+        added=None,
+        changed=None,
+        removed=None,
+        meta_set=None,
+        meta_removed=None,
+        name=None,
+        role=None,
+        firmware=None,
+        cleared=None,
+    ):
+        """
+        Encode the changes turning profile prev_hash into profile_hash.
+        added/changed hold full service entries, removed holds service ids;
+        changed entries replace the entry with the same id. cleared names
+        the long fields (Schema.F_NODE_NAME, F_ROLE, F_FIRMWARE) to unset.
+        """
+        msg = {
+            Schema.F_VERSION: Schema.PROTOCOL_VERSION,
+            Schema.F_TYPE: Schema.TYPE_PROFILE_DELTA,
+            Schema.F_NODE_ID: str(node_id),
+            Schema.F_PROFILE_HASH: binary.canonical_profile_hash(str(profile_hash)),
+            Schema.F_PREV_HASH: binary.canonical_profile_hash(str(prev_hash)),
+        }
+        if name is not None:
+            msg[Schema.F_NODE_NAME] = str(name)
+        if role is not None:
+            msg[Schema.F_ROLE] = str(role)
+        if firmware is not None:
+            msg[Schema.F_FIRMWARE] = str(firmware)
+        if added:
+            msg[Schema.F_SERVICES_ADDED] = list(added)
+        if changed:
+            msg[Schema.F_SERVICES_CHANGED] = list(changed)
+        if removed:
+            msg[Schema.F_SERVICES_REMOVED] = [int(sid) for sid in removed]
+        if meta_set:
+            msg[Schema.F_META_SET] = dict(meta_set)
+        if meta_removed:
+            msg[Schema.F_META_REMOVED] = [str(key) for key in meta_removed]
+        if cleared:
+            msg[Schema.F_CLEARED] = [str(field) for field in cleared]
+        self._validate_outgoing(msg)
+        return self.dumps(msg)
+
+    def encode_gossip_digest(self, node_id, digest):
+        return self._encode_json(Schema.TYPE_GOSSIP_DIGEST, node_id, Schema.F_DIGEST, str(digest))
+
+    def encode_gossip_pull(self, node_id, buckets, target=None):
+        """target names the node that should answer a broadcast pull."""
+        msg = {
+            Schema.F_VERSION: Schema.PROTOCOL_VERSION,
+            Schema.F_TYPE: Schema.TYPE_GOSSIP_PULL,
+            Schema.F_NODE_ID: str(node_id),
+            Schema.F_BUCKETS: int(buckets),
+        }
+        if target is not None:
+            msg[Schema.F_TARGET] = str(target)
+        self._validate_outgoing(msg)
+        return self.dumps(msg)
+
+    def encode_gossip_entries(self, node_id, entries):
+        """entries: [node_id, profile_hash, age_ms, service set encoding] lists."""
+        return self._encode_json(Schema.TYPE_GOSSIP_ENTRIES, node_id, Schema.F_ENTRIES, list(entries))
+
+    def encode_subscribe(self, node_id, topics, lease_s):
+        """Subscribe to topics for lease_s seconds; a lease of 0 unsubscribes."""
+        msg = {
+            Schema.F_VERSION: Schema.PROTOCOL_VERSION,
+            Schema.F_TYPE: Schema.TYPE_SUBSCRIBE,
+            Schema.F_NODE_ID: str(node_id),
+            Schema.F_TOPICS: [str(topic) for topic in topics],
+            Schema.F_LEASE: int(lease_s),
+        }
+        self._validate_outgoing(msg)
+        return self.dumps(msg)
+
+    def encode_publish(self, node_id, events):
+        """events: [topic, payload] lists; payload is any JSON value."""
+        return self._encode_json(Schema.TYPE_PUBLISH, node_id, Schema.F_EVENTS, list(events))
+
+    def encode_telemetry(
+        self,
+        node_id,
+        stream,
+        seq,
+        time_base_ms,
+        period_us,
+        samples,
+        frac_bits=0,
+        encoding=None,
+        version=Schema.PROTOCOL_VERSION_BINARY,
+    ):
+        """
+        Block of samples (lists of ints, one value per channel). Telemetry
+        defaults to the binary form whatever wire_version is; encoding picks
+        binary.TELEMETRY_DELTA (default) or TELEMETRY_RAW16.
+        """
+        msg = {
+            Schema.F_VERSION: version,
+            Schema.F_TYPE: Schema.TYPE_TELEMETRY,
+            Schema.F_NODE_ID: str(node_id),
+            Schema.F_STREAM: int(stream),
+            Schema.F_SEQ: int(seq) & 0xFFFF,
+            Schema.F_TIME_BASE: int(time_base_ms) & (binary.TELEMETRY_TICKS_PERIOD - 1),
+            Schema.F_PERIOD_US: int(period_us),
+            Schema.F_SAMPLES: samples,
+        }
+        if frac_bits:
+            msg[Schema.F_FRAC_BITS] = int(frac_bits)
+        if encoding is not None:
+            msg[Schema.F_ENCODING] = int(encoding)
+        self._validate_outgoing(msg)
+        encoded = self.dumps(msg)
+        if len(encoded) > self.max_short_packet_bytes:
+            raise MessageValidationError(
+                "telemetry block exceeds {} bytes (got {})".format(self.max_short_packet_bytes, len(encoded))
+            )
+        return encoded
+
+    def encode_call(self, node_id, service_id, request_id, args=None, deadline_ms=None, version=None):
+        """args is any JSON value; deadline_ms is the caller's remaining budget."""
+        msg = {
+            Schema.F_VERSION: version or self.wire_version,
+            Schema.F_TYPE: Schema.TYPE_CALL,
+            Schema.F_NODE_ID: str(node_id),
+            Schema.F_SERVICE_ID: int(service_id),
+            Schema.F_REQUEST_ID: int(request_id),
+        }
+        if args is not None:
+            msg[Schema.F_ARGS] = args
+        if deadline_ms is not None:
+            msg[Schema.F_DEADLINE] = max(1, min(0xFFFF, int(deadline_ms)))
+        self._validate_outgoing(msg)
+        return self.dumps(msg)
+
+    def encode_call_reply(self, node_id, request_id, result=None, error=None, version=None):
+        """A reply carries result, or an error code with result as optional detail."""
+        msg = {
+            Schema.F_VERSION: version or self.wire_version,
+            Schema.F_TYPE: Schema.TYPE_CALL_REPLY,
+            Schema.F_NODE_ID: str(node_id),
+            Schema.F_REQUEST_ID: int(request_id),
+        }
+        if result is not None:
+            msg[Schema.F_RESULT] = result
+        if error is not None:
+            msg[Schema.F_ERROR] = str(error)
+        self._validate_outgoing(msg)
+        return self.dumps(msg)
+
+    def _encode_json(self, mtype, node_id, field, value):
+        msg = {
+            Schema.F_VERSION: Schema.PROTOCOL_VERSION,
+            Schema.F_TYPE: mtype,
+            Schema.F_NODE_ID: str(node_id),
+            field: value,
+        }
+        self._validate_outgoing(msg)
         return self.dumps(msg)
 
     def decode(self, raw):
-        if isinstance(raw, bytes):
-            raw = raw.decode("utf-8")
+        if isinstance(raw, (bytes, bytearray)):
+            if raw and raw[0] == Schema.PROTOCOL_VERSION_BINARY:
+                try:
+                    msg = binary.decode(raw)
+                except binary.BinaryWireError as exc:
+                    raise MessageValidationError(str(exc))
+                self.validate(msg)
+                return msg
+            raw = bytes(raw).decode("utf-8")
+        # Cheap pre-check; leading whitespace is valid JSON and still allowed.
+        head = raw[:1]
+        if head != "{" and (not head or raw.lstrip()[:1] != "{"):
+            raise MessageValidationError("message must be a JSON object")
         msg = json.loads(raw)
         self.validate(msg)
+        for field in _HASH_FIELDS:
+            if field in msg:
+                msg[field] = binary.canonical_profile_hash(msg[field])
         return msg
 
+    def peek_type(self, raw):
+        """
+        Read the message type from raw bytes without parsing the message.
+
+        Binary frames carry it in byte 1. JSON frames are scanned for the
+        "t" key within the first PEEK_WINDOW bytes, where this codec always
+        emits it; returns None when it cannot be found cheaply or the match
+        is inside a nested object.
+        """
+        if isinstance(raw, str):
+            head = raw[:PEEK_WINDOW]
+            index = head.find(_PEEK_KEY_STR)
+            if index < 0 or index + _PEEK_KEY_LEN >= len(raw) or head.count("{", 0, index) != 1:
+                return None
+            return raw[index + _PEEK_KEY_LEN]
+        if len(raw) < 2:
+            return None
+        if raw[0] == Schema.PROTOCOL_VERSION_BINARY:
+            return chr(raw[1])
+        head = bytes(raw[:PEEK_WINDOW])
+        index = head.find(_PEEK_KEY_BYTES)
+        if index < 0 or index + _PEEK_KEY_LEN >= len(raw) or head.count(b"{", 0, index) != 1:
+            return None
+        return chr(raw[index + _PEEK_KEY_LEN])
+
     def dumps(self, msg):
+        if isinstance(msg, dict) and msg.get(Schema.F_VERSION) == Schema.PROTOCOL_VERSION_BINARY:
+            try:
+                return binary.encode(msg)
+            except binary.BinaryWireError as exc:
+                raise MessageValidationError(str(exc))
         # separators remove all whitespace to minimize packet size.
         return json.dumps(msg, separators=(",", ":"))
 
     def validate(self, msg):
+        # Checks run cheapest first so malformed frames are rejected early.
         if not isinstance(msg, dict):
             raise MessageValidationError("message must be a JSON object")
-
-        self._validate_common(msg)
-        mtype = msg[Schema.F_TYPE]
-        if mtype == Schema.TYPE_ADVERTISE:
-            self._validate_advertise(msg)
-        elif mtype == Schema.TYPE_QUERY:
-            self._validate_query(msg)
-        elif mtype == Schema.TYPE_QUERY_RESULT:
-            self._validate_query_result(msg)
-        elif mtype == Schema.TYPE_GET_PROFILE:
-            self._validate_get_profile(msg)
-        elif mtype == Schema.TYPE_PROFILE:
-            self._validate_profile(msg)
-        else:
-            raise MessageValidationError("unsupported message type: {}".format(mtype))
-
-    def _validate_common(self, msg):
-        for key in (Schema.F_VERSION, Schema.F_TYPE, Schema.F_NODE_ID):
+        mtype = msg.get(Schema.F_TYPE)
+        compiled = self._validators.get(mtype) if isinstance(mtype, str) else None
+        if compiled is None:
+            if Schema.F_TYPE not in msg:
+                raise MessageValidationError("missing field '{}'".format(Schema.F_TYPE))
+            raise MessageValidationError("unsupported message type: {}".format(msg[Schema.F_TYPE]))
+        if msg.get(Schema.F_VERSION) not in Schema.SUPPORTED_VERSIONS:
+            if Schema.F_VERSION not in msg:
+                raise MessageValidationError("missing field '{}'".format(Schema.F_VERSION))
+            raise MessageValidationError("unsupported version: {}".format(msg[Schema.F_VERSION]))
+        required, checks, optional = compiled
+        for key in required:
             if key not in msg:
                 raise MessageValidationError("missing field '{}'".format(key))
-        if msg[Schema.F_VERSION] != Schema.PROTOCOL_VERSION:
-            raise MessageValidationError(
-                "unsupported version: {}".format(msg[Schema.F_VERSION])
-            )
-        if not isinstance(msg[Schema.F_TYPE], str):
-            raise MessageValidationError("field '{}' must be a string".format(Schema.F_TYPE))
-        if not isinstance(msg[Schema.F_NODE_ID], str) or not msg[Schema.F_NODE_ID]:
-            raise MessageValidationError(
-                "field '{}' must be a non-empty string".format(Schema.F_NODE_ID)
-            )
+        for key, check, error in checks:
+            if not check(msg[key]):
+                raise MessageValidationError(error)
+        for key, check, error in optional:
+            if key in msg and not check(msg[key]):
+                raise MessageValidationError(error)
 
-    def _validate_advertise(self, msg):
-        for key in Schema.SHORT_ADVERTISE_SCHEMA["required"]:
-            if key not in msg:
-                raise MessageValidationError("missing field '{}'".format(key))
-        self._validate_service_ids(msg[Schema.F_SERVICES])
-        if not isinstance(msg[Schema.F_PROFILE_HASH], str):
-            raise MessageValidationError(
-                "field '{}' must be a string".format(Schema.F_PROFILE_HASH)
-            )
+    def _validate_outgoing(self, msg):
+        if self.validate_outgoing:
+            self.validate(msg)
 
-    def _validate_query(self, msg):
-        for key in Schema.QUERY_SCHEMA["required"]:
-            if key not in msg:
-                raise MessageValidationError("missing field '{}'".format(key))
-        self._validate_service_id(msg[Schema.F_SERVICE_ID])
+    @classmethod
+    def _compile_validators(cls):
+        """Build {type: (required, checks, optional)} once from Schema."""
+        table = {}
+        for schema in Schema.MESSAGE_SCHEMAS:
+            required = tuple(k for k in schema["required"] if k not in (Schema.F_VERSION, Schema.F_TYPE))
+            checks = [(Schema.F_NODE_ID,) + cls._compile_kind(Schema.F_NODE_ID, Schema.KIND_ID)]
+            for key, kind in schema["fields"]:
+                checks.append((key,) + cls._compile_kind(key, kind))
+            optional = tuple((key,) + cls._compile_kind(key, kind) for key, kind in schema.get("optional", ()))
+            table[schema["type"]] = (required, tuple(checks), optional)
+        return table
 
-    def _validate_query_result(self, msg):
-        for key in Schema.QUERY_RESULT_SCHEMA["required"]:
-            if key not in msg:
-                raise MessageValidationError("missing field '{}'".format(key))
-        self._validate_service_id(msg[Schema.F_SERVICE_ID])
-        providers = msg[Schema.F_PROVIDERS]
-        if not isinstance(providers, list):
-            raise MessageValidationError(
-                "field '{}' must be an array".format(Schema.F_PROVIDERS)
+    @staticmethod
+    def _compile_kind(key, kind):
+        if kind == Schema.KIND_STR:
+            return _is_str, "field '{}' must be a string".format(key)
+        if kind == Schema.KIND_ID:
+            return _is_id, "field '{}' must be a non-empty string".format(key)
+        if kind == Schema.KIND_SERVICE_ID:
+            return _is_service_id, "field '{}' must be a uint16 service id".format(key)
+        if kind == Schema.KIND_SERVICE_IDS:
+            return _is_service_ids, "field '{}' must be a non-empty array of uint16 service ids".format(key)
+        if kind == Schema.KIND_SERVICE_SET:
+            return service_set.is_valid, "field '{}' must be a service id array, range list, bitmap or digest".format(key)
+        if kind == Schema.KIND_NODE_IDS:
+            return _is_node_ids, "field '{}' must be an array of non-empty strings".format(key)
+        if kind == Schema.KIND_PROFILE_SERVICES:
+            return _is_profile_services, "field '{}' must be an array of objects with a uint16 '{}'".format(
+                key, Schema.F_SERVICE_ID
             )
-        for provider in providers:
-            if not isinstance(provider, str) or not provider:
-                raise MessageValidationError("provider ids must be non-empty strings")
+        if kind == Schema.KIND_OBJECT:
+            return _is_object, "field '{}' must be an object".format(key)
+        if kind == Schema.KIND_REQUEST_ID:
+            return _is_uint16, "field '{}' must be a uint16 request id".format(key)
+        if kind == Schema.KIND_UINT16:
+            return _is_uint16, "field '{}' must be a uint16".format(key)
+        if kind == Schema.KIND_GOSSIP_ENTRIES:
+            return _is_gossip_entries, "field '{}' must be an array of [node_id, hash, age_ms, services]".format(key)
+        if kind == Schema.KIND_UINT8:
+            return _is_uint8, "field '{}' must be a uint8".format(key)
+        if kind == Schema.KIND_UINT32:
+            return _is_uint32, "field '{}' must be a uint32".format(key)
+        if kind == Schema.KIND_SAMPLES:
+            return _is_samples, "field '{}' must be a non-empty array of equal-length int arrays".format(key)
+        if kind == Schema.KIND_ANY:
+            return _is_any, "field '{}' must be a JSON value".format(key)
+        if kind == Schema.KIND_EVENTS:
+            return _is_events, "field '{}' must be an array of [topic, payload]".format(key)
+        raise ValueError("unknown schema field kind: {}".format(kind))
 
-    def _validate_get_profile(self, msg):
-        for key in Schema.GET_PROFILE_SCHEMA["required"]:
-            if key not in msg:
-                raise MessageValidationError("missing field '{}'".format(key))
-        if not isinstance(msg[Schema.F_TARGET], str) or not msg[Schema.F_TARGET]:
-            raise MessageValidationError("field '{}' must be a non-empty string".format(Schema.F_TARGET))
 
-    def _validate_profile(self, msg):
-        for key in Schema.PROFILE_SCHEMA["required"]:
-            if key not in msg:
-                raise MessageValidationError("missing field '{}'".format(key))
-        if not isinstance(msg[Schema.F_PROFILE_HASH], str):
-            raise MessageValidationError(
-                "field '{}' must be a string".format(Schema.F_PROFILE_HASH)
-            )
-        services = msg[Schema.F_SERVICES]
-        if not isinstance(services, list):
-            raise MessageValidationError(
-                "field '{}' must be an array".format(Schema.F_SERVICES)
-            )
-        for entry in services:
-            if not isinstance(entry, dict):
-                raise MessageValidationError(
-                    "profile services must be objects with details"
-                )
-            if Schema.F_SERVICE_ID not in entry:
-                raise MessageValidationError(
-                    "profile service entry missing '{}'".format(Schema.F_SERVICE_ID)
-                )
-            self._validate_service_id(entry[Schema.F_SERVICE_ID])
-
-    def _validate_service_ids(self, service_ids):
-        if not isinstance(service_ids, list) or not service_ids:
-            raise MessageValidationError("field '{}' must be a non-empty array".format(Schema.F_SERVICES))
-        for value in service_ids:
-            self._validate_service_id(value)
-
-    def _validate_service_id(self, service_id):
-        if not isinstance(service_id, int):
-            raise MessageValidationError("service id must be an int")
-        if service_id < 0 or service_id > 65535:
-            raise MessageValidationError("service id out of uint16 range")
+def _is_str(value):
+    return isinstance(value, str)
+
+
+def _is_id(value):
+    return isinstance(value, str) and len(value) > 0
+
+
+def _is_object(value):
+    return isinstance(value, dict)
+
+
+def _is_service_id(value):
+    return isinstance(value, int) and 0 <= value <= 65535
+
+
+def _is_uint16(value):
+    return isinstance(value, int) and 0 <= value <= 65535
+
+
+def _is_gossip_entries(value):
+    if not isinstance(value, list):
+        return False
+    for entry in value:
+        if not isinstance(entry, list) or len(entry) != 4:
+            return False
+        node_id, profile_hash, age_ms, services = entry
+        if not isinstance(node_id, str) or not node_id or not isinstance(profile_hash, str):
+            return False
+        if not isinstance(age_ms, int) or age_ms < 0:
+            return False
+        if services != [] and not service_set.is_valid(services):
+            return False
+    return True
+
+
+def _is_any(value):
+    return True
+
+
+def _is_uint8(value):
+    return isinstance(value, int) and 0 <= value <= 255
+
+
+def _is_uint32(value):
+    return isinstance(value, int) and 0 <= value <= 0xFFFFFFFF
+
+
+def _is_samples(value):
+    if not isinstance(value, list) or not value:
+        return False
+    width = None
+    for sample in value:
+        if not isinstance(sample, list) or not sample:
+            return False
+        if width is None:
+            width = len(sample)
+        elif len(sample) != width:
+            return False
+        for item in sample:
+            if not isinstance(item, int):
+                return False
+    return True
+
+
+def _is_events(value):
+    if not isinstance(value, list):
+        return False
+    for event in value:
+        if not isinstance(event, list) or len(event) != 2:
+            return False
+        if not isinstance(event[0], str) or not event[0]:
+            return False
+    return True
+
+
+def _is_service_ids(value):
+    if not isinstance(value, list) or not value:
+        return False
+    for service_id in value:
+        if not isinstance(service_id, int) or service_id < 0 or service_id > 65535:
+            return False
+    return True
+
+
+def _is_node_ids(value):
+    if not isinstance(value, list):
+        return False
+    for node_id in value:
+        if not isinstance(node_id, str) or not node_id:
+            return False
+    return True
+
+
+def _is_profile_services(value):
+    if not isinstance(value, list):
+        return False
+    for entry in value:
+        if not isinstance(entry, dict):
+            return False
+        service_id = entry.get(Schema.F_SERVICE_ID)
+        if not isinstance(service_id, int) or service_id < 0 or service_id > 65535:
+            return False
+    return True
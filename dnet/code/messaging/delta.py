@@ -0,0 +1,61 @@
+"""
+Profile delta computation.
+
+Profiles here are wire-form dicts keyed by Schema field names, as loaded
+from profile.json or received in a full profile message.
+"""
+
+from .schema import Schema
+
+
+_MISSING = object()
+
+
+def diff_profiles(old, new):
+    """Return MessageCodec.encode_profile_delta kwargs turning old into new."""
+    old_services = _services_by_id(old)
+    new_services = _services_by_id(new)
+    added = []
+    changed = []
+    for service_id, entry in new_services.items():
+        previous = old_services.get(service_id)
+        if previous is None:
+            added.append(entry)
+        elif previous != entry:
+            changed.append(entry)
+    removed = [service_id for service_id in old_services if service_id not in new_services]
+
+    old_meta = old.get(Schema.F_META) or {}
+    new_meta = new.get(Schema.F_META) or {}
+    meta_set = {}
+    for key, value in new_meta.items():
+        if old_meta.get(key, _MISSING) != value:
+            meta_set[key] = value
+    meta_removed = [key for key in old_meta if key not in new_meta]
+
+    delta = {
+        "prev_hash": old[Schema.F_PROFILE_HASH],
+        "profile_hash": new[Schema.F_PROFILE_HASH],
+        "added": added,
+        "changed": changed,
+        "removed": removed,
+        "meta_set": meta_set,
+        "meta_removed": meta_removed,
+    }
+    cleared = []
+    for field, kwarg in ((Schema.F_NODE_NAME, "name"), (Schema.F_ROLE, "role"), (Schema.F_FIRMWARE, "firmware")):
+        value = new.get(field)
+        if value is None:
+            if old.get(field) is not None:
+                cleared.append(field)
+        elif value != old.get(field):
+            delta[kwarg] = value
+    delta["cleared"] = cleared
+    return delta
+
+
+def _services_by_id(profile):
+    out = {}
+    for entry in profile.get(Schema.F_SERVICES) or ():
+        out[entry[Schema.F_SERVICE_ID]] = entry
+    return out
@@ -0,0 +1,288 @@
+"""
+Gossip anti-entropy for ServiceRegistry contents.
+
+Every entry (node_id, profile_hash) falls into one of BUCKETS buckets by a
+hash of its node id; a bucket's summary is the XOR of its entries' FNV-1a
+hashes, so it is updated in O(1) from registry watch events. A digest is
+all bucket summaries (64 bytes, base64 in JSON).
+
+Digests are broadcast on a Trickle timer: matching digests suppress
+further broadcasts, a differing one resets the timer and the receiver
+pulls only the differing buckets from the sender. Entries carry their age
+so relayed nodes still expire on schedule and gossip never keeps a dead
+node alive. Each node includes its own profile in its digest, since it is
+in its neighbours' registries but not in its own.
+
+One digest usually differs from several neighbours at once, so pulls wait
+a random delay of up to pull_jitter_ms. Pulls and their answers are
+broadcast, and a pending pull is dropped when another node's pull for the
+same buckets, or entries from the node it would ask, are heard first.
+Relayed entries are second-hand and stay unverified, like snapshot
+restores, until the node itself is heard from.
+"""
+
+try:
+    import utime as time
+except Exception:
+    import time
+try:
+    import uasyncio as asyncio
+except Exception:
+    import asyncio
+try:
+    import ustruct as struct
+except Exception:
+    import struct
+try:
+    import ubinascii
+except Exception:
+    import binascii as ubinascii
+
+import random
+
+from . import binary
+from . import service_set
+from .schema import Schema
+from .trickle import TrickleTimer
+
+
+BUCKETS = 16
+_ALL_BUCKETS = (1 << BUCKETS) - 1
+
+
+class RegistryGossip:
+    """
+    Keeps endpoint.registry in sync with neighbours. Run run() as a task;
+    the endpoint's poll() loop delivers gossip messages to the handlers
+    registered here.
+    """
+
+    DEFAULT_PULL_JITTER_MS = 250
+
+    def __init__(self, endpoint, imin_ms=1000, imax_doublings=6, k=1, pull_jitter_ms=DEFAULT_PULL_JITTER_MS):
+        self.endpoint = endpoint
+        self.registry = endpoint.registry
+        self.timer = TrickleTimer(imin_ms=imin_ms, imax_doublings=imax_doublings, k=k)
+        self.pull_jitter_ms = int(pull_jitter_ms)
+        self._buckets = [0] * BUCKETS
+        # node_id -> (bucket, entry hash) currently folded into _buckets.
+        self._folded = {}
+        # [peer_id, bucket mask, due ticks] of the pull waiting to go out.
+        self._pull = None
+        self.pulls_sent = 0
+        self.pulls_suppressed = 0
+        self.entries_applied = 0
+        for node in self.registry.all_nodes().values():
+            self._fold(node)
+        self.registry.watch(self._on_registry_change)
+        endpoint.register_handler(Schema.TYPE_GOSSIP_DIGEST, self._on_digest)
+        endpoint.register_handler(Schema.TYPE_GOSSIP_PULL, self._on_pull)
+        endpoint.register_handler(Schema.TYPE_GOSSIP_ENTRIES, self._on_entries)
+
+    def digest(self):
+        buckets = list(self._buckets)
+        own = self._own_entry()
+        if own is not None:
+            bucket = _bucket_of(own[0])
+            buckets[bucket] ^= _entry_hash(own[0], own[1])
+        return ubinascii.b2a_base64(struct.pack(">{}I".format(BUCKETS), *buckets)).decode().strip()
+
+    def send_digest(self, peer_id="broadcast"):
+        payload = self.endpoint.codec.encode_gossip_digest(self.endpoint.node_id, self.digest())
+        self.endpoint.transport.send(peer_id, payload)
+        return payload
+
+    def poll(self, now_ms=None):
+        """Send the pending pull once its delay has passed."""
+        pull = self._pull
+        if pull is None:
+            return
+        if now_ms is None:
+            now_ms = self._now_ms()
+        if self._ticks_diff(now_ms, pull[2]) < 0:
+            return
+        self._pull = None
+        self.pulls_sent += 1
+        codec = self.endpoint.codec
+        self.endpoint.transport.send("broadcast", codec.encode_gossip_pull(self.endpoint.node_id, pull[1], pull[0]))
+
+    async def run(self, peer_id="broadcast"):
+        timer = self.timer
+        while True:
+            if timer.poll():
+                self.send_digest(peer_id)
+            self.poll()
+            wait_ms = timer.ms_until_next_event()
+            if self._pull is not None:
+                wait_ms = min(wait_ms, self._ticks_diff(self._pull[2], self._now_ms()))
+            # Re-check at least every imin so a reset() is honoured promptly.
+            wait_ms = min(max(wait_ms, 1), timer.imin_ms)
+            try:
+                await asyncio.sleep_ms(wait_ms)
+            except AttributeError:
+                await asyncio.sleep(wait_ms / 1000.0)
+
+    def _on_registry_change(self, event, node, revision):
+        self._unfold(node.node_id)
+        if event != self.registry.EVENT_EXPIRED:
+            self._fold(node)
+
+    def _fold(self, node):
+        bucket = _bucket_of(node.node_id)
+        value = _entry_hash(node.node_id, node.profile_hash)
+        self._buckets[bucket] ^= value
+        self._folded[node.node_id] = (bucket, value)
+
+    def _unfold(self, node_id):
+        folded = self._folded.pop(node_id, None)
+        if folded is not None:
+            self._buckets[folded[0]] ^= folded[1]
+
+    def _on_digest(self, peer_id, message):
+        theirs = _decode_digest(message[Schema.F_DIGEST])
+        if theirs is None:
+            return
+        ours = _decode_digest(self.digest())
+        mask = 0
+        for bucket in range(BUCKETS):
+            if ours[bucket] != theirs[bucket]:
+                mask |= 1 << bucket
+        if not mask:
+            self.timer.hear_consistent()
+            return
+        self.timer.hear_inconsistent()
+        pull = self._pull
+        if pull is not None and pull[0] == peer_id:
+            pull[1] |= mask
+            return
+        if pull is not None:
+            # Already waiting on another neighbour; its answer may settle this.
+            return
+        delay = (random.getrandbits(16) * self.pull_jitter_ms) >> 16
+        self._pull = [peer_id, mask, self._ticks_add(self._now_ms(), delay)]
+
+    def _on_pull(self, peer_id, message):
+        mask = message[Schema.F_BUCKETS] & _ALL_BUCKETS
+        target = message.get(Schema.F_TARGET)
+        if target is not None and target != self.endpoint.node_id:
+            self._overhear_pull(target, mask)
+            return
+        now_ms = self.registry._now_ms()
+        entries = []
+        own = self._own_entry()
+        if own is not None and mask & (1 << _bucket_of(own[0])):
+            entries.append([own[0], own[1], 0, service_set.compact(own[2]) if own[2] else []])
+        for node in self.registry.all_nodes().values():
+            if not mask & (1 << _bucket_of(node.node_id)):
+                continue
+            ids = list(node.service_ids)
+            entries.append(
+                [
+                    node.node_id,
+                    node.profile_hash,
+                    max(0, now_ms - node.last_seen_ms),
+                    service_set.compact(ids) if ids else [],
+                ]
+            )
+        # Broadcast pulls get broadcast answers so other waiting nodes can
+        # drop their own pulls; untargeted unicast pulls get a unicast answer.
+        self._send_entries("broadcast" if target is not None else peer_id, entries)
+
+    def _overhear_pull(self, target, mask):
+        pull = self._pull
+        if pull is None or pull[0] != target:
+            return
+        pull[1] &= ~mask
+        if not pull[1]:
+            self._pull = None
+            self.pulls_suppressed += 1
+
+    def _send_entries(self, peer_id, entries):
+        # Greedy packing keeps each frame inside the short packet budget.
+        codec = self.endpoint.codec
+        node_id = self.endpoint.node_id
+        batch = []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) > 1 and len(codec.encode_gossip_entries(node_id, batch)) > codec.max_short_packet_bytes:
+                batch.pop()
+                self.endpoint.transport.send(peer_id, codec.encode_gossip_entries(node_id, batch))
+                batch = [entry]
+        if batch:
+            self.endpoint.transport.send(peer_id, codec.encode_gossip_entries(node_id, batch))
+
+    def _on_entries(self, peer_id, message):
+        if self._pull is not None and self._pull[0] == peer_id:
+            # Answer to someone else's pull; the next digest shows whether
+            # anything is still missing.
+            self._pull = None
+            self.pulls_suppressed += 1
+        now_ms = self.registry._now_ms()
+        ttl_ms = self.registry.ttl_ms
+        for node_id, profile_hash, age_ms, services in message[Schema.F_ENTRIES]:
+            if node_id == self.endpoint.node_id or (ttl_ms and age_ms >= ttl_ms):
+                continue
+            seen_at_ms = now_ms - age_ms
+            node = self.registry.get_node(node_id)
+            if node is not None and node.last_seen_ms >= seen_at_ms:
+                # Our own sighting is at least as fresh.
+                continue
+            self.registry.register_advertisement(
+                {
+                    Schema.F_NODE_ID: node_id,
+                    Schema.F_PROFILE_HASH: binary.canonical_profile_hash(profile_hash),
+                    Schema.F_SERVICES: services,
+                },
+                seen_at_ms=seen_at_ms,
+                verified=False,
+            )
+            self.entries_applied += 1
+
+    def _own_entry(self):
+        profile = self.endpoint._local_profile
+        if profile is None:
+            return None
+        return self.endpoint.node_id, profile[Schema.F_PROFILE_HASH], self.endpoint._local_service_ids
+
+    @staticmethod
+    def _now_ms():
+        if hasattr(time, "ticks_ms"):
+            return time.ticks_ms()
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def _ticks_diff(newer, older):
+        if hasattr(time, "ticks_diff"):
+            return time.ticks_diff(newer, older)
+        return newer - older
+
+    @staticmethod
+    def _ticks_add(ticks, delta):
+        if hasattr(time, "ticks_add"):
+            return time.ticks_add(ticks, delta)
+        return ticks + delta
+
+
+def _fnv1a(text):
+    value = 0x811C9DC5
+    for byte in text.encode("utf-8"):
+        value = ((value ^ byte) * 0x01000193) & 0xFFFFFFFF
+    return value
+
+
+def _bucket_of(node_id):
+    return _fnv1a(node_id) % BUCKETS
+
+
+def _entry_hash(node_id, profile_hash):
+    return _fnv1a("{}\x00{}".format(node_id, profile_hash))
+
+
+def _decode_digest(text):
+    try:
+        raw = ubinascii.a2b_base64(text)
+    except Exception:
+        return None
+    if len(raw) != 4 * BUCKETS:
+        return None
+    return struct.unpack(">{}I".format(BUCKETS), raw)
@@ -0,0 +1,169 @@
+"""
+Request/response correlation for MessagingEndpoint.
+
+Requests carry a uint16 request id (Schema.F_REQUEST_ID) that replies
+echo. Outstanding requests live in one table keyed by that id; their
+deadlines share a single min-heap serviced by one timer task, so any
+number of requests can be in flight without a timer each.
+"""
+
+try:
+    import utime as time
+except Exception:
+    import time
+
+try:
+    import uasyncio as asyncio
+except Exception:
+    import asyncio
+
+try:
+    import heapq
+except Exception:
+    import uheapq as heapq
+
+
+class PendingRequest:
+    """
+    One outstanding request. Single-reply requests complete on the first
+    reply; gather requests collect replies until their deadline.
+    """
+
+    __slots__ = ("request_id", "deadline", "gather", "replies", "event", "done")
+
+    def __init__(self, request_id, deadline, gather):
+        self.request_id = request_id
+        self.deadline = deadline
+        self.gather = gather
+        self.replies = []
+        self.event = asyncio.Event()
+        self.done = False
+
+    def reply(self):
+        """First reply message, or None if the request timed out."""
+        return self.replies[0] if self.replies else None
+
+
+class PendingRequests:
+    # Upper bound on one timer sleep so a request opened with an earlier
+    # deadline than the one being slept on is not served late.
+    TIMER_SLICE_MS = 50
+
+    def __init__(self):
+        self._pending = {}
+        self._deadlines = []
+        self._next_id = 0
+        self._timer_running = False
+        # Deadlines use an unwrapped millisecond count so the heap stays
+        # ordered across ticks_ms wraparound.
+        self._last_ticks = self._ticks_ms()
+        self._elapsed_ms = 0
+        self.timeouts = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def open(self, timeout_ms, gather=False):
+        if len(self._pending) >= 0xFFFF:
+            raise RuntimeError("too many outstanding requests")
+        request_id = self._allocate_id()
+        request = PendingRequest(request_id, self._monotonic_ms() + int(timeout_ms), gather)
+        self._pending[request_id] = request
+        heapq.heappush(self._deadlines, (request.deadline, request_id))
+        self._ensure_timer()
+        return request
+
+    def deliver(self, request_id, message):
+        """Attach a reply to its request; False when nothing is waiting for it."""
+        request = self._pending.get(request_id)
+        if request is None:
+            return False
+        request.replies.append(message)
+        if not request.gather:
+            self.close(request)
+        return True
+
+    def close(self, request):
+        """Complete request now (reply, timeout or caller cancelled)."""
+        if request.done:
+            return
+        request.done = True
+        if self._pending.get(request.request_id) is request:
+            del self._pending[request.request_id]
+        request.event.set()
+
+    def expire(self):
+        """Close requests whose deadline has passed; returns how many."""
+        now = self._monotonic_ms()
+        heap = self._deadlines
+        count = 0
+        while heap and heap[0][0] <= now:
+            deadline, request_id = heapq.heappop(heap)
+            request = self._pending.get(request_id)
+            # Stale entries belong to requests that completed early.
+            if request is None or request.deadline != deadline:
+                continue
+            if not request.gather and not request.replies:
+                self.timeouts += 1
+            self.close(request)
+            count += 1
+        return count
+
+    async def wait(self, request):
+        try:
+            await request.event.wait()
+        finally:
+            self.close(request)
+        return request
+
+    def _allocate_id(self):
+        while True:
+            self._next_id = (self._next_id % 0xFFFF) + 1
+            if self._next_id not in self._pending:
+                return self._next_id
+
+    def _ensure_timer(self):
+        if self._timer_running:
+            return
+        self._timer_running = True
+        try:
+            asyncio.create_task(self._run_timer())
+        except Exception:
+            # No running loop: callers fall back to expire() from poll().
+            self._timer_running = False
+
+    async def _run_timer(self):
+        try:
+            while self._pending:
+                self.expire()
+                if not self._deadlines:
+                    break
+                wait_ms = self._deadlines[0][0] - self._monotonic_ms()
+                wait_ms = max(1, min(self.TIMER_SLICE_MS, wait_ms))
+                try:
+                    await asyncio.sleep_ms(wait_ms)
+                except AttributeError:
+                    await asyncio.sleep(wait_ms / 1000.0)
+        finally:
+            self._timer_running = False
+            # Drop heap entries left by requests that finished early.
+            if not self._pending:
+                self._deadlines = []
+
+    def _monotonic_ms(self):
+        ticks = self._ticks_ms()
+        self._elapsed_ms += self._ticks_diff(ticks, self._last_ticks)
+        self._last_ticks = ticks
+        return self._elapsed_ms
+
+    @staticmethod
+    def _ticks_ms():
+        if hasattr(time, "ticks_ms"):
+            return time.ticks_ms()
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def _ticks_diff(newer, older):
+        if hasattr(time, "ticks_diff"):
+            return time.ticks_diff(newer, older)
+        return newer - older
@@ -0,0 +1,85 @@
+"""
+Content-addressed cache of full profiles keyed by profile hash.
+
+A profile hash names the profile content, so boards running identical
+firmware share one entry: a profile fetched from one of them answers for
+all the others advertising the same hash.
+"""
+
+from .schema import Schema
+
+
+# Profile fields that belong to the content rather than to the sender.
+_BODY_FIELDS = (
+    Schema.F_SERVICES,
+    Schema.F_NODE_NAME,
+    Schema.F_ROLE,
+    Schema.F_FIRMWARE,
+    Schema.F_META,
+)
+
+
+class ProfileCache:
+    """Least-recently-used profile bodies, at most max_entries of them."""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = int(max_entries)
+        # profile_hash -> [last_use, body]
+        self._entries = {}
+        self._uses = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, profile_hash):
+        return profile_hash in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, profile_hash):
+        entry = self._entries.get(profile_hash)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._uses += 1
+        entry[0] = self._uses
+        return entry[1]
+
+    def put_message(self, message):
+        """Cache the content of a full profile message."""
+        body = {}
+        for field in _BODY_FIELDS:
+            if field in message:
+                body[field] = message[field]
+        self.put(message[Schema.F_PROFILE_HASH], body)
+
+    def put(self, profile_hash, body):
+        self._uses += 1
+        if profile_hash not in self._entries and len(self._entries) >= self.max_entries:
+            self._evict_oldest()
+        self._entries[profile_hash] = [self._uses, body]
+
+    def profile_message(self, node_id, profile_hash):
+        """A full profile message for node_id built from the cache, or None."""
+        body = self.get(profile_hash)
+        if body is None:
+            return None
+        message = {
+            Schema.F_VERSION: Schema.PROTOCOL_VERSION,
+            Schema.F_TYPE: Schema.TYPE_PROFILE,
+            Schema.F_NODE_ID: node_id,
+            Schema.F_PROFILE_HASH: profile_hash,
+        }
+        message.update(body)
+        return message
+
+    def _evict_oldest(self):
+        oldest_hash = None
+        oldest_use = None
+        for profile_hash, entry in self._entries.items():
+            if oldest_use is None or entry[0] < oldest_use:
+                oldest_hash = profile_hash
+                oldest_use = entry[0]
+        if oldest_hash is not None:
+            del self._entries[oldest_hash]
@@ -1,5 +1,18 @@
+try:
+    import utime as time
+except Exception:
+    import time
+
+try:
+    import uasyncio as asyncio
+except Exception:
+    import asyncio
+
+from . import binary
 from .schema import Schema
 from .codec import MessageCodec
+from .delta import diff_profiles
+from .pending import PendingRequests
 from .registry import ServiceRegistry
 
 
@@ -10,65 +23,473 @@ class MessagingEndpoint:
     Expected transport methods:
     - send(peer_id, payload_str_or_bytes)
     - recv() -> (peer_id, payload_str_or_bytes) or (None, None)
+
+    Transports that support acknowledged delivery also accept
+    send(peer_id, payload, reliable=True); unicast send_* helpers expose this
+    per message through their reliable argument.
+
+    Requests sent by request_profile() and query() carry a request id that
+    replies echo; poll() hands matching replies to the waiting coroutine, so
+    many requests can be outstanding at once.
+
+    query() coalesces concurrent lookups for a service into one broadcast
+    and caches the answer: providers for query_ttl_ms, an empty answer for
+    the shorter query_negative_ttl_ms.
+
+    poll() dispatches each decoded message through a type-code -> handler
+    table; register_handler() adds or replaces handler(peer_id, message).
+    Built-in handlers update the registry, answer queries for the local
+    profile (and from the registry when answer_from_registry is set), and
+    answer get_profile requests addressed to this node.
     """
 
-    def __init__(self, node_id, transport, codec=None, registry=None):
+    QUERY_TTL_MS = 30000
+    QUERY_NEGATIVE_TTL_MS = 5000
+    # Keeps JSON query results inside the short packet budget.
+    QUERY_REPLY_LIMIT = 8
+
+    def __init__(
+        self,
+        node_id,
+        transport,
+        codec=None,
+        registry=None,
+        wanted_types=None,
+        profile_cache=None,
+        answer_from_registry=False,
+    ):
         self.node_id = str(node_id)
         self.transport = transport
         self.codec = codec or MessageCodec()
         self.registry = registry or ServiceRegistry()
+        self.wanted_types = None
+        self.filtered = 0
+        self.query_ttl_ms = self.QUERY_TTL_MS
+        self.query_negative_ttl_ms = self.QUERY_NEGATIVE_TTL_MS
+        self._requests = PendingRequests()
+        # service_id -> [gathering PendingRequest, callers waiting on it] of
+        # the in-flight broadcast.
+        self._inflight_queries = {}
+        # service_id -> (expires_at_ticks, providers tuple).
+        self._query_cache = {}
+        self.queries_sent = 0
+        self.queries_coalesced = 0
+        self.query_cache_hits = 0
+        # Encoded advertise/profile payloads, one slot per (type, target)
+        # holding (profile_hash, version, payload). A profile only changes
+        # when its hash does, so steady-state broadcasts reuse the bytes.
+        self._payload_cache = {}
+        # With a ProfileCache, advertisements whose hash names a profile we
+        # do not hold trigger one fetch per hash, shared by every node
+        # advertising it; known hashes are filled in from the cache.
+        self.profile_cache = profile_cache
+        self.profile_fetch_timeout_ms = 1000
+        # profile_hash -> node ids waiting on the in-flight fetch.
+        self._profile_fetches = {}
+        self.profile_fetches = 0
+        self.answer_from_registry = answer_from_registry
+        self._local_profile = None
+        self._local_service_ids = ()
+        self._handlers = {
+            Schema.TYPE_ADVERTISE: self._handle_advertise,
+            Schema.TYPE_PROFILE: self._handle_profile,
+            Schema.TYPE_PROFILE_DELTA: self._handle_profile_delta,
+            Schema.TYPE_QUERY: self._handle_query,
+            Schema.TYPE_QUERY_RESULT: self._handle_query_result,
+            Schema.TYPE_GET_PROFILE: self._handle_get_profile,
+        }
+        if wanted_types is not None:
+            self.subscribe(*wanted_types)
 
-    def send_advertise(self, peer_id, profile_hash, service_ids):
-        payload = self.codec.encode_advertise(self.node_id, profile_hash, service_ids)
-        self.transport.send(peer_id, payload)
-        return payload
+    def subscribe(self, *message_types):
+        """
+        Only decode the given message types; poll() drops others after a
+        cheap type peek. Call with no arguments to accept every type again.
+        """
+        self.wanted_types = set(message_types) if message_types else None
 
-    def send_query(self, peer_id, service_id):
-        payload = self.codec.encode_query(self.node_id, service_id)
-        self.transport.send(peer_id, payload)
-        return payload
+    def register_handler(self, message_type, handler):
+        """Route message_type to handler(peer_id, message); returns the previous handler."""
+        previous = self._handlers.get(message_type)
+        self._handlers[message_type] = handler
+        return previous
+
+    def unregister_handler(self, message_type):
+        return self._handlers.pop(message_type, None)
 
-    def send_query_result(self, peer_id, service_id, providers):
-        payload = self.codec.encode_query_result(self.node_id, service_id, providers)
+    def set_local_profile(self, profile):
+        """Wire-form profile dict of this node, used to answer queries and get_profile."""
+        profile = dict(profile)
+        # Keep the hash in the form peers will see it in.
+        profile[Schema.F_PROFILE_HASH] = binary.canonical_profile_hash(profile[Schema.F_PROFILE_HASH])
+        self._local_profile = profile
+        self._local_service_ids = tuple(entry[Schema.F_SERVICE_ID] for entry in profile[Schema.F_SERVICES])
+
+    def local_profile_hash(self):
+        """Canonical hash of the profile set by set_local_profile(), or None."""
+        if self._local_profile is None:
+            return None
+        return self._local_profile[Schema.F_PROFILE_HASH]
+
+    def send_advertise(self, peer_id, profile_hash, service_ids, version=None):
+        cached = self._cached_payload(Schema.TYPE_ADVERTISE, profile_hash, peer_id, version)
+        if cached is None:
+            payload = self.codec.encode_advertise(self.node_id, profile_hash, service_ids, version=version)
+            cached = self._store_payload(Schema.TYPE_ADVERTISE, profile_hash, peer_id, version, payload)
+        self.transport.send(peer_id, cached[0])
+        return cached[1]
+
+    def send_query(self, peer_id, service_id, version=None, request_id=None):
+        payload = self.codec.encode_query(self.node_id, service_id, version=version, request_id=request_id)
         self.transport.send(peer_id, payload)
         return payload
 
-    def send_get_profile(self, peer_id, target_node_id):
-        payload = self.codec.encode_get_profile(self.node_id, target_node_id)
-        self.transport.send(peer_id, payload)
+    def send_query_result(self, peer_id, service_id, providers, reliable=False, version=None, request_id=None):
+        payload = self.codec.encode_query_result(
+            self.node_id, service_id, providers, version=version, request_id=request_id
+        )
+        self._send(peer_id, payload, reliable)
         return payload
 
-    def send_profile(self, peer_id, profile_hash, services, name=None, role=None, firmware=None, meta=None):
-        payload = self.codec.encode_profile(
-            self.node_id,
-            profile_hash,
-            services,
-            name=name,
-            role=role,
-            firmware=firmware,
-            meta=meta,
+    def send_get_profile(self, peer_id, target_node_id, reliable=False, version=None, request_id=None):
+        payload = self.codec.encode_get_profile(
+            self.node_id, target_node_id, version=version, request_id=request_id
         )
-        self.transport.send(peer_id, payload)
+        self._send(peer_id, payload, reliable)
+        return payload
+
+    def send_profile(
+        self,
+        peer_id,
+        profile_hash,
+        services,
+        name=None,
+        role=None,
+        firmware=None,
+        meta=None,
+        reliable=False,
+        request_id=None,
+    ):
+        # Replies carry the request id, so only unsolicited sends are cached.
+        cached = None
+        if request_id is None:
+            cached = self._cached_payload(Schema.TYPE_PROFILE, profile_hash, peer_id, None)
+        if cached is None:
+            payload = self.codec.encode_profile(
+                self.node_id,
+                profile_hash,
+                services,
+                name=name,
+                role=role,
+                firmware=firmware,
+                meta=meta,
+                request_id=request_id,
+            )
+            if request_id is not None:
+                self._send(peer_id, payload, reliable)
+                return payload
+            cached = self._store_payload(Schema.TYPE_PROFILE, profile_hash, peer_id, None, payload)
+        self._send(peer_id, cached[0], reliable)
+        return cached[1]
+
+    def send_profile_delta(self, peer_id, old_profile, new_profile, reliable=False):
+        """Send only what changed between two wire-form profile dicts."""
+        payload = self.codec.encode_profile_delta(self.node_id, **diff_profiles(old_profile, new_profile))
+        self._send(peer_id, payload, reliable)
         return payload
 
+    async def request_profile(self, peer_id, target_node_id=None, timeout_ms=1000, reliable=False):
+        """
+        Fetch a node's full profile; returns the profile message or None on
+        timeout. The reply also updates the registry through poll().
+        """
+        request = self._requests.open(timeout_ms)
+        try:
+            self.send_get_profile(
+                peer_id,
+                target_node_id if target_node_id is not None else peer_id,
+                reliable=reliable,
+                request_id=request.request_id,
+            )
+        except Exception:
+            self._requests.close(request)
+            raise
+        await self._requests.wait(request)
+        return request.reply()
+
+    async def request_profiles(self, peer_ids, timeout_ms=1000):
+        """Fetch several profiles concurrently; returns {peer_id: profile or None}."""
+        peer_ids = list(peer_ids)
+        replies = await asyncio.gather(*[self.request_profile(peer_id, timeout_ms=timeout_ms) for peer_id in peer_ids])
+        return dict(zip(peer_ids, replies))
+
+    async def query(self, service_id, timeout_ms=500, peer_id="broadcast"):
+        """
+        Ask the mesh which nodes provide service_id and return their ids.
+
+        Replies are gathered for timeout_ms. Callers arriving while a query
+        for the same service is in flight wait for its answer instead of
+        broadcasting again; answers are then served from the cache. poll()
+        must be running (e.g. the mesh loop) for replies to be collected.
+        """
+        service_id = int(service_id)
+        cached = self._query_cache.get(service_id)
+        if cached is not None:
+            if self._ticks_diff(cached[0], self._now_ms()) > 0:
+                self.query_cache_hits += 1
+                return list(cached[1])
+            del self._query_cache[service_id]
+
+        entry = self._inflight_queries.get(service_id)
+        if entry is not None:
+            self.queries_coalesced += 1
+        else:
+            request = self._requests.open(timeout_ms, gather=True)
+            entry = [request, 0]
+            self._inflight_queries[service_id] = entry
+            try:
+                self.send_query(peer_id, service_id, request_id=request.request_id)
+            except Exception:
+                del self._inflight_queries[service_id]
+                self._requests.close(request)
+                raise
+            self.queries_sent += 1
+        request = entry[0]
+        # The query completes at its deadline whoever started it; a
+        # cancelled caller only leaves, and the last one to leave drops the
+        # query without caching an answer.
+        entry[1] += 1
+        completed = False
+        try:
+            await request.event.wait()
+            completed = True
+        finally:
+            entry[1] -= 1
+            if not completed and not entry[1] and not request.done:
+                self._requests.close(request)
+                if self._inflight_queries.get(service_id) is entry:
+                    del self._inflight_queries[service_id]
+        providers = self._query_providers(request)
+        if self._inflight_queries.get(service_id) is entry:
+            del self._inflight_queries[service_id]
+            ttl_ms = self.query_ttl_ms if providers else self.query_negative_ttl_ms
+            self._query_cache[service_id] = (self._ticks_add(self._now_ms(), ttl_ms), tuple(providers))
+        return providers
+
+    def invalidate_query_cache(self):
+        self._query_cache = {}
+
+    @staticmethod
+    def _query_providers(request):
+        providers = []
+        for reply in request.replies:
+            for provider in reply[Schema.F_PROVIDERS]:
+                if provider not in providers:
+                    providers.append(provider)
+        return providers
+
+    def _on_reply(self, message):
+        request_id = message.get(Schema.F_REQUEST_ID)
+        if request_id is not None and self._requests.deliver(request_id, message):
+            return
+        if message[Schema.F_TYPE] != Schema.TYPE_QUERY_RESULT:
+            return
+        service_id = message[Schema.F_SERVICE_ID]
+        entry = self._inflight_queries.get(service_id)
+        if entry is not None:
+            # Responder did not echo the request id; match on the service.
+            self._requests.deliver(entry[0].request_id, message)
+            return
+        providers = message[Schema.F_PROVIDERS]
+        cached = self._query_cache.get(service_id)
+        if cached is not None and providers:
+            # A late reply still beats a cached "nobody".
+            merged = list(cached[1])
+            for provider in providers:
+                if provider not in merged:
+                    merged.append(provider)
+            self._query_cache[service_id] = (self._ticks_add(self._now_ms(), self.query_ttl_ms), tuple(merged))
+
+    def invalidate_payload_cache(self):
+        """Drop cached payloads, e.g. after editing a profile without rehashing it."""
+        self._payload_cache = {}
+
+    def _cached_payload(self, mtype, profile_hash, peer_id, version):
+        entry = self._payload_cache.get((mtype, peer_id))
+        if entry is None or entry[0] != profile_hash or entry[1] != version:
+            return None
+        return entry[2]
+
+    def _store_payload(self, mtype, profile_hash, peer_id, version, payload):
+        """
+        Cache (wire bytes, payload as encoded). The transport gets bytes so
+        it has no per-send utf-8 encode; callers still get the codec's str
+        or bytes back.
+        """
+        wire = payload.encode("utf-8") if isinstance(payload, str) else payload
+        pair = (wire, payload)
+        self._payload_cache[(mtype, peer_id)] = (profile_hash, version, pair)
+        return pair
+
+    def _send(self, peer_id, payload, reliable=False):
+        # Only pass the reliable flag when asked so plain transports keep working.
+        if reliable:
+            self.transport.send(peer_id, payload, reliable=True)
+        else:
+            self.transport.send(peer_id, payload)
+
     def poll(self):
         """
         Receive one message and update registry.
         Returns (peer_id, decoded_message) or (None, None).
+        Frames whose type is not in wanted_types are skipped undecoded.
         """
-        peer_id, payload = self.transport.recv()
-        if payload is None:
-            return None, None
+        if self._requests:
+            self._requests.expire()
+        while True:
+            peer_id, payload = self.transport.recv()
+            if payload is None:
+                return None, None
+            if self.wanted_types is None:
+                break
+            mtype = self.codec.peek_type(payload)
+            if mtype is None or mtype in self.wanted_types:
+                break
+            self.filtered += 1
 
         message = self.codec.decode(payload)
-        mtype = message[Schema.F_TYPE]
+        handler = self._handlers.get(message[Schema.F_TYPE])
+        if handler is not None:
+            handler(peer_id, message)
+        return peer_id, message
 
-        if mtype == Schema.TYPE_ADVERTISE:
-            self.registry.register_advertisement(message)
-        elif mtype == Schema.TYPE_PROFILE:
-            self.registry.register_profile(message)
+    def _handle_advertise(self, peer_id, message):
+        self.registry.register_advertisement(message)
+        if self.profile_cache is not None:
+            self._resolve_profile(peer_id, message[Schema.F_NODE_ID], message[Schema.F_PROFILE_HASH])
 
-        return peer_id, message
+    def _handle_profile(self, peer_id, message):
+        self.registry.register_profile(message)
+        if self.profile_cache is not None:
+            self.profile_cache.put_message(message)
+        if Schema.F_REQUEST_ID in message:
+            self._on_reply(message)
+
+    def _handle_profile_delta(self, peer_id, message):
+        if self.registry.register_profile_delta(message):
+            if self.profile_cache is not None:
+                self._cache_registry_profile(message[Schema.F_NODE_ID])
+        elif self.profile_cache is not None:
+            self._resolve_profile(peer_id, message[Schema.F_NODE_ID], message[Schema.F_PROFILE_HASH])
+        else:
+            # No base profile for the delta: fall back to a full fetch.
+            self.send_get_profile(peer_id, message[Schema.F_NODE_ID])
+
+    def _handle_query_result(self, peer_id, message):
+        self._on_reply(message)
+
+    def _handle_query(self, peer_id, message):
+        service_id = message[Schema.F_SERVICE_ID]
+        providers = []
+        if service_id in self._local_service_ids:
+            providers.append(self.node_id)
+        if self.answer_from_registry:
+            for node in self.registry.find_service(service_id, self.QUERY_REPLY_LIMIT):
+                if not node.approximate and node.node_id not in providers:
+                    providers.append(node.node_id)
+        if not providers:
+            # Stay silent rather than flood the asker with empty answers.
+            return
+        self.send_query_result(
+            peer_id,
+            service_id,
+            providers[:self.QUERY_REPLY_LIMIT],
+            version=message[Schema.F_VERSION],
+            request_id=message.get(Schema.F_REQUEST_ID),
+        )
+
+    def _handle_get_profile(self, peer_id, message):
+        profile = self._local_profile
+        if profile is None or message[Schema.F_TARGET] != self.node_id:
+            return
+        self.send_profile(
+            peer_id,
+            profile[Schema.F_PROFILE_HASH],
+            profile[Schema.F_SERVICES],
+            name=profile.get(Schema.F_NODE_NAME),
+            role=profile.get(Schema.F_ROLE),
+            firmware=profile.get(Schema.F_FIRMWARE),
+            meta=profile.get(Schema.F_META),
+            request_id=message.get(Schema.F_REQUEST_ID),
+        )
+
+    def _resolve_profile(self, peer_id, node_id, profile_hash):
+        node = self.registry.get_node(node_id)
+        if node is not None and node.has_profile(profile_hash):
+            return
+        if not self.registry.retain_profiles:
+            return
+        cached = self.profile_cache.profile_message(node_id, profile_hash)
+        if cached is not None:
+            self.registry.register_profile(cached)
+            return
+        waiting = self._profile_fetches.get(profile_hash)
+        if waiting is not None:
+            if node_id not in waiting:
+                waiting.append(node_id)
+            return
+        self._profile_fetches[profile_hash] = [node_id]
+        self.profile_fetches += 1
+        try:
+            asyncio.create_task(self._fetch_profile(peer_id, node_id, profile_hash))
+        except Exception:
+            # No event loop to await the reply in; poll() still caches it.
+            del self._profile_fetches[profile_hash]
+            self.send_get_profile(peer_id, node_id)
+
+    async def _fetch_profile(self, peer_id, node_id, profile_hash):
+        try:
+            reply = await self.request_profile(peer_id, node_id, timeout_ms=self.profile_fetch_timeout_ms)
+        finally:
+            waiting = self._profile_fetches.pop(profile_hash, ())
+        if reply is None:
+            # The next advertisement retries.
+            return
+        for other_id in waiting:
+            if other_id == node_id:
+                continue
+            cached = self.profile_cache.profile_message(other_id, profile_hash)
+            if cached is not None:
+                self.registry.register_profile(cached)
+
+    def _cache_registry_profile(self, node_id):
+        node = self.registry.get_node(node_id)
+        if node is None or not node.has_profile():
+            return
+        services, meta = node.profile()
+        body = {Schema.F_SERVICES: services, Schema.F_META: meta}
+        for field, value in ((Schema.F_NODE_NAME, node.name), (Schema.F_ROLE, node.role), (Schema.F_FIRMWARE, node.firmware)):
+            if value is not None:
+                body[field] = value
+        self.profile_cache.put(node.retained_hash, body)
+
+    def find_providers(self, service_id, limit=None):
+        return self.registry.find_service(service_id, limit)
+
+    @staticmethod
+    def _now_ms():
+        if hasattr(time, "ticks_ms"):
+            return time.ticks_ms()
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def _ticks_diff(newer, older):
+        if hasattr(time, "ticks_diff"):
+            return time.ticks_diff(newer, older)
+        return newer - older
 
-    def find_providers(self, service_id):
-        return self.registry.find_service(service_id)
+    @staticmethod
+    def _ticks_add(ticks, delta):
+        if hasattr(time, "ticks_add"):
+            return time.ticks_add(ticks, delta)
+        return ticks + delta
@@ -0,0 +1,253 @@
+"""
+Topic publish/subscribe over MessagingEndpoint.
+
+Subscribers broadcast the topics they want with a lease (seconds) and
+renew it at half-lease; a lease of 0 withdraws them. Publishers keep the
+leases in a subscriber table and send each event only to peers interested
+in its topic, so fan-out cost follows the subscriber count rather than
+the mesh size. Once a topic has broadcast_threshold or more subscribers
+one broadcast replaces the unicasts; receivers drop topics they did not
+ask for.
+
+Events are queued per destination and flushed every batch_ms, or sooner
+when a batch would overflow the short packet budget, so a burst of small
+sensor readings costs a few frames instead of one each.
+"""
+
+try:
+    import utime as time
+except Exception:
+    import time
+
+try:
+    import uasyncio as asyncio
+except Exception:
+    import asyncio
+
+from .schema import Schema
+
+
+BROADCAST = "broadcast"
+
+
+class PubSub:
+    """
+    Publisher and subscriber side of topics for one endpoint. Run run() as
+    a task for batching and lease renewal; the endpoint's poll() loop
+    delivers subscribe and publish messages to the handlers registered here.
+    """
+
+    DEFAULT_LEASE_S = 60
+    DEFAULT_BATCH_MS = 50
+    DEFAULT_BROADCAST_THRESHOLD = 4
+
+    def __init__(
+        self,
+        endpoint,
+        lease_s=DEFAULT_LEASE_S,
+        batch_ms=DEFAULT_BATCH_MS,
+        broadcast_threshold=DEFAULT_BROADCAST_THRESHOLD,
+        reliable=False,
+    ):
+        self.endpoint = endpoint
+        self.lease_s = int(lease_s)
+        self.batch_ms = int(batch_ms)
+        self.broadcast_threshold = int(broadcast_threshold)
+        self.reliable = reliable
+        # topic -> [callback(topic, payload, publisher_id)] of local subscribers.
+        self._local = {}
+        # topic -> {node_id: lease expiry ticks} of remote subscribers.
+        self._subscribers = {}
+        # destination peer -> ([events], encoded size estimate).
+        self._outbox = {}
+        self._oldest_queued = None
+        self._renew_at = None
+        self._empty_batch_bytes = len(endpoint.codec.encode_publish(endpoint.node_id, []))
+        self.events_published = 0
+        self.events_unwanted = 0
+        self.events_delivered = 0
+        self.frames_sent = 0
+        endpoint.register_handler(Schema.TYPE_SUBSCRIBE, self._on_subscribe)
+        endpoint.register_handler(Schema.TYPE_PUBLISH, self._on_publish)
+
+    def subscribe(self, topic, callback):
+        """Call callback(topic, payload, publisher_id) for events on topic."""
+        callbacks = self._local.get(topic)
+        if callbacks is None:
+            callbacks = []
+            self._local[topic] = callbacks
+        callbacks.append(callback)
+        if len(callbacks) == 1:
+            self._announce([topic], self.lease_s)
+            self._schedule_renewal()
+
+    def unsubscribe(self, topic, callback=None):
+        """Drop callback (every callback when None) from topic."""
+        callbacks = self._local.get(topic)
+        if callbacks is None:
+            return
+        if callback is not None and callback in callbacks:
+            callbacks.remove(callback)
+        if callback is None or not callbacks:
+            del self._local[topic]
+            self._announce([topic], 0)
+
+    def subscribers(self, topic):
+        """Node ids whose lease on topic has not expired."""
+        table = self._subscribers.get(topic)
+        if not table:
+            return []
+        now = self._now_ms()
+        live = []
+        for node_id, expires in list(table.items()):
+            if self._ticks_diff(expires, now) > 0:
+                live.append(node_id)
+            else:
+                del table[node_id]
+        if not table:
+            del self._subscribers[topic]
+        return live
+
+    def publish(self, topic, payload, flush=False):
+        """
+        Queue payload (any JSON value) for topic's subscribers. Returns the
+        number of remote subscribers it will reach; local subscribers are
+        called immediately. flush=True sends without waiting for the batch.
+        """
+        self.events_published += 1
+        self._deliver_local(topic, payload, self.endpoint.node_id)
+        peers = self.subscribers(topic)
+        if not peers:
+            if topic not in self._local:
+                self.events_unwanted += 1
+            return 0
+        event = [topic, payload]
+        size = len(self.endpoint.codec.dumps(event)) + 1
+        if len(peers) >= self.broadcast_threshold:
+            self._enqueue(BROADCAST, event, size)
+        else:
+            for peer_id in peers:
+                self._enqueue(peer_id, event, size)
+        if flush:
+            self.flush()
+        return len(peers)
+
+    def flush(self):
+        """Send every queued batch now."""
+        outbox = self._outbox
+        self._outbox = {}
+        self._oldest_queued = None
+        for peer_id, batch in outbox.items():
+            self._send_batch(peer_id, batch[0])
+
+    def poll(self, now_ms=None):
+        """Flush batches older than batch_ms and renew leases when due."""
+        if now_ms is None:
+            now_ms = self._now_ms()
+        if self._oldest_queued is not None and self._ticks_diff(now_ms, self._oldest_queued) >= self.batch_ms:
+            self.flush()
+        if self._renew_at is not None and self._ticks_diff(now_ms, self._renew_at) >= 0:
+            self._renew_at = None
+            if self._local:
+                self._announce(list(self._local), self.lease_s)
+                self._schedule_renewal()
+
+    async def run(self):
+        while True:
+            self.poll()
+            try:
+                await asyncio.sleep_ms(self.batch_ms)
+            except AttributeError:
+                await asyncio.sleep(self.batch_ms / 1000.0)
+
+    def _enqueue(self, peer_id, event, size):
+        batch = self._outbox.get(peer_id)
+        if batch is None:
+            batch = [[], self._empty_batch_bytes]
+            self._outbox[peer_id] = batch
+        elif batch[1] + size > self.endpoint.codec.max_short_packet_bytes:
+            self._send_batch(peer_id, batch[0])
+            batch[0] = []
+            batch[1] = self._empty_batch_bytes
+        batch[0].append(event)
+        batch[1] += size
+        if self._oldest_queued is None:
+            self._oldest_queued = self._now_ms()
+
+    def _send_batch(self, peer_id, events):
+        if not events:
+            return
+        payload = self.endpoint.codec.encode_publish(self.endpoint.node_id, events)
+        if peer_id == BROADCAST:
+            self.endpoint.transport.send(peer_id, payload)
+        else:
+            self.endpoint._send(peer_id, payload, self.reliable)
+        self.frames_sent += 1
+
+    def _announce(self, topics, lease_s):
+        # Split so each subscribe frame stays inside the packet budget.
+        codec = self.endpoint.codec
+        node_id = self.endpoint.node_id
+        batch = []
+        for topic in topics:
+            batch.append(topic)
+            if len(batch) > 1 and len(codec.encode_subscribe(node_id, batch, lease_s)) > codec.max_short_packet_bytes:
+                batch.pop()
+                self.endpoint.transport.send(BROADCAST, codec.encode_subscribe(node_id, batch, lease_s))
+                batch = [topic]
+        if batch:
+            self.endpoint.transport.send(BROADCAST, codec.encode_subscribe(node_id, batch, lease_s))
+
+    def _schedule_renewal(self):
+        if self._renew_at is None:
+            self._renew_at = self._ticks_add(self._now_ms(), self.lease_s * 500)
+
+    def _on_subscribe(self, peer_id, message):
+        node_id = message[Schema.F_NODE_ID]
+        lease_s = message[Schema.F_LEASE]
+        expires = self._ticks_add(self._now_ms(), lease_s * 1000)
+        for topic in message[Schema.F_TOPICS]:
+            table = self._subscribers.get(topic)
+            if lease_s:
+                if table is None:
+                    table = {}
+                    self._subscribers[topic] = table
+                table[node_id] = expires
+            elif table is not None:
+                table.pop(node_id, None)
+                if not table:
+                    del self._subscribers[topic]
+
+    def _on_publish(self, peer_id, message):
+        publisher_id = message[Schema.F_NODE_ID]
+        for topic, payload in message[Schema.F_EVENTS]:
+            self._deliver_local(topic, payload, publisher_id)
+
+    def _deliver_local(self, topic, payload, publisher_id):
+        callbacks = self._local.get(topic)
+        if not callbacks:
+            return
+        for callback in list(callbacks):
+            try:
+                callback(topic, payload, publisher_id)
+            except Exception as exc:
+                print("PubSub: subscriber for {} failed ({})".format(topic, exc))
+        self.events_delivered += 1
+
+    @staticmethod
+    def _now_ms():
+        if hasattr(time, "ticks_ms"):
+            return time.ticks_ms()
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def _ticks_diff(newer, older):
+        if hasattr(time, "ticks_diff"):
+            return time.ticks_diff(newer, older)
+        return newer - older
+
+    @staticmethod
+    def _ticks_add(ticks, delta):
+        if hasattr(time, "ticks_add"):
+            return time.ticks_add(ticks, delta)
+        return ticks + delta
@@ -1,88 +1,670 @@
+import json
 import time
+from array import array
 
+try:
+    import heapq
+except Exception:
+    import uheapq as heapq
+
+from . import service_set
 from .schema import Schema
 
 
+class NodeRecord:
+    """
+    Compact per-node registry entry.
+
+    service_ids is an array('H'). The full profile's services and meta are
+    kept, when retained at all, as one compact JSON string and only decoded
+    when profile() is called.
+    """
+
+    __slots__ = (
+        "node_id",
+        "profile_hash",
+        "last_seen_ms",
+        "service_ids",
+        "name",
+        "role",
+        "firmware",
+        "approximate",
+        "verified",
+        "profile_json",
+        "retained_hash",
+    )
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.profile_hash = None
+        self.last_seen_ms = None
+        self.service_ids = array("H")
+        self.name = None
+        self.role = None
+        self.firmware = None
+        # True while the node is only known through a Bloom digest.
+        self.approximate = False
+        # False for records restored from a snapshot until heard from again.
+        self.verified = True
+        self.profile_json = None
+        # Hash of the retained profile; profile_hash follows advertisements
+        # and may already name a newer profile.
+        self.retained_hash = None
+
+    def has_profile(self, profile_hash=None):
+        if self.profile_json is None:
+            return False
+        return profile_hash is None or self.retained_hash == profile_hash
+
+    def profile(self):
+        """(services, meta) from the retained profile, or (None, None)."""
+        if self.profile_json is None:
+            return None, None
+        data = json.loads(self.profile_json)
+        return data[Schema.F_SERVICES], data[Schema.F_META]
+
+    def set_profile(self, services, meta, profile_hash):
+        self.profile_json = json.dumps(
+            {Schema.F_SERVICES: services, Schema.F_META: meta or {}}, separators=(",", ":")
+        )
+        self.retained_hash = profile_hash
+
+    def to_dict(self):
+        services, meta = self.profile()
+        return {
+            "node_id": self.node_id,
+            "profile_hash": self.profile_hash,
+            "name": self.name,
+            "role": self.role,
+            "firmware": self.firmware,
+            "meta": meta or {},
+            "service_ids": list(self.service_ids),
+            "last_seen_ms": self.last_seen_ms,
+            "approximate": self.approximate,
+            "verified": self.verified,
+        }
+
+
 class ServiceRegistry:
     """
     In-memory registry for capability discovery.
     Works with both short advertisements and full profiles.
+
+    clock is an optional zero-argument callable returning milliseconds; pass
+    a mesh clock's now_ms so last_seen_ms is comparable across nodes.
+
+    Nodes not seen for ttl_ms are evicted (ttl_ms=0 keeps them forever).
+    Expiry uses a min-heap holding one (last_seen_ms, generation, node_id)
+    entry per node; entries found stale on pop are re-pushed with the newer
+    time, so sightings cost nothing and each expiry check is O(1) when
+    idle. The generation is fresh each time a node is added, so entries
+    left by a removed node are dropped instead of doubling up when it
+    returns.
+
+    Each service keeps its providers as a list of (last_seen_ms, node_id)
+    sorted oldest first, so a sighting is a binary search plus one move and
+    the k most recent providers are the last k entries. Limited
+    find_service results are memoized until the next change of any kind
+    (version), so the top k always follow recency; unlimited ones until
+    membership_version changes.
     """
 
-    def __init__(self):
+    DEFAULT_TTL_MS = 120000
+    DEFAULT_CHANGE_LOG = 128
+
+    EVENT_ADDED = "added"
+    EVENT_UPDATED = "updated"
+    EVENT_EXPIRED = "expired"
+
+    def __init__(self, clock=None, ttl_ms=None, retain_profiles=True, change_log_size=None):
+        self._clock = clock
+        self.ttl_ms = self.DEFAULT_TTL_MS if ttl_ms is None else int(ttl_ms)
+        # Without retained profiles the registry keeps ids and names only;
+        # profile deltas then fall back to a full fetch.
+        self.retain_profiles = retain_profiles
+        # node_id -> NodeRecord. The record's node_id string is the one
+        # shared by every index entry for that node.
         self._nodes = {}
+        # service_id -> [(last_seen_ms, node_id), ...] ascending by time.
         self._service_to_nodes = {}
+        # Nodes that advertised a Bloom digest instead of exact service ids.
+        self._digest_nodes = {}
+        # Secondary indexes: (field, value) -> set of node ids, for name,
+        # role, firmware and scalar meta values ("meta.<key>"), plus each
+        # node's current keys so updates only touch what changed.
+        self._attr_index = {}
+        self._node_attrs = {}
+        self._expiry_heap = []
+        # node_id -> generation of its live heap entry.
+        self._expiry_gen = {}
+        self._generation = 0
+        self._evict_callbacks = []
+        # version is bumped on every change, re-sightings included.
+        # membership_version only when a node is added or removed, or its
+        # service ids, digest, attributes or other record fields change.
+        # Unlimited find_service memos and snapshots key on it.
+        self.version = 0
+        self.membership_version = 0
+        # find_service memos: (service_id, limit) -> results for limited
+        # lookups, service_id -> results for unlimited ones.
+        self._find_cache = {}
+        self._find_cache_version = 0
+        self._members_cache = {}
+        self._members_cache_version = 0
+        # Change feed: revision counts events; the log is a ring buffer in
+        # which revision r sits at slot r % size.
+        self.revision = 0
+        self._watchers = []
+        size = self.DEFAULT_CHANGE_LOG if change_log_size is None else int(change_log_size)
+        self._change_log = [None] * max(1, size)
 
-    def register_advertisement(self, msg, seen_at_ms=None):
-        node_id = msg[Schema.F_NODE_ID]
-        profile_hash = msg[Schema.F_PROFILE_HASH]
-        services = msg[Schema.F_SERVICES]
+    def register_advertisement(self, msg, seen_at_ms=None, verified=True):
+        """
+        verified=False is for second-hand sightings (e.g. gossip): a node
+        first learned that way stays unverified until heard from directly,
+        and an existing record keeps its flag.
+        """
         if seen_at_ms is None:
             seen_at_ms = self._now_ms()
+        # Expand first: a set that fails to decode must not leave a record.
+        encoded_services = msg[Schema.F_SERVICES]
+        services = service_set.expand(encoded_services)
+        if services is None:
+            bloom = service_set.digest(encoded_services)
+        else:
+            services = array("H", services)
+        node = self._get_or_create(msg[Schema.F_NODE_ID], seen_at_ms)
+        node_id = node.node_id
+        old_ids = node.service_ids
+        old_seen = node.last_seen_ms
+        old_state = (node.profile_hash, node.approximate, node.verified)
+        if verified:
+            node.verified = True
+        elif old_seen is None:
+            node.verified = False
+        if services is None:
+            # Bloom digest: keep known exact ids (e.g. from a profile) and
+            # answer lookups probabilistically from the digest.
+            previous = self._digest_nodes.get(node_id)
+            if previous is None or previous.bits != bloom.bits or previous.hashes != bloom.hashes:
+                self.membership_version += 1
+            self._digest_nodes[node_id] = bloom
+            node.approximate = True
+        else:
+            self._digest_nodes.pop(node_id, None)
+            node.approximate = False
+            node.service_ids = services
+        node.profile_hash = msg[Schema.F_PROFILE_HASH]
+        node.last_seen_ms = int(seen_at_ms)
+        self._reindex(node_id, old_ids, node.service_ids, old_seen, node.last_seen_ms)
+        if old_seen is None:
+            self._emit(self.EVENT_ADDED, node)
+        elif old_state != (node.profile_hash, node.approximate, node.verified) or old_ids != node.service_ids:
+            self._emit(self.EVENT_UPDATED, node)
+        self.expire(seen_at_ms)
 
-        node = self._nodes.get(node_id, {})
-        node["node_id"] = node_id
-        node["profile_hash"] = profile_hash
-        node["service_ids"] = list(services)
-        node["last_seen_ms"] = int(seen_at_ms)
-        self._nodes[node_id] = node
+    def register_profile(self, msg, seen_at_ms=None):
+        if msg[Schema.F_TYPE] == Schema.TYPE_PROFILE_DELTA:
+            return self.register_profile_delta(msg, seen_at_ms)
+        if seen_at_ms is None:
+            seen_at_ms = self._now_ms()
+        node = self._get_or_create(msg[Schema.F_NODE_ID], seen_at_ms)
+        services = msg[Schema.F_SERVICES]
 
-        for service_id in services:
-            providers = self._service_to_nodes.get(service_id, set())
-            providers.add(node_id)
-            self._service_to_nodes[service_id] = providers
+        old_ids = node.service_ids
+        old_seen = node.last_seen_ms
+        old_state = (
+            node.profile_hash,
+            node.name,
+            node.role,
+            node.firmware,
+            node.approximate,
+            node.verified,
+            node.profile_json,
+        )
+        node.verified = True
+        node.profile_hash = msg[Schema.F_PROFILE_HASH]
+        node.last_seen_ms = int(seen_at_ms)
+        node.name = msg.get(Schema.F_NODE_NAME)
+        node.role = msg.get(Schema.F_ROLE)
+        node.firmware = msg.get(Schema.F_FIRMWARE)
+        node.service_ids = array("H", [entry[Schema.F_SERVICE_ID] for entry in services])
+        if self.retain_profiles:
+            node.set_profile(services, msg.get(Schema.F_META), node.profile_hash)
+        attrs_changed = self._index_attrs(node, msg.get(Schema.F_META))
+        # A full profile lists exact services, superseding any digest.
+        self._digest_nodes.pop(node.node_id, None)
+        node.approximate = False
+        self._reindex(node.node_id, old_ids, node.service_ids, old_seen, node.last_seen_ms)
+        new_state = (
+            node.profile_hash,
+            node.name,
+            node.role,
+            node.firmware,
+            node.approximate,
+            node.verified,
+            node.profile_json,
+        )
+        if old_seen is None:
+            self._emit(self.EVENT_ADDED, node)
+        elif attrs_changed or old_state != new_state or old_ids != node.service_ids:
+            self._emit(self.EVENT_UPDATED, node)
+        self.expire(seen_at_ms)
 
-    def register_profile(self, msg, seen_at_ms=None):
-        node_id = msg[Schema.F_NODE_ID]
+    def register_profile_delta(self, msg, seen_at_ms=None):
+        """
+        Apply a profile delta in place.
+
+        Returns False without changing anything when the node's full profile
+        for the delta's previous hash is not known; the caller should then
+        request the full profile.
+        """
+        node = self._nodes.get(msg[Schema.F_NODE_ID])
+        if node is None or not node.has_profile(msg[Schema.F_PREV_HASH]):
+            return False
         if seen_at_ms is None:
             seen_at_ms = self._now_ms()
+        old_services, meta = node.profile()
+        node.verified = True
+
+        services = {}
+        for entry in old_services:
+            services[entry[Schema.F_SERVICE_ID]] = entry
+        for service_id in msg.get(Schema.F_SERVICES_REMOVED, ()):
+            services.pop(service_id, None)
+        for entry in msg.get(Schema.F_SERVICES_ADDED, ()):
+            services[entry[Schema.F_SERVICE_ID]] = entry
+        for entry in msg.get(Schema.F_SERVICES_CHANGED, ()):
+            services[entry[Schema.F_SERVICE_ID]] = entry
 
-        node = self._nodes.get(node_id, {})
-        node["node_id"] = node_id
-        node["profile_hash"] = msg[Schema.F_PROFILE_HASH]
-        node["last_seen_ms"] = int(seen_at_ms)
-        node["name"] = msg.get(Schema.F_NODE_NAME)
-        node["role"] = msg.get(Schema.F_ROLE)
-        node["firmware"] = msg.get(Schema.F_FIRMWARE)
-        node["meta"] = msg.get(Schema.F_META, {})
-        node["services"] = list(msg[Schema.F_SERVICES])
-        node["service_ids"] = [entry[Schema.F_SERVICE_ID] for entry in node["services"]]
-        self._nodes[node_id] = node
-
-        for service_id in node["service_ids"]:
-            providers = self._service_to_nodes.get(service_id, set())
-            providers.add(node_id)
-            self._service_to_nodes[service_id] = providers
-
-    def find_service(self, service_id):
+        for key in msg.get(Schema.F_META_REMOVED, ()):
+            meta.pop(key, None)
+        meta.update(msg.get(Schema.F_META_SET, {}))
+
+        if Schema.F_NODE_NAME in msg:
+            node.name = msg[Schema.F_NODE_NAME]
+        if Schema.F_ROLE in msg:
+            node.role = msg[Schema.F_ROLE]
+        if Schema.F_FIRMWARE in msg:
+            node.firmware = msg[Schema.F_FIRMWARE]
+        for field in msg.get(Schema.F_CLEARED, ()):
+            if field == Schema.F_NODE_NAME:
+                node.name = None
+            elif field == Schema.F_ROLE:
+                node.role = None
+            elif field == Schema.F_FIRMWARE:
+                node.firmware = None
+        old_ids = node.service_ids
+        old_seen = node.last_seen_ms
+        services = list(services.values())
+        node.profile_hash = msg[Schema.F_PROFILE_HASH]
+        node.last_seen_ms = int(seen_at_ms)
+        node.service_ids = array("H", [entry[Schema.F_SERVICE_ID] for entry in services])
+        node.set_profile(services, meta, node.profile_hash)
+        self._index_attrs(node, meta)
+        self._reindex(node.node_id, old_ids, node.service_ids, old_seen, node.last_seen_ms)
+        self._emit(self.EVENT_UPDATED, node)
+        self.expire(seen_at_ms)
+        return True
+
+    def find_service(self, service_id, limit=None):
         """
         Query API:
-        Return candidate providers for a service id.
+        Return NodeRecords of candidate providers for a service id, most
+        recently seen first, at most limit of them. Records with approximate
+        set matched only a Bloom digest and may be false positives. The
+        returned list is shared with the memo cache and must not be modified.
+
+        Without a limit the result is the full provider set, and its order
+        is only refreshed when membership changes; pass a limit when the
+        most recently seen providers matter.
+        """
+        self.expire()
+        service_id = int(service_id)
+        if limit is None:
+            if self._members_cache_version != self.membership_version:
+                self._members_cache = {}
+                self._members_cache_version = self.membership_version
+            cache = self._members_cache
+            key = service_id
+        else:
+            # Re-sightings reorder the top k, so any change invalidates.
+            if self._find_cache_version != self.version:
+                self._find_cache = {}
+                self._find_cache_version = self.version
+            cache = self._find_cache
+            key = (service_id, limit)
+        results = cache.get(key)
+        if results is not None:
+            return results
+
+        ordered = self._service_to_nodes.get(service_id, ())
+        if limit is not None and limit < len(ordered):
+            ordered = ordered[len(ordered) - int(limit):]
+        entries = list(ordered)
+        if self._digest_nodes:
+            for node_id, bloom in self._digest_nodes.items():
+                node = self._nodes[node_id]
+                # Exact ids kept from a profile already put the node in
+                # ordered (or past the limit); list it once.
+                if service_id in bloom and service_id not in node.service_ids:
+                    entries.append((node.last_seen_ms, node_id))
+            # Digest matches are few; merging them by sort keeps this O(k log k).
+            entries.sort()
+            if limit is not None:
+                entries = entries[max(0, len(entries) - int(limit)):]
+
+        nodes = self._nodes
+        results = [nodes[entries[index][1]] for index in range(len(entries) - 1, -1, -1)]
+        cache[key] = results
+        return results
+
+    def restore(self, record):
+        """
+        Insert a record loaded from a snapshot, marked unverified. Nodes
+        already known (heard from since startup) are kept as they are.
+        Returns True when the record was added.
         """
-        providers = self._service_to_nodes.get(int(service_id), set())
+        if record.node_id in self._nodes or record.last_seen_ms is None:
+            return False
+        record.verified = False
+        self._nodes[record.node_id] = record
+        self._schedule(record.node_id, record.last_seen_ms)
+        self._reindex(record.node_id, (), record.service_ids, None, record.last_seen_ms)
+        self._index_attrs(record, record.profile()[1])
+        self._emit(self.EVENT_ADDED, record)
+        return True
+
+    def query(
+        self,
+        services=(),
+        role=None,
+        name=None,
+        firmware=None,
+        meta=None,
+        seen_within_ms=None,
+        where=None,
+        limit=None,
+        now_ms=None,
+    ):
+        """
+        Return NodeRecords matching every given constraint, most recently
+        seen first: all of services, the exact role/name/firmware, every
+        meta key/value pair, seen within the last seen_within_ms, and
+        where(record) if given. Digest-only matches are not included.
+
+        Candidates come from the smallest matching index; the remaining
+        constraints are checked per record.
+        """
+        self.expire(now_ms)
+        sources = []
+        for service_id in services:
+            ordered = self._service_to_nodes.get(int(service_id))
+            if not ordered:
+                return []
+            sources.append((len(ordered), 0, ordered))
+        attrs = []
+        for field, value in (("role", role), ("name", name), ("firmware", firmware)):
+            if value is not None:
+                attrs.append((field, value))
+        for key, value in (meta or {}).items():
+            attrs.append(("meta." + key, value))
+        for key in attrs:
+            if not _is_indexable(key[1]):
+                raise ValueError("cannot query on non-scalar value for {}".format(key[0]))
+            ids = self._attr_index.get(key)
+            if not ids:
+                return []
+            sources.append((len(ids), 1, ids))
+
+        cutoff = None
+        if seen_within_ms is not None:
+            if now_ms is None:
+                now_ms = self._now_ms()
+            cutoff = int(now_ms) - int(seen_within_ms)
+
+        if not sources:
+            candidates = self._nodes.keys()
+            ordered = False
+        else:
+            smallest = sources[0]
+            for source in sources:
+                if source[0] < smallest[0]:
+                    smallest = source
+            if smallest[1] == 0:
+                # A recency list: walk newest first and stop early.
+                candidates = [smallest[2][i][1] for i in range(len(smallest[2]) - 1, -1, -1)]
+                ordered = True
+            else:
+                candidates = smallest[2]
+                ordered = False
+
         results = []
-        for node_id in providers:
-            node = self._nodes.get(node_id)
-            if not node:
+        for node_id in candidates:
+            node = self._nodes[node_id]
+            if cutoff is not None and node.last_seen_ms < cutoff:
+                if ordered:
+                    break
                 continue
-            results.append(
-                {
-                    "node_id": node["node_id"],
-                    "profile_hash": node.get("profile_hash"),
-                    "name": node.get("name"),
-                    "role": node.get("role"),
-                    "last_seen_ms": node.get("last_seen_ms"),
-                }
-            )
-        results.sort(key=lambda r: (r["last_seen_ms"] or 0), reverse=True)
+            if not self._matches(node, services, attrs) or (where is not None and not where(node)):
+                continue
+            results.append(node)
+            if ordered and limit is not None and len(results) >= limit:
+                return results
+        if not ordered:
+            results.sort(key=lambda record: record.last_seen_ms, reverse=True)
+        if limit is not None:
+            results = results[:int(limit)]
         return results
 
+    def _matches(self, node, services, attrs):
+        for service_id in services:
+            if int(service_id) not in node.service_ids:
+                return False
+        if attrs:
+            keys = self._node_attrs.get(node.node_id, ())
+            for key in attrs:
+                if key not in keys:
+                    return False
+        return True
+
+    def watch(self, callback):
+        """
+        Register callback(event, record, revision) for EVENT_ADDED,
+        EVENT_UPDATED and EVENT_EXPIRED. Re-sightings that change nothing
+        but last_seen_ms do not produce events.
+        """
+        self._watchers.append(callback)
+
+    def unwatch(self, callback):
+        if callback in self._watchers:
+            self._watchers.remove(callback)
+
+    def changes_since(self, revision):
+        """
+        [(revision, event, node_id), ...] for events after revision, oldest
+        first, or None when the log no longer reaches back that far and the
+        caller must re-read all_nodes().
+        """
+        revision = int(revision)
+        if revision >= self.revision:
+            return []
+        size = len(self._change_log)
+        if revision < 0 or self.revision - revision > size:
+            return None
+        return [self._change_log[r % size] for r in range(revision + 1, self.revision + 1)]
+
+    def on_evict(self, callback):
+        """Register callback(node_id, record) run when a node expires or is removed."""
+        self._evict_callbacks.append(callback)
+
+    def expire(self, now_ms=None):
+        """Evict nodes not seen within ttl_ms; returns the evicted node ids."""
+        heap = self._expiry_heap
+        if not self.ttl_ms or not heap:
+            return []
+        if now_ms is None:
+            now_ms = self._now_ms()
+        cutoff = int(now_ms) - self.ttl_ms
+        evicted = []
+        while heap and heap[0][0] <= cutoff:
+            _, generation, node_id = heapq.heappop(heap)
+            if self._expiry_gen.get(node_id) != generation:
+                # Left by an earlier life of a removed node.
+                continue
+            node = self._nodes[node_id]
+            if node.last_seen_ms > cutoff:
+                # Seen again since this entry was pushed; reschedule.
+                heapq.heappush(heap, (node.last_seen_ms, generation, node.node_id))
+                continue
+            self.remove_node(node_id)
+            evicted.append(node_id)
+        return evicted
+
+    def remove_node(self, node_id):
+        node = self._nodes.pop(node_id, None)
+        if node is None:
+            return None
+        self._expiry_gen.pop(node_id, None)
+        heap = self._expiry_heap
+        if len(heap) > 2 * len(self._nodes) + 16:
+            # Mostly dead entries from removed nodes; rebuild without them.
+            generations = self._expiry_gen
+            heap[:] = [entry for entry in heap if generations.get(entry[2]) == entry[1]]
+            heapq.heapify(heap)
+        self._digest_nodes.pop(node_id, None)
+        self._reindex(node.node_id, node.service_ids, (), node.last_seen_ms, node.last_seen_ms)
+        self._set_attr_keys(node.node_id, ())
+        self._emit(self.EVENT_EXPIRED, node)
+        for callback in self._evict_callbacks:
+            try:
+                callback(node_id, node)
+            except Exception as exc:
+                print("ServiceRegistry: evict callback failed ({})".format(exc))
+        return node
+
     def get_node(self, node_id):
         return self._nodes.get(node_id)
 
     def all_nodes(self):
         return dict(self._nodes)
 
-    @staticmethod
-    def _now_ms():
+    def _get_or_create(self, node_id, seen_at_ms):
+        node = self._nodes.get(node_id)
+        if node is None:
+            node = NodeRecord(node_id)
+            self._nodes[node_id] = node
+            self._schedule(node_id, int(seen_at_ms))
+        return node
+
+    def _schedule(self, node_id, seen_at_ms):
+        self._generation += 1
+        self._expiry_gen[node_id] = self._generation
+        heapq.heappush(self._expiry_heap, (seen_at_ms, self._generation, node_id))
+
+    def _index_attrs(self, node, meta):
+        keys = []
+        for field, value in (("name", node.name), ("role", node.role), ("firmware", node.firmware)):
+            if value is not None:
+                keys.append((field, value))
+        for key, value in (meta or {}).items():
+            if _is_indexable(value):
+                keys.append(("meta." + key, value))
+        return self._set_attr_keys(node.node_id, tuple(keys))
+
+    def _set_attr_keys(self, node_id, keys):
+        """Replace node_id's index keys; returns True when they changed."""
+        old_keys = self._node_attrs.get(node_id, ())
+        if old_keys == keys:
+            return False
+        self.membership_version += 1
+        for key in old_keys:
+            if key not in keys:
+                ids = self._attr_index.get(key)
+                if ids is not None:
+                    ids.discard(node_id)
+                    if not ids:
+                        del self._attr_index[key]
+        for key in keys:
+            if key not in old_keys:
+                ids = self._attr_index.get(key)
+                if ids is None:
+                    ids = set()
+                    self._attr_index[key] = ids
+                ids.add(node_id)
+        if keys:
+            self._node_attrs[node_id] = keys
+        else:
+            self._node_attrs.pop(node_id, None)
+        return True
+
+    def _emit(self, event, node):
+        self.membership_version += 1
+        self.revision += 1
+        revision = self.revision
+        self._change_log[revision % len(self._change_log)] = (revision, event, node.node_id)
+        for callback in self._watchers:
+            try:
+                callback(event, node, revision)
+            except Exception as exc:
+                print("ServiceRegistry: watch callback failed ({})".format(exc))
+
+    def _reindex(self, node_id, old_ids, new_ids, old_seen, new_seen):
+        """Update the recency lists for services that changed or were re-seen."""
+        self.version += 1
+        old_set = set(old_ids)
+        new_set = set(new_ids)
+        if old_set != new_set:
+            self.membership_version += 1
+        old_entry = (old_seen, node_id)
+        new_entry = (new_seen, node_id)
+        for service_id in old_set - new_set:
+            ordered = self._service_to_nodes.get(service_id)
+            if ordered is None:
+                continue
+            _remove_sorted(ordered, old_entry)
+            if not ordered:
+                del self._service_to_nodes[service_id]
+        if old_seen != new_seen:
+            for service_id in old_set & new_set:
+                ordered = self._service_to_nodes[service_id]
+                _remove_sorted(ordered, old_entry)
+                _insert_sorted(ordered, new_entry)
+        for service_id in new_set - old_set:
+            ordered = self._service_to_nodes.get(service_id)
+            if ordered is None:
+                ordered = []
+                self._service_to_nodes[service_id] = ordered
+            _insert_sorted(ordered, new_entry)
+
+    def _now_ms(self):
+        if self._clock is not None:
+            return int(self._clock())
         return int(time.time() * 1000)
+
+
+def _is_indexable(value):
+    return isinstance(value, (str, int, float, bool))
+
+
+# MicroPython ships no bisect module.
+def _bisect_left(ordered, item):
+    lo = 0
+    hi = len(ordered)
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if ordered[mid] < item:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _insert_sorted(ordered, item):
+    ordered.insert(_bisect_left(ordered, item), item)
+
+
+def _remove_sorted(ordered, item):
+    index = _bisect_left(ordered, item)
+    if index < len(ordered) and ordered[index] == item:
+        del ordered[index]
@@ -0,0 +1,301 @@
+"""
+Remote service calls over MessagingEndpoint.
+
+A call names a service id and carries a request id that its reply echoes
+(see pending.py), so replies complete the waiting coroutine as soon as
+poll() receives them; no application-level polling is involved. Calls to
+one peer are pipelined: up to window of them are in flight at once and
+later calls queue until a slot frees. The caller's remaining deadline
+travels with the call so providers skip work nobody is waiting for.
+"""
+
+try:
+    import utime as time
+except Exception:
+    import time
+
+try:
+    import uasyncio as asyncio
+except Exception:
+    import asyncio
+
+try:
+    import inspect
+except Exception:
+    inspect = None
+
+from .schema import Schema
+
+
+ERR_NO_SERVICE = "nosvc"
+ERR_BAD_ARGS = "args"
+ERR_FAILED = "fail"
+ERR_TIMEOUT = "timeout"
+ERR_NO_PROVIDER = "noprov"
+
+
+class RpcError(Exception):
+    def __init__(self, code, detail=None):
+        Exception.__init__(self, code if detail is None else "{}: {}".format(code, detail))
+        self.code = code
+        self.detail = detail
+
+
+class RpcTimeout(RpcError):
+    def __init__(self, detail=None):
+        RpcError.__init__(self, ERR_TIMEOUT, detail)
+
+
+class RpcClient:
+    """
+    Caller side. call() returns the provider's result or raises RpcError
+    (RpcTimeout when the deadline passes). The endpoint's poll() loop must
+    be running for replies to arrive.
+    """
+
+    DEFAULT_WINDOW = 4
+    DEFAULT_TIMEOUT_MS = 500
+
+    def __init__(self, endpoint, window=DEFAULT_WINDOW, reliable=False):
+        self.endpoint = endpoint
+        self.window = int(window)
+        self.reliable = reliable
+        # peer_id -> calls in flight; peer_id -> [Event] of queued callers.
+        self._inflight = {}
+        self._waiters = {}
+        self.calls = 0
+        self.timeouts = 0
+        endpoint.register_handler(Schema.TYPE_CALL_REPLY, self._on_reply)
+
+    async def call(self, peer_id, service_id, args=None, timeout_ms=DEFAULT_TIMEOUT_MS):
+        """
+        Invoke service_id on peer_id. args is any JSON value: a list is
+        passed to the handler as positional arguments, a dict as keyword
+        arguments. peer_id None picks a known provider (registry first,
+        then a mesh query).
+        """
+        start = self._now_ms()
+        if peer_id is None:
+            peer_id = await self._pick_provider(service_id, timeout_ms)
+        remaining = timeout_ms - self._ticks_diff(self._now_ms(), start)
+        await self._acquire(peer_id, remaining)
+        try:
+            remaining = timeout_ms - self._ticks_diff(self._now_ms(), start)
+            if remaining <= 0:
+                self.timeouts += 1
+                raise RpcTimeout("queued past deadline")
+            requests = self.endpoint._requests
+            request = requests.open(remaining)
+            try:
+                payload = self.endpoint.codec.encode_call(
+                    self.endpoint.node_id,
+                    service_id,
+                    request.request_id,
+                    args=args,
+                    deadline_ms=remaining,
+                )
+                self.endpoint._send(peer_id, payload, self.reliable)
+            except Exception:
+                requests.close(request)
+                raise
+            self.calls += 1
+            await requests.wait(request)
+        finally:
+            self._release(peer_id)
+        reply = request.reply()
+        if reply is None:
+            self.timeouts += 1
+            raise RpcTimeout()
+        error = reply.get(Schema.F_ERROR)
+        if error is not None:
+            raise RpcError(error, reply.get(Schema.F_RESULT))
+        return reply.get(Schema.F_RESULT)
+
+    def in_flight(self, peer_id):
+        return self._inflight.get(peer_id, 0)
+
+    async def _pick_provider(self, service_id, timeout_ms):
+        for node in self.endpoint.find_providers(service_id, 1):
+            return node.node_id
+        providers = await self.endpoint.query(service_id, timeout_ms=min(timeout_ms, 500))
+        if not providers:
+            raise RpcError(ERR_NO_PROVIDER, service_id)
+        return providers[0]
+
+    async def _acquire(self, peer_id, timeout_ms):
+        count = self._inflight.get(peer_id, 0)
+        if count < self.window:
+            self._inflight[peer_id] = count + 1
+            return
+        event = asyncio.Event()
+        waiters = self._waiters.get(peer_id)
+        if waiters is None:
+            waiters = []
+            self._waiters[peer_id] = waiters
+        waiters.append(event)
+        acquired = False
+        try:
+            await asyncio.wait_for(event.wait(), max(0, timeout_ms) / 1000.0)
+            acquired = True
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise RpcTimeout("pipeline to {} full".format(peer_id))
+        finally:
+            # Timed out or cancelled: give back a slot handed over as the
+            # wait ended, or leave the queue.
+            if not acquired:
+                if event.is_set():
+                    self._release(peer_id)
+                elif event in waiters:
+                    waiters.remove(event)
+                    if not waiters and self._waiters.get(peer_id) is waiters:
+                        del self._waiters[peer_id]
+
+    def _release(self, peer_id):
+        waiters = self._waiters.get(peer_id)
+        if waiters:
+            # Hand the slot straight to the oldest queued call.
+            waiters.pop(0).set()
+            if not waiters:
+                del self._waiters[peer_id]
+            return
+        count = self._inflight.get(peer_id, 0) - 1
+        if count > 0:
+            self._inflight[peer_id] = count
+        else:
+            self._inflight.pop(peer_id, None)
+
+    def _on_reply(self, peer_id, message):
+        self.endpoint._requests.deliver(message[Schema.F_REQUEST_ID], message)
+
+    @staticmethod
+    def _now_ms():
+        if hasattr(time, "ticks_ms"):
+            return time.ticks_ms()
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def _ticks_diff(newer, older):
+        if hasattr(time, "ticks_diff"):
+            return time.ticks_diff(newer, older)
+        return newer - older
+
+
+class RpcDispatcher:
+    """
+    Provider side: routes calls to handlers by service id. A handler may be
+    a plain function, answered inline from poll(), or a coroutine function,
+    run as a task and cancelled at the caller's deadline.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self._services = {}
+        # service_id -> inspect.Signature, or None where it is unavailable.
+        self._signatures = {}
+        self.calls_handled = 0
+        self.calls_failed = 0
+        self.calls_expired = 0
+        endpoint.register_handler(Schema.TYPE_CALL, self._on_call)
+
+    def register(self, service_id, handler):
+        """Route calls for service_id to handler; returns the previous handler."""
+        service_id = int(service_id)
+        previous = self._services.get(service_id)
+        self._services[service_id] = handler
+        self._signatures[service_id] = _signature(handler)
+        return previous
+
+    def unregister(self, service_id):
+        service_id = int(service_id)
+        self._signatures.pop(service_id, None)
+        return self._services.pop(service_id, None)
+
+    def _on_call(self, peer_id, message):
+        handler = self._services.get(message[Schema.F_SERVICE_ID])
+        if handler is None:
+            self._reply(peer_id, message, None, ERR_NO_SERVICE)
+            return
+        args = message.get(Schema.F_ARGS)
+        if args is None:
+            positional, keywords = (), {}
+        elif isinstance(args, list):
+            positional, keywords = args, {}
+        elif isinstance(args, dict):
+            positional, keywords = (), args
+        else:
+            positional, keywords = (args,), {}
+        # Bind before calling, so a TypeError raised inside the handler is
+        # reported as a failure rather than as bad arguments.
+        signature = self._signatures.get(message[Schema.F_SERVICE_ID])
+        if signature is not None:
+            try:
+                signature.bind(*positional, **keywords)
+            except TypeError as exc:
+                self.calls_failed += 1
+                self._reply(peer_id, message, str(exc), ERR_BAD_ARGS)
+                return
+        try:
+            result = handler(*positional, **keywords)
+        except Exception as exc:
+            self.calls_failed += 1
+            self._reply(peer_id, message, str(exc), ERR_FAILED)
+            return
+        if hasattr(result, "send") and hasattr(result, "throw"):
+            try:
+                asyncio.create_task(self._finish(peer_id, message, result))
+            except Exception as exc:
+                self.calls_failed += 1
+                self._reply(peer_id, message, str(exc), ERR_FAILED)
+            return
+        self.calls_handled += 1
+        self._reply(peer_id, message, result, None)
+
+    async def _finish(self, peer_id, message, coroutine):
+        deadline_ms = message.get(Schema.F_DEADLINE)
+        try:
+            if deadline_ms is None:
+                result = await coroutine
+            else:
+                result = await asyncio.wait_for(coroutine, deadline_ms / 1000.0)
+        except asyncio.TimeoutError:
+            # The caller has given up; a late reply would only cost airtime.
+            self.calls_expired += 1
+            return
+        except Exception as exc:
+            self.calls_failed += 1
+            self._reply(peer_id, message, str(exc), ERR_FAILED)
+            return
+        self.calls_handled += 1
+        self._reply(peer_id, message, result, None)
+
+    def _reply(self, peer_id, message, result, error):
+        endpoint = self.endpoint
+        codec = endpoint.codec
+        request_id = message[Schema.F_REQUEST_ID]
+        version = message[Schema.F_VERSION]
+        try:
+            payload = codec.encode_call_reply(endpoint.node_id, request_id, result=result, error=error, version=version)
+        except Exception as exc:
+            # A result that cannot be serialised (TypeError/ValueError from
+            # the encoder), or one that would not fit a frame, is answered
+            # as a failure instead of raising out of poll().
+            payload = None
+            detail = str(exc)
+        else:
+            if len(payload) > codec.max_short_packet_bytes:
+                detail = "reply of {} bytes exceeds {}".format(len(payload), codec.max_short_packet_bytes)
+                payload = None
+        if payload is None:
+            payload = codec.encode_call_reply(endpoint.node_id, request_id, result=detail, error=ERR_FAILED, version=version)
+            if len(payload) > codec.max_short_packet_bytes:
+                payload = codec.encode_call_reply(endpoint.node_id, request_id, error=ERR_FAILED, version=version)
+        endpoint._send(peer_id, payload)
+
+def _signature(handler):
+    if inspect is None or not hasattr(inspect, "signature"):
+        return None
+    try:
+        return inspect.signature(handler)
+    except (TypeError, ValueError):
+        return None
@@ -8,6 +8,9 @@ small wireless packet budgets.
 
 class Schema:
     PROTOCOL_VERSION = 1
+    # Same message model packed with struct instead of JSON (see binary.py).
+    PROTOCOL_VERSION_BINARY = 2
+    SUPPORTED_VERSIONS = (PROTOCOL_VERSION, PROTOCOL_VERSION_BINARY)
 
     # Message type codes (1 byte when serialized).
     TYPE_ADVERTISE = "a"      # Short capability advertisement (broadcast).
@@ -15,6 +18,15 @@ class Schema:
     TYPE_QUERY_RESULT = "i"   # Response with candidate providers.
     TYPE_GET_PROFILE = "g"    # Request full profile from a node.
     TYPE_PROFILE = "p"        # Full profile response.
+    TYPE_PROFILE_DELTA = "d"  # Changes between two profile hashes.
+    TYPE_GOSSIP_DIGEST = "y"  # Bucketed registry digest (anti-entropy).
+    TYPE_GOSSIP_PULL = "u"    # Request entries of differing digest buckets.
+    TYPE_GOSSIP_ENTRIES = "e" # Registry entries answering a pull.
+    TYPE_SUBSCRIBE = "s"      # Topic subscription lease (broadcast).
+    TYPE_PUBLISH = "m"        # Batch of topic events for subscribers.
+    TYPE_TELEMETRY = "w"      # Block of fixed-point sensor samples.
+    TYPE_CALL = "c"           # Invoke a service on a provider.
+    TYPE_CALL_REPLY = "o"     # Outcome of a call.
 
     # Hard packet limit for compact advertisements.
     SHORT_PACKET_MAX_BYTES = 205
@@ -28,6 +40,8 @@ class Schema:
     F_SERVICE_ID = "sid"
     F_PROVIDERS = "p"
     F_TARGET = "to"
+    # Optional request id (uint16) on requests, echoed in their replies.
+    F_REQUEST_ID = "r"
 
     # Long profile fields.
     F_NODE_NAME = "name"
@@ -35,27 +49,184 @@ class Schema:
     F_FIRMWARE = "fw"
     F_META = "meta"
 
+    # Profile delta fields.
+    F_PREV_HASH = "ph"
+    F_SERVICES_ADDED = "sa"
+    F_SERVICES_CHANGED = "sc"
+    F_SERVICES_REMOVED = "sr"
+    F_META_SET = "ms"
+    F_META_REMOVED = "mr"
+    # Long profile fields (name, role, fw) the new profile no longer has.
+    F_CLEARED = "cl"
+
+    # Gossip fields.
+    F_DIGEST = "dg"
+    F_BUCKETS = "bk"
+    F_ENTRIES = "en"
+
+    # Pub/sub fields.
+    F_TOPICS = "tp"
+    F_LEASE = "ls"
+    F_EVENTS = "ev"
+
+    # Telemetry fields. Sample j of a block was taken at
+    # time_base_ms + j * period_us / 1000; values are ints scaled by
+    # 2**frac_bits.
+    F_STREAM = "st"
+    F_SEQ = "sq"
+    F_TIME_BASE = "tb"
+    F_PERIOD_US = "pu"
+    F_FRAC_BITS = "fb"
+    F_ENCODING = "ec"
+    F_SAMPLES = "sm"
+
+    # Remote call fields. Calls always carry a request id ("r").
+    F_ARGS = "a"
+    F_DEADLINE = "dl"
+    F_RESULT = "rv"
+    F_ERROR = "er"
+
+    # Field value kinds; MessageCodec compiles these into checks.
+    # "fields" lists checks in evaluation order, cheapest first.
+    KIND_STR = "str"
+    KIND_ID = "id"                  # Non-empty string.
+    KIND_SERVICE_ID = "sid"         # uint16.
+    KIND_SERVICE_IDS = "sids"       # Non-empty array of uint16.
+    KIND_SERVICE_SET = "sset"       # Any service_set encoding.
+    KIND_NODE_IDS = "ids"           # Array of non-empty strings (ids, keys).
+    KIND_PROFILE_SERVICES = "svcs"  # Array of objects each with uint16 "sid".
+    KIND_OBJECT = "obj"
+    KIND_REQUEST_ID = "rid"         # uint16.
+    KIND_UINT16 = "u16"
+    KIND_GOSSIP_ENTRIES = "gent"    # Array of [node_id, hash, age_ms, service set].
+    KIND_EVENTS = "evts"            # Array of [topic, payload].
+    KIND_UINT8 = "u8"
+    KIND_UINT32 = "u32"
+    KIND_SAMPLES = "smp"            # Non-empty array of equal-length int arrays.
+    KIND_ANY = "any"                # Any JSON value.
+
     SHORT_ADVERTISE_SCHEMA = {
         "required": (F_VERSION, F_TYPE, F_NODE_ID, F_PROFILE_HASH, F_SERVICES),
         "type": TYPE_ADVERTISE,
+        "fields": ((F_PROFILE_HASH, KIND_STR), (F_SERVICES, KIND_SERVICE_SET)),
     }
 
     QUERY_SCHEMA = {
         "required": (F_VERSION, F_TYPE, F_NODE_ID, F_SERVICE_ID),
         "type": TYPE_QUERY,
+        "fields": ((F_SERVICE_ID, KIND_SERVICE_ID),),
+        "optional": ((F_REQUEST_ID, KIND_REQUEST_ID),),
     }
 
     QUERY_RESULT_SCHEMA = {
         "required": (F_VERSION, F_TYPE, F_NODE_ID, F_SERVICE_ID, F_PROVIDERS),
         "type": TYPE_QUERY_RESULT,
+        "fields": ((F_SERVICE_ID, KIND_SERVICE_ID), (F_PROVIDERS, KIND_NODE_IDS)),
+        "optional": ((F_REQUEST_ID, KIND_REQUEST_ID),),
     }
 
     GET_PROFILE_SCHEMA = {
         "required": (F_VERSION, F_TYPE, F_NODE_ID, F_TARGET),
         "type": TYPE_GET_PROFILE,
+        "fields": ((F_TARGET, KIND_ID),),
+        "optional": ((F_REQUEST_ID, KIND_REQUEST_ID),),
     }
 
     PROFILE_SCHEMA = {
         "required": (F_VERSION, F_TYPE, F_NODE_ID, F_PROFILE_HASH, F_SERVICES),
         "type": TYPE_PROFILE,
+        "fields": ((F_PROFILE_HASH, KIND_STR), (F_SERVICES, KIND_PROFILE_SERVICES)),
+        "optional": ((F_META, KIND_OBJECT), (F_REQUEST_ID, KIND_REQUEST_ID)),
     }
+
+    PROFILE_DELTA_SCHEMA = {
+        "required": (F_VERSION, F_TYPE, F_NODE_ID, F_PROFILE_HASH, F_PREV_HASH),
+        "type": TYPE_PROFILE_DELTA,
+        "fields": ((F_PROFILE_HASH, KIND_STR), (F_PREV_HASH, KIND_STR)),
+        "optional": (
+            (F_NODE_NAME, KIND_STR),
+            (F_ROLE, KIND_STR),
+            (F_FIRMWARE, KIND_STR),
+            (F_SERVICES_REMOVED, KIND_SERVICE_IDS),
+            (F_META_REMOVED, KIND_NODE_IDS),
+            (F_META_SET, KIND_OBJECT),
+            (F_CLEARED, KIND_NODE_IDS),
+            (F_SERVICES_ADDED, KIND_PROFILE_SERVICES),
+            (F_SERVICES_CHANGED, KIND_PROFILE_SERVICES),
+        ),
+    }
+
+    GOSSIP_DIGEST_SCHEMA = {
+        "required": (F_VERSION, F_TYPE, F_NODE_ID, F_DIGEST),
+        "type": TYPE_GOSSIP_DIGEST,
+        "fields": ((F_DIGEST, KIND_STR),),
+    }
+
+    GOSSIP_PULL_SCHEMA = {
+        "required": (F_VERSION, F_TYPE, F_NODE_ID, F_BUCKETS),
+        "type": TYPE_GOSSIP_PULL,
+        "fields": ((F_BUCKETS, KIND_UINT16),),
+        "optional": ((F_TARGET, KIND_ID),),
+    }
+
+    GOSSIP_ENTRIES_SCHEMA = {
+        "required": (F_VERSION, F_TYPE, F_NODE_ID, F_ENTRIES),
+        "type": TYPE_GOSSIP_ENTRIES,
+        "fields": ((F_ENTRIES, KIND_GOSSIP_ENTRIES),),
+    }
+
+    SUBSCRIBE_SCHEMA = {
+        "required": (F_VERSION, F_TYPE, F_NODE_ID, F_TOPICS, F_LEASE),
+        "type": TYPE_SUBSCRIBE,
+        "fields": ((F_TOPICS, KIND_NODE_IDS), (F_LEASE, KIND_UINT16)),
+    }
+
+    PUBLISH_SCHEMA = {
+        "required": (F_VERSION, F_TYPE, F_NODE_ID, F_EVENTS),
+        "type": TYPE_PUBLISH,
+        "fields": ((F_EVENTS, KIND_EVENTS),),
+    }
+
+    TELEMETRY_SCHEMA = {
+        "required": (F_VERSION, F_TYPE, F_NODE_ID, F_STREAM, F_SEQ, F_TIME_BASE, F_PERIOD_US, F_SAMPLES),
+        "type": TYPE_TELEMETRY,
+        "fields": (
+            (F_STREAM, KIND_UINT8),
+            (F_SEQ, KIND_UINT16),
+            (F_TIME_BASE, KIND_UINT32),
+            (F_PERIOD_US, KIND_UINT32),
+            (F_SAMPLES, KIND_SAMPLES),
+        ),
+        "optional": ((F_FRAC_BITS, KIND_UINT8), (F_ENCODING, KIND_UINT8)),
+    }
+
+    CALL_SCHEMA = {
+        "required": (F_VERSION, F_TYPE, F_NODE_ID, F_SERVICE_ID, F_REQUEST_ID),
+        "type": TYPE_CALL,
+        "fields": ((F_SERVICE_ID, KIND_SERVICE_ID), (F_REQUEST_ID, KIND_REQUEST_ID)),
+        "optional": ((F_ARGS, KIND_ANY), (F_DEADLINE, KIND_UINT16)),
+    }
+
+    CALL_REPLY_SCHEMA = {
+        "required": (F_VERSION, F_TYPE, F_NODE_ID, F_REQUEST_ID),
+        "type": TYPE_CALL_REPLY,
+        "fields": ((F_REQUEST_ID, KIND_REQUEST_ID),),
+        "optional": ((F_RESULT, KIND_ANY), (F_ERROR, KIND_STR)),
+    }
+
+    MESSAGE_SCHEMAS = (
+        SHORT_ADVERTISE_SCHEMA,
+        QUERY_SCHEMA,
+        QUERY_RESULT_SCHEMA,
+        GET_PROFILE_SCHEMA,
+        PROFILE_SCHEMA,
+        PROFILE_DELTA_SCHEMA,
+        GOSSIP_DIGEST_SCHEMA,
+        GOSSIP_PULL_SCHEMA,
+        GOSSIP_ENTRIES_SCHEMA,
+        SUBSCRIBE_SCHEMA,
+        PUBLISH_SCHEMA,
+        TELEMETRY_SCHEMA,
+        CALL_SCHEMA,
+        CALL_REPLY_SCHEMA,
+    )
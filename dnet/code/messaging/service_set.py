@@ -0,0 +1,203 @@
+"""
+Compact encodings for advertised service id sets.
+
+The advertise "s" field may hold any of:
+- plain array of uint16 ids: [101, 102, 205]
+- run-length ranges mixed with ids, pairs are inclusive: [1, [100, 160], 900]
+- base plus bitmap for dense blocks: {"b": 100, "m": "<base64>"}
+  where bit i (LSB first within each byte) marks service id b + i
+- Bloom digest for very large sets: {"f": "<base64>", "k": 3}
+  membership is probabilistic, so lookups may return false positives
+"""
+
+import json
+
+try:
+    import ubinascii
+except Exception:
+    import binascii as ubinascii
+
+
+F_BITMAP_BASE = "b"
+F_BITMAP = "m"
+F_BLOOM = "f"
+F_BLOOM_HASHES = "k"
+
+_BLOOM_MAX_HASHES = 8
+
+
+def compact(service_ids):
+    """Return the smallest exact encoding of service_ids."""
+    ids = sorted(set(service_ids))
+    best = ids
+    best_len = _json_len(ids)
+    for candidate in (encode_ranges(ids), encode_bitmap(ids)):
+        size = _json_len(candidate)
+        if size < best_len:
+            best = candidate
+            best_len = size
+    return best
+
+
+def encode_ranges(service_ids):
+    ids = sorted(set(service_ids))
+    out = []
+    i = 0
+    count = len(ids)
+    while i < count:
+        j = i
+        while j + 1 < count and ids[j + 1] == ids[j] + 1:
+            j += 1
+        # Runs of 3+ are cheaper as [start, end] than as separate ids.
+        if j - i >= 2:
+            out.append([ids[i], ids[j]])
+        else:
+            out.extend(ids[i:j + 1])
+        i = j + 1
+    return out
+
+
+def encode_bitmap(service_ids):
+    ids = sorted(set(service_ids))
+    if not ids:
+        return ids
+    base = ids[0]
+    bitmap = bytearray((ids[-1] - base) // 8 + 1)
+    for service_id in ids:
+        offset = service_id - base
+        bitmap[offset >> 3] |= 1 << (offset & 7)
+    return {F_BITMAP_BASE: base, F_BITMAP: _b64(bitmap)}
+
+
+def encode_bloom(service_ids, max_json_bytes):
+    """Bloom digest whose JSON form fits in max_json_bytes."""
+    ids = set(service_ids)
+    # {"f":"","k":N} costs 14 bytes around the base64 body.
+    body_bytes = ((int(max_json_bytes) - 14) // 4) * 3
+    if body_bytes <= 0:
+        raise ValueError("no room for a service digest ({} bytes)".format(max_json_bytes))
+    bits = body_bytes * 8
+    # Optimal hash count is (m / n) * ln 2.
+    hashes = (bits * 69) // (max(1, len(ids)) * 100)
+    hashes = max(1, min(_BLOOM_MAX_HASHES, hashes))
+    bloom = BloomDigest(bytearray(body_bytes), hashes)
+    for service_id in ids:
+        bloom.add(service_id)
+    return {F_BLOOM: _b64(bloom.bits), F_BLOOM_HASHES: hashes}
+
+
+def expand(value):
+    """List of service ids for exact encodings, None for a Bloom digest."""
+    if isinstance(value, list):
+        out = []
+        for entry in value:
+            if isinstance(entry, list):
+                out.extend(range(entry[0], entry[1] + 1))
+            else:
+                out.append(entry)
+        return out
+    if F_BLOOM in value:
+        return None
+    base = value[F_BITMAP_BASE]
+    bitmap = ubinascii.a2b_base64(value[F_BITMAP])
+    out = []
+    for index in range(len(bitmap)):
+        byte = bitmap[index]
+        if not byte:
+            continue
+        for bit in range(8):
+            if byte & (1 << bit):
+                out.append(base + (index << 3) + bit)
+    return out
+
+
+def digest(value):
+    """BloomDigest for a Bloom-encoded set, otherwise None."""
+    if isinstance(value, dict) and F_BLOOM in value:
+        return BloomDigest(ubinascii.a2b_base64(value[F_BLOOM]), value[F_BLOOM_HASHES])
+    return None
+
+
+def is_valid(value):
+    if isinstance(value, list):
+        if not value:
+            return False
+        for entry in value:
+            if isinstance(entry, list):
+                if len(entry) != 2 or not _is_uint16(entry[0]) or not _is_uint16(entry[1]):
+                    return False
+                if entry[0] > entry[1]:
+                    return False
+            elif not _is_uint16(entry):
+                return False
+        return True
+    if not isinstance(value, dict):
+        return False
+    if F_BLOOM in value:
+        hashes = value.get(F_BLOOM_HASHES)
+        if not isinstance(hashes, int) or not 1 <= hashes <= _BLOOM_MAX_HASHES:
+            return False
+        return bool(_b64_decode(value[F_BLOOM]))
+    base = value.get(F_BITMAP_BASE)
+    if not _is_uint16(base):
+        return False
+    bitmap = _b64_decode(value.get(F_BITMAP))
+    if bitmap is None:
+        return False
+    # The highest marked id must still be a uint16.
+    for index in range(len(bitmap) - 1, -1, -1):
+        byte = bitmap[index]
+        if byte:
+            top = 7
+            while not byte & (1 << top):
+                top -= 1
+            return base + (index << 3) + top <= 65535
+    return True
+
+
+class BloomDigest:
+    """Bloom filter over uint16 service ids using double hashing."""
+
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = int(hashes)
+        self._size = len(bits) * 8
+
+    def add(self, service_id):
+        for index in self._indexes(service_id):
+            self.bits[index >> 3] |= 1 << (index & 7)
+
+    def __contains__(self, service_id):
+        if not self._size:
+            return False
+        for index in self._indexes(service_id):
+            if not self.bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def _indexes(self, service_id):
+        h1 = (int(service_id) * 0x9E3779B1) & 0xFFFFFFFF
+        h2 = ((int(service_id) * 0x85EBCA6B) & 0xFFFFFFFF) | 1
+        for i in range(self.hashes):
+            yield ((h1 + i * h2) & 0xFFFFFFFF) % self._size
+
+
+def _is_uint16(value):
+    return isinstance(value, int) and 0 <= value <= 65535
+
+
+def _b64_decode(text):
+    if not isinstance(text, str):
+        return None
+    try:
+        return ubinascii.a2b_base64(text)
+    except Exception:
+        return None
+
+
+def _b64(data):
+    return ubinascii.b2a_base64(bytes(data)).decode().strip()
+
+
+def _json_len(value):
+    return len(json.dumps(value, separators=(",", ":")))
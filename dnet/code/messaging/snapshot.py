@@ -0,0 +1,281 @@
+"""
+Registry snapshots for fast warm starts.
+
+A snapshot is a small versioned binary file (all integers big-endian):
+
+    header  "DNRS" magic, u8 version, u8 flags, u16 reserved, u32 count
+    record  u8 len + node_id
+            u8 len + profile_hash
+            u32 age_ms            (snapshot time minus last_seen_ms)
+            u16 count + u16 service ids
+            name, role, firmware  (u8 len + utf-8 each, len 0xFF = None)
+            u16 len + profile JSON (len 0xFFFF = None)
+            u8 len + retained_hash (len 0xFF = None)
+    trailer u32 CRC-32 of all records (when flags bit 0 is set)
+
+Files are written to "<path>.tmp" and renamed over the old snapshot, so a
+reset mid-write leaves the previous snapshot intact. Restored records are
+marked unverified until their node is heard from again. On CPython the
+file is parsed straight from an mmap.
+
+Version 1 files, which lack retained_hash, still load; their retained
+profiles match no hash, so the first delta for such a node falls back to
+a full profile fetch.
+"""
+
+import os
+
+try:
+    import ustruct as struct
+except Exception:
+    import struct
+try:
+    import ubinascii
+except Exception:
+    import binascii as ubinascii
+try:
+    import uasyncio as asyncio
+except Exception:
+    import asyncio
+try:
+    import mmap
+except Exception:
+    mmap = None
+
+from array import array
+
+from .registry import NodeRecord
+
+
+MAGIC = b"DNRS"
+SNAPSHOT_VERSION = 2
+
+_HEADER = ">4sBBHI"
+_HEADER_BYTES = 12
+_FLAG_CRC = 0x01
+_NONE_STR = 0xFF
+_NONE_JSON = 0xFFFF
+
+_crc32 = getattr(ubinascii, "crc32", None)
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def save_snapshot(registry, path, now_ms=None):
+    """Atomically write every registry node to path. Returns the node count."""
+    if now_ms is None:
+        now_ms = registry._now_ms()
+    nodes = registry.all_nodes()
+    tmp_path = path + ".tmp"
+    crc = 0
+    flags = _FLAG_CRC if _crc32 is not None else 0
+    with open(tmp_path, "wb") as handle:
+        handle.write(struct.pack(_HEADER, MAGIC, SNAPSHOT_VERSION, flags, 0, len(nodes)))
+        for record in nodes.values():
+            chunk = _encode_record(record, now_ms)
+            if _crc32 is not None:
+                crc = _crc32(chunk, crc)
+            handle.write(chunk)
+        handle.write(struct.pack(">I", crc & 0xFFFFFFFF))
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Some flash filesystems refuse to rename over an existing file.
+        os.remove(path)
+        os.rename(tmp_path, path)
+    return len(nodes)
+
+
+def load_snapshot(registry, path, now_ms=None):
+    """
+    Restore nodes from a snapshot into registry, ages counted from now_ms.
+    Returns the number of records restored, 0 when no snapshot exists.
+    Raises SnapshotError for a corrupt or unsupported file.
+    """
+    if now_ms is None:
+        now_ms = registry._now_ms()
+    for candidate in (path, path + ".tmp"):
+        try:
+            handle = open(candidate, "rb")
+        except OSError:
+            continue
+        with handle:
+            return _load_from(registry, handle, int(now_ms))
+    return 0
+
+
+class Snapshotter:
+    """
+    Saves the registry every interval_ms, but only after its membership has
+    changed; re-sightings alone do not make it dirty.
+    """
+
+    def __init__(self, registry, path, interval_ms=30000):
+        self.registry = registry
+        self.path = path
+        self.interval_ms = int(interval_ms)
+        self._saved_version = registry.membership_version
+        self._last_save_ms = None
+        self.saves = 0
+        self.errors = 0
+
+    def maybe_save(self, now_ms=None):
+        if now_ms is None:
+            now_ms = self.registry._now_ms()
+        if self._last_save_ms is not None and now_ms - self._last_save_ms < self.interval_ms:
+            return False
+        self._last_save_ms = now_ms
+        if self.registry.membership_version == self._saved_version:
+            return False
+        version = self.registry.membership_version
+        try:
+            save_snapshot(self.registry, self.path, now_ms)
+        except Exception as exc:
+            self.errors += 1
+            print("Snapshotter: save failed ({})".format(exc))
+            return False
+        self._saved_version = version
+        self.saves += 1
+        return True
+
+    async def run(self):
+        while True:
+            self.maybe_save()
+            await _sleep_ms(self.interval_ms)
+
+
+def _encode_record(record, now_ms):
+    node_id = record.node_id.encode("utf-8")
+    profile_hash = str(record.profile_hash or "").encode("utf-8")
+    ids = record.service_ids
+    age = max(0, min(0xFFFFFFFF, int(now_ms) - int(record.last_seen_ms or now_ms)))
+    parts = [
+        struct.pack(">B", len(node_id)),
+        node_id,
+        struct.pack(">B", len(profile_hash)),
+        profile_hash,
+        struct.pack(">IH", age, len(ids)),
+        struct.pack(">{}H".format(len(ids)), *ids),
+        _encode_str(record.name),
+        _encode_str(record.role),
+        _encode_str(record.firmware),
+    ]
+    if record.profile_json is None:
+        parts.append(struct.pack(">H", _NONE_JSON))
+    else:
+        blob = record.profile_json.encode("utf-8")
+        if len(blob) >= _NONE_JSON:
+            parts.append(struct.pack(">H", _NONE_JSON))
+        else:
+            parts.append(struct.pack(">H", len(blob)))
+            parts.append(blob)
+    parts.append(_encode_str(record.retained_hash))
+    return b"".join(parts)
+
+
+def _encode_str(value):
+    if value is None:
+        return struct.pack(">B", _NONE_STR)
+    data = str(value).encode("utf-8")
+    if len(data) >= _NONE_STR:
+        # Cut on a character boundary: drop UTF-8 continuation bytes.
+        end = _NONE_STR - 1
+        while end and data[end] & 0xC0 == 0x80:
+            end -= 1
+        data = data[:end]
+    return struct.pack(">B", len(data)) + data
+
+
+def _load_from(registry, handle, now_ms):
+    mapped = None
+    if mmap is not None and hasattr(handle, "fileno"):
+        try:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            mapped = None
+    view = memoryview(mapped if mapped is not None else handle.read())
+    try:
+        return _parse(registry, view, now_ms)
+    finally:
+        if mapped is not None:
+            # CPython refuses to close an mmap while a view still exports it.
+            view.release()
+            mapped.close()
+
+
+def _parse(registry, view, now_ms):
+    if len(view) < _HEADER_BYTES + 4:
+        raise SnapshotError("snapshot too short")
+    magic, version, flags, _, count = struct.unpack_from(_HEADER, view, 0)
+    if bytes(magic) != MAGIC:
+        raise SnapshotError("not a registry snapshot")
+    if version not in (1, SNAPSHOT_VERSION):
+        raise SnapshotError("unsupported snapshot version {}".format(version))
+    end = len(view) - 4
+    if flags & _FLAG_CRC and _crc32 is not None:
+        stored = struct.unpack_from(">I", view, end)[0]
+        if _crc32(view[_HEADER_BYTES:end]) & 0xFFFFFFFF != stored:
+            raise SnapshotError("snapshot checksum mismatch")
+
+    records = []
+    offset = _HEADER_BYTES
+    try:
+        for _ in range(count):
+            node_id, offset = _read_bytes(view, offset, 1)
+            record = NodeRecord(bytes(node_id).decode())
+            profile_hash, offset = _read_bytes(view, offset, 1)
+            record.profile_hash = bytes(profile_hash).decode()
+            age, id_count = struct.unpack_from(">IH", view, offset)
+            offset += 6
+            record.service_ids = array("H", struct.unpack_from(">{}H".format(id_count), view, offset))
+            offset += 2 * id_count
+            record.last_seen_ms = now_ms - age
+            record.name, offset = _read_str(view, offset)
+            record.role, offset = _read_str(view, offset)
+            record.firmware, offset = _read_str(view, offset)
+            size = struct.unpack_from(">H", view, offset)[0]
+            offset += 2
+            if size != _NONE_JSON:
+                record.profile_json = bytes(view[offset:offset + size]).decode()
+                offset += size
+            if version > 1:
+                record.retained_hash, offset = _read_str(view, offset)
+            records.append(record)
+    except Exception as exc:
+        raise SnapshotError("malformed snapshot record: {}".format(exc))
+    if offset > end:
+        raise SnapshotError("truncated snapshot")
+
+    restored = 0
+    for record in records:
+        if registry.restore(record):
+            restored += 1
+    return restored
+
+
+def _read_bytes(view, offset, width):
+    if width == 1:
+        size = view[offset]
+    else:
+        size = struct.unpack_from(">H", view, offset)[0]
+    start = offset + width
+    if start + size > len(view):
+        raise SnapshotError("truncated field")
+    return view[start:start + size], start + size
+
+
+def _read_str(view, offset):
+    size = view[offset]
+    if size == _NONE_STR:
+        return None, offset + 1
+    data, offset = _read_bytes(view, offset, 1)
+    return bytes(data).decode(), offset
+
+
+async def _sleep_ms(delay_ms):
+    try:
+        await asyncio.sleep_ms(delay_ms)
+    except AttributeError:
+        await asyncio.sleep(delay_ms / 1000)
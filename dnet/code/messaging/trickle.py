@@ -0,0 +1,189 @@
+try:
+    import utime as time
+except Exception:
+    import time
+
+try:
+    import uasyncio as asyncio
+except Exception:
+    import asyncio
+
+import random
+
+from .registry import ServiceRegistry
+from .schema import Schema
+
+
+class TrickleTimer:
+    """
+    Trickle timer (RFC 6206) for periodic broadcasts.
+
+    Each interval I transmits once at a random point t in [I/2, I) unless k
+    or more consistent transmissions were already heard during the interval.
+    I doubles up to imin_ms * 2**imax_doublings while the network stays
+    consistent and drops back to imin_ms on any inconsistency or local change.
+    """
+
+    def __init__(self, imin_ms=1000, imax_doublings=5, k=2):
+        self.imin_ms = int(imin_ms)
+        self.imax_ms = self.imin_ms << int(imax_doublings)
+        self.k = int(k)
+        self.interval_ms = self.imin_ms
+        self.transmissions = 0
+        self.suppressed = 0
+        self._counter = 0
+        self._interval_start = 0
+        self._fire_at = 0
+        self._fired = False
+        self._start_interval(self._now_ms())
+
+    def reset(self):
+        """Restart at the minimum interval (local state changed)."""
+        self.interval_ms = self.imin_ms
+        self._start_interval(self._now_ms())
+
+    def hear_consistent(self):
+        self._counter += 1
+
+    def hear_inconsistent(self):
+        if self.interval_ms > self.imin_ms:
+            self.reset()
+
+    def poll(self, now_ms=None):
+        """Advance the timer; return True when the caller should transmit now."""
+        if now_ms is None:
+            now_ms = self._now_ms()
+        if self._ticks_diff(now_ms, self._interval_start) >= self.interval_ms:
+            self.interval_ms = min(self.interval_ms * 2, self.imax_ms)
+            self._start_interval(now_ms)
+        if self._fired or self._ticks_diff(now_ms, self._fire_at) < 0:
+            return False
+        self._fired = True
+        if self._counter >= self.k:
+            self.suppressed += 1
+            return False
+        self.transmissions += 1
+        return True
+
+    def ms_until_next_event(self, now_ms=None):
+        if now_ms is None:
+            now_ms = self._now_ms()
+        if not self._fired:
+            return max(0, self._ticks_diff(self._fire_at, now_ms))
+        end = self._ticks_add(self._interval_start, self.interval_ms)
+        return max(0, self._ticks_diff(end, now_ms))
+
+    async def run(self, transmit):
+        """Call transmit() whenever the timer fires and is not suppressed."""
+        while True:
+            if self.poll():
+                transmit()
+            wait_ms = self.ms_until_next_event()
+            # Re-check at least every imin so a reset() is honoured promptly.
+            wait_ms = min(max(wait_ms, 1), self.imin_ms)
+            try:
+                await asyncio.sleep_ms(wait_ms)
+            except AttributeError:
+                await asyncio.sleep(wait_ms / 1000.0)
+
+    def _start_interval(self, now_ms):
+        half = self.interval_ms // 2
+        # Uniform jitter in [I/2, I) de-synchronizes neighbours.
+        jitter = (random.getrandbits(16) * (self.interval_ms - half)) >> 16
+        self._fire_at = self._ticks_add(now_ms, half + jitter)
+        self._interval_start = now_ms
+        self._counter = 0
+        self._fired = False
+
+    @staticmethod
+    def _now_ms():
+        if hasattr(time, "ticks_ms"):
+            return time.ticks_ms()
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def _ticks_diff(newer, older):
+        if hasattr(time, "ticks_diff"):
+            return time.ticks_diff(newer, older)
+        return newer - older
+
+    @staticmethod
+    def _ticks_add(ticks, delta):
+        if hasattr(time, "ticks_add"):
+            return time.ticks_add(ticks, delta)
+        return ticks + delta
+
+
+class AdvertiseScheduler(TrickleTimer):
+    """
+    Trickle timer driven by advertisement and profile traffic.
+
+    Trickle suppression only applies to transmissions that carry what this
+    node would send itself: a copy of our own advertisement (same node id
+    and hash, e.g. relayed) or a gossip digest equal to ours, which shows
+    the neighbour already holds our current entry. Other nodes' adverts
+    never suppress ours; a new sender or a changed hash is an inconsistency
+    and speeds everyone back up so newcomers are learned fast.
+
+    Registries drop nodes not heard from for ttl_ms, so the interval is
+    capped at max_silent_ms (ttl_ms // 2) and a node that has stayed silent
+    that long transmits even when suppressed.
+    """
+
+    def __init__(self, imin_ms=1000, imax_doublings=5, k=2, ttl_ms=None, node_id=None, profile_hash=None, digest=None):
+        TrickleTimer.__init__(self, imin_ms=imin_ms, imax_doublings=imax_doublings, k=k)
+        if ttl_ms is None:
+            ttl_ms = ServiceRegistry.DEFAULT_TTL_MS
+        self.max_silent_ms = int(ttl_ms) // 2
+        if self.max_silent_ms < self.imin_ms:
+            raise ValueError("ttl_ms {} too short for imin_ms {}".format(ttl_ms, self.imin_ms))
+        self.imax_ms = min(self.imax_ms, self.max_silent_ms)
+        self.node_id = node_id
+        self.profile_hash = profile_hash
+        # Callable returning this node's gossip digest, e.g. RegistryGossip.digest.
+        self.digest = digest
+        self.forced = 0
+        self._heard = {}
+        self._last_sent = self._now_ms()
+
+    def set_local(self, node_id, profile_hash):
+        """Identity this node advertises; a changed hash resets the timer."""
+        changed = profile_hash != self.profile_hash
+        self.node_id = node_id
+        self.profile_hash = profile_hash
+        if changed:
+            self.reset()
+
+    def observe(self, message):
+        mtype = message.get(Schema.F_TYPE)
+        if mtype == Schema.TYPE_GOSSIP_DIGEST:
+            if self.digest is not None and message.get(Schema.F_DIGEST) == self.digest():
+                self.hear_consistent()
+            return
+        if mtype != Schema.TYPE_ADVERTISE and mtype != Schema.TYPE_PROFILE:
+            return
+        node_id = message.get(Schema.F_NODE_ID)
+        profile_hash = message.get(Schema.F_PROFILE_HASH)
+        if node_id == self.node_id:
+            if profile_hash == self.profile_hash:
+                self.hear_consistent()
+            return
+        if self._heard.get(node_id) == profile_hash:
+            return
+        self._heard[node_id] = profile_hash
+        self.hear_inconsistent()
+
+    def poll(self, now_ms=None):
+        if now_ms is None:
+            now_ms = self._now_ms()
+        if TrickleTimer.poll(self, now_ms):
+            self._last_sent = now_ms
+            return True
+        if self._ticks_diff(now_ms, self._last_sent) >= self.max_silent_ms:
+            # Suppressed too long: registries would start expiring us.
+            self.forced += 1
+            self.transmissions += 1
+            self._last_sent = now_ms
+            self._fired = True
+            return True
+        return False
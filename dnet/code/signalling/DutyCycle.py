@@ -0,0 +1,355 @@
+try:
+    import ustruct as struct
+except Exception:
+    import struct
+try:
+    import utime as time
+except Exception:
+    import time
+
+try:
+    import uasyncio as asyncio
+except Exception:
+    import asyncio
+
+
+_MAGIC = b"\x7fW"
+_VERSION = 1
+_KIND_SCHEDULE = 0
+_KIND_SCHEDULE_ACK = 1
+_KIND_AWAKE = 2
+_SCHEDULE_FORMAT = ">2sBBII"
+_SCHEDULE_ACK_FORMAT = ">2sBBIIq"
+_AWAKE_FORMAT = ">2sBB"
+
+DEFAULT_PERIOD_MS = 1000
+DEFAULT_WINDOW_MS = 50
+
+
+class WakeSchedule:
+    """Periodic wake window of window_ms every period_ms, anchored in mesh time."""
+
+    def __init__(self, period_ms, window_ms, anchor_ms=0):
+        period_ms = int(period_ms)
+        window_ms = int(window_ms)
+        if period_ms <= 0 or window_ms <= 0 or window_ms > period_ms:
+            raise ValueError("invalid wake schedule period={} window={}".format(period_ms, window_ms))
+        self.period_ms = period_ms
+        self.window_ms = window_ms
+        self.anchor_ms = int(anchor_ms)
+
+    def phase(self, mesh_ms):
+        return (int(mesh_ms) - self.anchor_ms) % self.period_ms
+
+    def is_awake(self, mesh_ms):
+        return self.phase(mesh_ms) < self.window_ms
+
+    def ms_until_window(self, mesh_ms):
+        """0 while inside a window, otherwise time until the next one opens."""
+        phase = self.phase(mesh_ms)
+        if phase < self.window_ms:
+            return 0
+        return self.period_ms - phase
+
+    def ms_left_in_window(self, mesh_ms):
+        phase = self.phase(mesh_ms)
+        if phase >= self.window_ms:
+            return 0
+        return self.window_ms - phase
+
+    def duty_ratio(self):
+        return self.window_ms / self.period_ms
+
+
+class DutyCycleGateway:
+    """
+    Gateway side of duty cycling.
+
+    Accepts wake schedules proposed by nodes, assigns each a staggered phase
+    so bursts don't collide, and holds unicast traffic for sleeping peers
+    until they report awake (or their window opens). Exposes the
+    MessagingEndpoint transport contract so it can wrap the mesh transport.
+    """
+
+    MAX_BUFFERED_PER_PEER = 16
+
+    def __init__(self, mesh, clock, default_peer="broadcast"):
+        self.mesh = mesh
+        self.clock = clock
+        self.default_peer = default_peer
+        self._transport = mesh.create_transport(default_peer=default_peer)
+        self._schedules = {}
+        self._buffers = {}
+        self._next_phase_ms = 0
+        self._buffered = 0
+        self._flushed = 0
+        self._dropped = 0
+        self._hold_ms_total = 0
+        mesh.register_frame_handler(_MAGIC, self._on_frame)
+
+    def send(self, peer_id, payload, reliable=False, on_delivery=None):
+        peer = self.default_peer if peer_id is None else peer_id
+        node_id = self._peer_node_id(peer)
+        schedule = self._schedules.get(node_id) if node_id is not None else None
+        if schedule is None or schedule.is_awake(self.clock.now_ms()):
+            return self._transport.send(peer, payload, reliable=reliable, on_delivery=on_delivery)
+        buffer = self._buffers.get(node_id)
+        if buffer is None:
+            buffer = []
+            self._buffers[node_id] = buffer
+        if len(buffer) >= self.MAX_BUFFERED_PER_PEER:
+            buffer.pop(0)
+            self._dropped += 1
+        buffer.append((payload, reliable, on_delivery, self.clock.now_ms()))
+        self._buffered += 1
+        return None
+
+    def recv(self):
+        return self._transport.recv()
+
+    def service(self):
+        """Flush buffers of peers whose window is open; call from the main loop."""
+        if not self._buffers:
+            return
+        now = self.clock.now_ms()
+        for node_id in list(self._buffers.keys()):
+            schedule = self._schedules.get(node_id)
+            if schedule is None or schedule.is_awake(now):
+                self._flush(node_id)
+
+    def get_schedule(self, node_id):
+        return self._schedules.get(node_id)
+
+    def stats(self):
+        flushed = self._flushed
+        return {
+            "sleepers": len(self._schedules),
+            "buffered": self._buffered,
+            "flushed": flushed,
+            "dropped": self._dropped,
+            "queued": sum(len(b) for b in self._buffers.values()),
+            "mean_hold_ms": (self._hold_ms_total // flushed) if flushed else 0,
+        }
+
+    def _flush(self, node_id):
+        buffer = self._buffers.pop(node_id, None)
+        if not buffer:
+            return
+        now = self.clock.now_ms()
+        for payload, reliable, on_delivery, queued_ms in buffer:
+            try:
+                self._transport.send(node_id, payload, reliable=reliable, on_delivery=on_delivery)
+            except Exception as exc:
+                self.mesh._log_error("duty-cycle flush failed peer={} err={}".format(node_id, exc))
+                continue
+            self._flushed += 1
+            self._hold_ms_total += now - queued_ms
+
+    def _on_frame(self, mac, payload):
+        if len(payload) < 4 or payload[2] != _VERSION:
+            return
+        node_id = self.mesh.mac_to_node_id(mac)
+        kind = payload[3]
+        if kind == _KIND_SCHEDULE:
+            _, _, _, period_ms, window_ms = struct.unpack(_SCHEDULE_FORMAT, bytes(payload))
+            self._accept_schedule(mac, node_id, period_ms, window_ms)
+        elif kind == _KIND_AWAKE:
+            self._flush(node_id)
+
+    def _accept_schedule(self, mac, node_id, period_ms, window_ms):
+        try:
+            schedule = WakeSchedule(period_ms, window_ms)
+        except ValueError as exc:
+            self.mesh._log_error("rejecting wake schedule peer={} err={}".format(node_id, exc))
+            return
+        existing = self._schedules.get(node_id)
+        if existing is not None and existing.period_ms == schedule.period_ms and existing.window_ms == schedule.window_ms:
+            schedule = existing
+        else:
+            # Stagger windows so buffered bursts to different sleepers don't collide.
+            phase = self._next_phase_ms % schedule.period_ms
+            self._next_phase_ms += schedule.window_ms
+            now = self.clock.now_ms()
+            schedule.anchor_ms = now - (now % schedule.period_ms) + phase
+            self._schedules[node_id] = schedule
+        frame = struct.pack(
+            _SCHEDULE_ACK_FORMAT,
+            _MAGIC,
+            _VERSION,
+            _KIND_SCHEDULE_ACK,
+            schedule.period_ms,
+            schedule.window_ms,
+            schedule.anchor_ms,
+        )
+        self.mesh.send_raw(mac, frame)
+
+    def _peer_node_id(self, peer):
+        if isinstance(peer, str):
+            if peer in ("*", "broadcast"):
+                return None
+            return peer.replace(":", "").replace("-", "").lower()
+        if peer == self.mesh.BROADCAST_TARGET:
+            return None
+        return self.mesh.mac_to_node_id(peer)
+
+
+class DutyCycledNode:
+    """
+    Node side of duty cycling.
+
+    Proposes a wake schedule to the gateway, then alternates between short
+    awake windows (announce awake, drain RX, run handlers) and sleep. Mesh
+    time from a synced MeshClock keeps windows aligned with the gateway.
+    light_sleep=True uses machine.lightsleep() between windows; otherwise the
+    radio relies on modem power save (LighthouseMesh(power_save=True)).
+    """
+
+    def __init__(
+        self,
+        mesh,
+        clock,
+        gateway_peer,
+        period_ms=None,
+        window_ms=None,
+        light_sleep=False,
+        poll_ms=10,
+    ):
+        self.mesh = mesh
+        self.clock = clock
+        self.gateway_peer = gateway_peer
+        self.period_ms = int(period_ms or DEFAULT_PERIOD_MS)
+        self.window_ms = int(window_ms or DEFAULT_WINDOW_MS)
+        self.light_sleep = bool(light_sleep)
+        self.poll_ms = int(poll_ms)
+        self.schedule = None
+        self._awake_ms = 0
+        self._sleep_ms = 0
+        self._windows = 0
+        mesh.register_frame_handler(_MAGIC, self._on_frame)
+
+    def request_schedule(self):
+        frame = struct.pack(
+            _SCHEDULE_FORMAT, _MAGIC, _VERSION, _KIND_SCHEDULE, self.period_ms, self.window_ms
+        )
+        self.mesh.send_raw(self.gateway_peer, frame)
+
+    def announce_awake(self):
+        self.mesh.send_raw(self.gateway_peer, struct.pack(_AWAKE_FORMAT, _MAGIC, _VERSION, _KIND_AWAKE))
+
+    def stats(self):
+        total = self._awake_ms + self._sleep_ms
+        return {
+            "windows": self._windows,
+            "awake_ms": self._awake_ms,
+            "sleep_ms": self._sleep_ms,
+            "duty_ratio": (self._awake_ms / total) if total else 1.0,
+        }
+
+    async def run(self, endpoint=None, on_message=None):
+        while self.schedule is None or not self.clock.is_synced():
+            try:
+                self.request_schedule()
+            except Exception as exc:
+                self.mesh._log_error("wake schedule request failed err={}".format(exc))
+            await self._async_sleep(500)
+            self.mesh.process_pending(endpoint=endpoint, on_message=on_message)
+
+        while True:
+            wait_ms = self.schedule.ms_until_window(self.clock.now_ms())
+            if wait_ms > 0:
+                await self._sleep(wait_ms)
+            self._windows += 1
+            started = self._ticks_ms()
+            try:
+                self.announce_awake()
+            except Exception as exc:
+                self.mesh._log_error("awake announce failed err={}".format(exc))
+            while True:
+                left = self.schedule.ms_left_in_window(self.clock.now_ms())
+                if left <= 0:
+                    break
+                await self.mesh._wait_for_rx(min(self.poll_ms, left))
+                self.mesh.process_pending(endpoint=endpoint, on_message=on_message)
+            self._awake_ms += self._ticks_diff(self._ticks_ms(), started)
+
+    async def _sleep(self, ms):
+        self._sleep_ms += ms
+        if self.light_sleep:
+            try:
+                import machine
+
+                machine.lightsleep(ms)
+                return
+            except Exception:
+                pass
+        await self._async_sleep(ms)
+
+    @staticmethod
+    async def _async_sleep(ms):
+        try:
+            await asyncio.sleep_ms(ms)
+        except AttributeError:
+            await asyncio.sleep(ms / 1000.0)
+
+    def _on_frame(self, mac, payload):
+        if len(payload) < 4 or payload[2] != _VERSION or payload[3] != _KIND_SCHEDULE_ACK:
+            return
+        _, _, _, period_ms, window_ms, anchor_ms = struct.unpack(_SCHEDULE_ACK_FORMAT, bytes(payload))
+        self.schedule = WakeSchedule(period_ms, window_ms, anchor_ms)
+
+    @staticmethod
+    def _ticks_ms():
+        if hasattr(time, "ticks_ms"):
+            return time.ticks_ms()
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def _ticks_diff(newer, older):
+        if hasattr(time, "ticks_diff"):
+            return time.ticks_diff(newer, older)
+        return newer - older
+
+
+def simulate_duty_cycle(
+    period_ms=DEFAULT_PERIOD_MS,
+    window_ms=DEFAULT_WINDOW_MS,
+    message_interval_ms=2000,
+    duration_ms=3600000,
+    active_ma=120.0,
+    sleep_ma=2.0,
+    battery_mah=1000.0,
+    seed=1,
+):
+    """
+    Estimate latency versus energy for a wake schedule on the host.
+
+    Downlink messages arrive at the gateway with exponential inter-arrival
+    times averaging message_interval_ms and are held until the next window.
+    Returns delivery latency statistics, mean current and battery life.
+    """
+    import random
+
+    rng = random.Random(seed)
+    schedule = WakeSchedule(period_ms, window_ms)
+    latencies = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(1.0 / message_interval_ms)
+        if t >= duration_ms:
+            break
+        latencies.append(schedule.ms_until_window(int(t)))
+    latencies.sort()
+    duty = schedule.duty_ratio()
+    mean_ma = active_ma * duty + sleep_ma * (1.0 - duty)
+    count = len(latencies)
+    return {
+        "period_ms": period_ms,
+        "window_ms": window_ms,
+        "duty_ratio": duty,
+        "messages": count,
+        "mean_latency_ms": (sum(latencies) / count) if count else 0.0,
+        "p95_latency_ms": latencies[int(count * 0.95)] if count else 0,
+        "max_latency_ms": latencies[-1] if count else 0,
+        "mean_current_ma": mean_ma,
+        "battery_hours": battery_mah / mean_ma,
+    }
@@ -4,6 +4,7 @@ except Exception:
     def const(value):
         return value
 
+import random
 import ubinascii
 import network
 import aioespnow
@@ -37,6 +38,21 @@ class LighthouseMesh:
     _TX_QUEUE_MAX_FRAMES = const(96)
     DEFAULT_CHANNEL = const(6)
 
+    # Reliable unicast header: magic(2) + version(1) + session(2) + seq(2).
+    # The session is drawn at boot so a rebooted sender, whose seq restarts,
+    # is not mistaken for duplicates of its previous life. Ack frames reuse
+    # the layout with the ack magic, echo the data frame's session and carry
+    # no body.
+    _REL_MAGIC = b"\x7fR"
+    _ACK_MAGIC = b"\x7fK"
+    _REL_VERSION = const(2)
+    _REL_HEADER_BYTES = const(7)
+    _REL_MAX_RETRIES = const(4)
+    _REL_RTO_INITIAL_MS = const(250)
+    _REL_RTO_MIN_MS = const(40)
+    _REL_RTO_MAX_MS = const(4000)
+    _REL_DEDUP_WINDOW = const(32)
+
     _instance = None
 
     def __new__(cls, *args, **kwargs):
@@ -46,7 +62,7 @@ class LighthouseMesh:
             cls._initialized = False 
         return cls._instance
 
-    def __init__(self, peers=None, debug=False, channel=None):
+    def __init__(self, peers=None, debug=False, channel=None, power_save=False):
         # Mirror class constants onto the instance for MicroPython variants
         # that don't reliably resolve class attributes via `self`.
         self.BROADCAST_TARGET = b"\xff\xff\xff\xff\xff\xff"
@@ -57,6 +73,15 @@ class LighthouseMesh:
         self._FRAG_REASSEMBLY_TIMEOUT_MS = 30000
         self._TX_ACK_TIMEOUT_MS = 1200
         self._TX_QUEUE_MAX_FRAMES = 96
+        self._REL_MAGIC = b"\x7fR"
+        self._ACK_MAGIC = b"\x7fK"
+        self._REL_VERSION = 2
+        self._REL_HEADER_BYTES = 7
+        self._REL_MAX_RETRIES = 4
+        self._REL_RTO_INITIAL_MS = 250
+        self._REL_RTO_MIN_MS = 40
+        self._REL_RTO_MAX_MS = 4000
+        self._REL_DEDUP_WINDOW = 32
         self._logger = None
         self._debug = bool(debug)
         self._init_logger()
@@ -74,9 +99,28 @@ class LighthouseMesh:
         self._tx_stat_tx_responses = 0
         self._tx_stat_tx_failures = 0
 
+        # Reliable unicast state: pending sends keyed by (mac, seq), per-peer
+        # RTT estimators and, per sender, its session and a small window of
+        # recently delivered seqs.
+        self._rel_session = random.getrandbits(16)
+        self._rel_seq = 0
+        self._rel_pending = {}
+        self._rel_rtt = {}
+        self._rel_seen = {}
+        self._rel_sent = 0
+        self._rel_acked = 0
+        self._rel_retransmits = 0
+        self._rel_failed = 0
+        self._rel_duplicates = 0
+
+        # Control-frame handlers keyed by 2-byte magic (clock sync, etc.).
+        self._frame_handlers = {}
+
         if channel is None:
             channel = int(self.DEFAULT_CHANNEL)
         self._channel = int(channel)
+        # Duty-cycled nodes let the radio use modem sleep between windows.
+        self._power_save = bool(power_save)
 
         # Bring up STA mode so ESP-NOW can operate.
         self.wlan_sta = network.WLAN(network.STA_IF)
@@ -179,12 +223,28 @@ class LighthouseMesh:
             return self.node_id_to_mac(peer)
         return peer
 
-    def send_raw(self, peer, payload):
-        """Send bytes (or utf-8 string) to the resolved peer."""
+    def send_raw(self, peer, payload, reliable=False, on_delivery=None, max_retries=None):
+        """
+        Send bytes (or utf-8 string) to the resolved peer.
+
+        With reliable=True the payload is sequenced, acknowledged end-to-end by
+        the receiving mesh and retransmitted on an RTT-adapted timer, up to
+        max_retries times. on_delivery(seq, ok, rtt_ms) is called once the
+        payload is acked (ok=True) or retries are exhausted (ok=False).
+        Returns the reliable sequence number, or None for best-effort sends.
+        """
         target = self.resolve_peer(peer)
         self.add_peer(target)
         if isinstance(payload, str):
             payload = payload.encode("utf-8")
+        if reliable:
+            if target == self.BROADCAST_TARGET:
+                raise ValueError("reliable delivery requires a unicast peer")
+            return self._send_reliable(target, payload, on_delivery, max_retries)
+        self._send_frame(target, payload)
+        return None
+
+    def _send_frame(self, target, payload):
         try:
             if len(payload) <= self.ESPNOW_MAX_PAYLOAD_BYTES:
                 self.espnow.send(target, payload, False)
@@ -221,39 +281,90 @@ class LighthouseMesh:
 
         return LighthouseMeshTransport(self, default_peer=default_peer)
 
+    def create_clock(self, server=False, server_peer=None):
+        """Build mesh clock synchronizer (reference when server=True)."""
+        from dnet.signalling.MeshClock import MeshClock
+
+        return MeshClock(self, server=server, server_peer=server_peer)
+
+    def create_duty_cycle(self, clock, gateway_peer=None, period_ms=None, window_ms=None):
+        """Build duty-cycle coordinator (gateway when gateway_peer is None)."""
+        from dnet.signalling.DutyCycle import DutyCycleGateway, DutyCycledNode
+
+        if gateway_peer is None:
+            return DutyCycleGateway(self, clock)
+        return DutyCycledNode(
+            self, clock, gateway_peer, period_ms=period_ms, window_ms=window_ms
+        )
+
+    def register_frame_handler(self, magic, handler):
+        """
+        Route inbound frames starting with a 2-byte magic to handler(mac, payload).
+
+        Handlers run on the RX drain path (possibly from the IRQ wakeup) and
+        consume the frame; it is not queued for recv_raw().
+        """
+        if handler is None:
+            self._frame_handlers.pop(bytes(magic), None)
+            return
+        self._frame_handlers[bytes(magic)] = handler
+
     async def run(self, endpoint=None, on_message=None, poll_ms=20):
         # Wait for RX signal, then drain all currently queued packets.
         self._log_debug("run loop started endpoint={}".format(endpoint is not None))
         while True:
             await self._wait_for_rx(poll_ms)
-            if endpoint is None:
-                while True:
-                    peer, payload = self.recv_raw(timeout_ms=0)
-                    if payload is None:
-                        break
-                    if on_message:
-                        try:
-                            on_message(self.mac_to_node_id(peer), payload)
-                        except Exception as exc:
-                            self._log_error("on_message(raw) failed err={}".format(exc))
-            else:
-                while True:
+            self.process_pending(endpoint=endpoint, on_message=on_message)
+
+    def process_pending(self, endpoint=None, on_message=None):
+        """Drain queued packets through endpoint.poll() or raw on_message."""
+        if endpoint is None:
+            while True:
+                peer, payload = self.recv_raw(timeout_ms=0)
+                if payload is None:
+                    break
+                if on_message:
                     try:
-                        peer_id, message = endpoint.poll()
+                        on_message(self.mac_to_node_id(peer), payload)
                     except Exception as exc:
-                        self._log_error("endpoint.poll failed err={}".format(exc))
-                        break
-                    if message is None:
-                        break
-                    if on_message:
-                        try:
-                            on_message(peer_id, message)
-                        except Exception as exc:
-                            self._log_error("on_message(decoded) failed err={}".format(exc))
+                        self._log_error("on_message(raw) failed err={}".format(exc))
+        else:
+            while True:
+                try:
+                    peer_id, message = endpoint.poll()
+                except Exception as exc:
+                    self._log_error("endpoint.poll failed err={}".format(exc))
+                    break
+                if message is None:
+                    break
+                if on_message:
+                    try:
+                        on_message(peer_id, message)
+                    except Exception as exc:
+                        self._log_error("on_message(decoded) failed err={}".format(exc))
 
     def get_stats(self):
         return self.espnow.stats()
 
+    def get_reliable_stats(self):
+        """Counters and per-peer RTO state for reliable unicast sends."""
+        peers = {}
+        for mac, est in self._rel_rtt.items():
+            peers[self.mac_to_node_id(mac)] = {
+                "srtt_ms": est[0],
+                "rttvar_ms": est[1],
+                "rto_ms": est[2],
+            }
+        return {
+            "sent": self._rel_sent,
+            "acked": self._rel_acked,
+            "retransmits": self._rel_retransmits,
+            "failed": self._rel_failed,
+            "duplicates": self._rel_duplicates,
+            "pending": len(self._rel_pending),
+            "peers": peers,
+        }
+
     def print_stats(self):
         stats = self.get_stats()
         print("\nESP-NOW Statistics:")
@@ -350,6 +461,22 @@ class LighthouseMesh:
         )
 
     def _ingest_rx_packet(self, mac, msg):
+        payload = self._reassemble_rx_packet(mac, msg)
+        if payload is None:
+            return None
+        payload = self._unwrap_reliable(mac, payload)
+        if payload is None or not self._frame_handlers or len(payload) < 2:
+            return payload
+        handler = self._frame_handlers.get(bytes(payload[0:2]))
+        if handler is None:
+            return payload
+        try:
+            handler(mac, payload)
+        except Exception as exc:
+            self._log_error("frame handler failed err={}".format(exc))
+        return None
+
+    def _reassemble_rx_packet(self, mac, msg):
         self._expire_fragment_buffers()
         frag = self._parse_fragment(msg)
         if frag is None:
@@ -383,6 +510,172 @@ class LighthouseMesh:
         del self._fragment_buffers[key]
         return bytes(assembled)
 
+    def _next_reliable_seq(self):
+        self._rel_seq = (self._rel_seq + 1) & 0xFFFF
+        return self._rel_seq
+
+    def _reliable_header(self, magic, session, seq):
+        return bytes(
+            (
+                magic[0],
+                magic[1],
+                self._REL_VERSION,
+                (session >> 8) & 0xFF,
+                session & 0xFF,
+                (seq >> 8) & 0xFF,
+                seq & 0xFF,
+            )
+        )
+
+    def _send_reliable(self, target, payload, on_delivery, max_retries):
+        if max_retries is None:
+            max_retries = self._REL_MAX_RETRIES
+        key_mac = bytes(target)
+        seq = self._next_reliable_seq()
+        frame = self._reliable_header(self._REL_MAGIC, self._rel_session, seq) + payload
+        now = self._now_ms()
+        entry = {
+            "target": target,
+            "seq": seq,
+            "frame": frame,
+            "first_sent_ms": now,
+            "sent_ms": now,
+            "attempts": 1,
+            "max_retries": int(max_retries),
+            "rto": self._reliable_rto(key_mac),
+            "on_delivery": on_delivery,
+        }
+        # Register before sending so an ack drained in the IRQ path finds it.
+        self._rel_pending[(key_mac, seq)] = entry
+        self._rel_sent += 1
+        try:
+            self._send_frame(target, frame)
+        except Exception:
+            del self._rel_pending[(key_mac, seq)]
+            raise
+        return seq
+
+    def _unwrap_reliable(self, mac, payload):
+        if len(payload) < self._REL_HEADER_BYTES or payload[0] != self._REL_MAGIC[0]:
+            return payload
+        magic = payload[0:2]
+        if magic != self._REL_MAGIC and magic != self._ACK_MAGIC:
+            return payload
+        if payload[2] != self._REL_VERSION:
+            self._log_error("dropping reliable frame with unsupported version={}".format(payload[2]))
+            return None
+        session = (payload[3] << 8) | payload[4]
+        seq = (payload[5] << 8) | payload[6]
+        key_mac = bytes(mac)
+        if magic == self._ACK_MAGIC:
+            if session == self._rel_session:
+                self._on_reliable_ack(key_mac, seq)
+            return None
+
+        # Always re-ack: a duplicate usually means our previous ack was lost.
+        self._send_reliable_ack(key_mac, session, seq)
+        state = self._rel_seen.get(key_mac)
+        if state is None or state[0] != session:
+            # New peer or the peer rebooted: its seqs start over.
+            state = [session, []]
+            self._rel_seen[key_mac] = state
+        seen = state[1]
+        if seq in seen:
+            self._rel_duplicates += 1
+            return None
+        seen.append(seq)
+        if len(seen) > self._REL_DEDUP_WINDOW:
+            seen.pop(0)
+        return payload[self._REL_HEADER_BYTES:]
+
+    def _send_reliable_ack(self, mac, session, seq):
+        try:
+            self.add_peer(mac)
+            self.espnow.send(mac, self._reliable_header(self._ACK_MAGIC, session, seq), False)
+        except Exception as exc:
+            self._log_error(
+                "reliable ack send failed peer={} seq={} err={}".format(
+                    self.mac_to_node_id(mac), seq, exc
+                )
+            )
+
+    def _on_reliable_ack(self, mac, seq):
+        entry = self._rel_pending.pop((mac, seq), None)
+        if entry is None:
+            # Late ack for a send that already completed or gave up.
+            return
+        self._rel_acked += 1
+        rtt = None
+        # Karn's rule: only sample RTT from sends that were never retransmitted.
+        if entry["attempts"] == 1:
+            rtt = self._ticks_diff(self._now_ms(), entry["first_sent_ms"])
+            self._update_reliable_rtt(mac, rtt)
+        self._notify_delivery(entry, True, rtt)
+
+    def _reliable_rto(self, mac):
+        est = self._rel_rtt.get(mac)
+        if est is None:
+            return self._REL_RTO_INITIAL_MS
+        return est[2]
+
+    def _update_reliable_rtt(self, mac, rtt):
+        # Jacobson/Karels estimator (RFC 6298) in integer milliseconds.
+        if rtt < 0:
+            return
+        est = self._rel_rtt.get(mac)
+        if est is None:
+            srtt = rtt
+            rttvar = rtt // 2
+        else:
+            srtt, rttvar = est[0], est[1]
+            rttvar += (abs(srtt - rtt) - rttvar) // 4
+            srtt += (rtt - srtt) // 8
+        rto = srtt + max(1, 4 * rttvar)
+        if rto < self._REL_RTO_MIN_MS:
+            rto = self._REL_RTO_MIN_MS
+        elif rto > self._REL_RTO_MAX_MS:
+            rto = self._REL_RTO_MAX_MS
+        self._rel_rtt[mac] = [srtt, rttvar, rto]
+
+    def _service_reliable(self):
+        if not self._rel_pending:
+            return
+        now = self._now_ms()
+        for key in list(self._rel_pending.keys()):
+            entry = self._rel_pending.get(key)
+            if entry is None:
+                continue
+            if self._ticks_diff(now, entry["sent_ms"]) < entry["rto"]:
+                continue
+            if entry["attempts"] > entry["max_retries"]:
+                del self._rel_pending[key]
+                self._rel_failed += 1
+                self._log_error(
+                    "reliable send failed peer={} seq={} attempts={}".format(
+                        self.mac_to_node_id(key[0]), entry["seq"], entry["attempts"]
+                    )
+                )
+                self._notify_delivery(entry, False, None)
+                continue
+            entry["attempts"] += 1
+            entry["sent_ms"] = now
+            # Exponential backoff until an unambiguous sample refreshes the RTO.
+            entry["rto"] = min(entry["rto"] * 2, self._REL_RTO_MAX_MS)
+            self._rel_retransmits += 1
+            try:
+                self._send_frame(entry["target"], entry["frame"])
+            except Exception:
+                pass
+
+    def _notify_delivery(self, entry, ok, rtt):
+        callback = entry.get("on_delivery")
+        if callback is None:
+            return
+        try:
+            callback(entry["seq"], ok, rtt)
+        except Exception as exc:
+            self._log_error("on_delivery failed seq={} err={}".format(entry["seq"], exc))
+
     def _parse_fragment(self, msg):
         if len(msg) < self._FRAG_HEADER_BYTES:
             return None
@@ -476,6 +769,9 @@ class LighthouseMesh:
         self._tx_queued_frames += 1
 
     def _pump_tx_queue(self, source):
+        # Retransmit reliable sends whose RTO expired.
+        self._service_reliable()
+
         # Update completion status for prior async send.
         self._update_tx_completion()
 
@@ -589,11 +885,12 @@ class LighthouseMesh:
             return
 
         try:
-            pm_none = getattr(self.wlan_sta, "PM_NONE", None)
-            if pm_none is None:
-                pm_none = getattr(network.WLAN, "PM_NONE", None)
-            if pm_none is not None:
-                self.wlan_sta.config(pm=pm_none)
+            pm_name = "PM_POWERSAVE" if self._power_save else "PM_NONE"
+            pm_mode = getattr(self.wlan_sta, pm_name, None)
+            if pm_mode is None:
+                pm_mode = getattr(network.WLAN, pm_name, None)
+            if pm_mode is not None:
+                self.wlan_sta.config(pm=pm_mode)
         except Exception as exc:
             self._log_debug("wifi pm config unavailable err={}".format(exc))
         try:
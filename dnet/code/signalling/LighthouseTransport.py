@@ -5,14 +5,18 @@ class LighthouseMeshTransport:
     Implements the transport contract expected by MessagingEndpoint:
     - send(peer_id, payload)
     - recv() -> (peer_id, payload) or (None, None)
+
+    send() also accepts reliable=True for acked, retried unicast delivery.
     """
 
     def __init__(self, mesh, default_peer=None):
         self.mesh = mesh
         self.default_peer = default_peer
 
-    def send(self, peer_id, payload):
+    def send(self, peer_id, payload, reliable=False, on_delivery=None):
         peer = self.default_peer if peer_id is None else peer_id
+        if reliable:
+            return self.mesh.send_raw(peer, payload, reliable=True, on_delivery=on_delivery)
         self.mesh.send_raw(peer, payload)
 
     def recv(self):
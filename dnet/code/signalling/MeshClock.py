@@ -0,0 +1,212 @@
+try:
+    import ustruct as struct
+except Exception:
+    import struct
+try:
+    import utime as time
+except Exception:
+    import time
+
+try:
+    import uasyncio as asyncio
+except Exception:
+    import asyncio
+
+
+class MeshClock:
+    """
+    NTP-style clock offset estimation over LighthouseMesh.
+
+    One node (normally the gateway) runs as the reference with server=True;
+    its monotonic local millisecond counter defines mesh time. Other nodes
+    exchange timestamped request/response frames with it, keep the
+    lowest-delay sample of a sliding window as the offset estimate and track
+    drift between estimates so mesh time stays accurate between exchanges.
+
+    Frame layout: magic(2) + version(1) + kind(1) + seq(2) followed by
+    big-endian int64 timestamps (t1 for requests; t1, t2, t3 for responses).
+    """
+
+    _MAGIC = b"\x7fT"
+    _VERSION = 1
+    _KIND_REQUEST = 0
+    _KIND_RESPONSE = 1
+    _REQUEST_FORMAT = ">2sBBHq"
+    _RESPONSE_FORMAT = ">2sBBHqqq"
+
+    DEFAULT_INTERVAL_MS = 10000
+    _SAMPLE_WINDOW = 8
+    _STEP_THRESHOLD_MS = 1000
+    _MIN_DRIFT_SPAN_MS = 5000
+    _DRIFT_GAIN = 0.25
+
+    def __init__(self, mesh, server=False, server_peer=None):
+        self.mesh = mesh
+        self.server = bool(server)
+        self.server_peer = server_peer
+        self._last_ticks = self._ticks_ms()
+        self._local_ms = 0
+        self._seq = 0
+        self._outstanding = {}
+        self._samples = []
+        self._offset_ms = 0.0
+        self._ref_local_ms = 0
+        self._drift = 0.0
+        self._synced = self.server
+        self._step_votes = 0
+        self._requests = 0
+        self._responses = 0
+        self._last_delay_ms = None
+        mesh.register_frame_handler(self._MAGIC, self._on_frame)
+
+    def local_ms(self):
+        """Monotonic local milliseconds, unwrapped from ticks_ms()."""
+        ticks = self._ticks_ms()
+        self._local_ms += self._ticks_diff(ticks, self._last_ticks)
+        self._last_ticks = ticks
+        return self._local_ms
+
+    def now_ms(self):
+        """Current mesh time in milliseconds."""
+        return self.to_mesh_ms()
+
+    def to_mesh_ms(self, local_ticks=None):
+        """Convert a local ticks_ms() value (default: now) to mesh time."""
+        local = self.local_ms()
+        if local_ticks is not None:
+            local += self._ticks_diff(local_ticks, self._last_ticks)
+        if self.server:
+            return local
+        elapsed = local - self._ref_local_ms
+        return int(local + self._offset_ms + self._drift * elapsed)
+
+    def to_local_ticks(self, mesh_ms):
+        """Convert a mesh timestamp to the matching local ticks_ms() value."""
+        delta = int(mesh_ms) - self.to_mesh_ms()
+        if hasattr(time, "ticks_add"):
+            return time.ticks_add(self._last_ticks, delta)
+        return self._last_ticks + delta
+
+    def one_way_latency_ms(self, sent_mesh_ms, received_ticks=None):
+        """Delivery latency for a message stamped with the sender's mesh time."""
+        return self.to_mesh_ms(received_ticks) - int(sent_mesh_ms)
+
+    def is_synced(self):
+        return self._synced
+
+    def stats(self):
+        return {
+            "server": self.server,
+            "synced": self._synced,
+            "offset_ms": int(self._offset_ms),
+            "drift_ppm": int(self._drift * 1000000),
+            "last_delay_ms": self._last_delay_ms,
+            "samples": len(self._samples),
+            "requests": self._requests,
+            "responses": self._responses,
+        }
+
+    def sync_once(self, peer=None):
+        """Send one sync request to the reference node."""
+        if self.server:
+            return None
+        peer = self.server_peer if peer is None else peer
+        if peer is None:
+            raise ValueError("server_peer is required for clock sync")
+        self._seq = (self._seq + 1) & 0xFFFF
+        t1 = self.local_ms()
+        self._outstanding[self._seq] = t1
+        if len(self._outstanding) > self._SAMPLE_WINDOW:
+            # Forget the oldest unanswered request.
+            del self._outstanding[min(self._outstanding, key=self._outstanding.get)]
+        frame = struct.pack(
+            self._REQUEST_FORMAT, self._MAGIC, self._VERSION, self._KIND_REQUEST, self._seq, t1
+        )
+        self.mesh.send_raw(peer, frame)
+        self._requests += 1
+        return self._seq
+
+    async def run(self, interval_ms=DEFAULT_INTERVAL_MS):
+        """Periodically resync; faster until the first estimate exists."""
+        while True:
+            try:
+                self.sync_once()
+            except Exception as exc:
+                self.mesh._log_error("clock sync request failed err={}".format(exc))
+            wait_ms = interval_ms if self._synced else min(interval_ms, 1000)
+            try:
+                await asyncio.sleep_ms(wait_ms)
+            except AttributeError:
+                await asyncio.sleep(wait_ms / 1000.0)
+
+    def _on_frame(self, mac, payload):
+        # Capture receive time first; this runs on the RX drain path.
+        received = self.local_ms()
+        if len(payload) < 4 or payload[2] != self._VERSION:
+            return
+        kind = payload[3]
+        if kind == self._KIND_REQUEST and self.server:
+            _, _, _, seq, t1 = struct.unpack(self._REQUEST_FORMAT, bytes(payload))
+            frame = struct.pack(
+                self._RESPONSE_FORMAT,
+                self._MAGIC,
+                self._VERSION,
+                self._KIND_RESPONSE,
+                seq,
+                t1,
+                received,
+                self.local_ms(),
+            )
+            self.mesh.send_raw(mac, frame)
+            self._responses += 1
+        elif kind == self._KIND_RESPONSE and not self.server:
+            _, _, _, seq, t1, t2, t3 = struct.unpack(self._RESPONSE_FORMAT, bytes(payload))
+            if self._outstanding.pop(seq, None) != t1:
+                return
+            self._responses += 1
+            self._add_sample(t1, t2, t3, received)
+
+    def _add_sample(self, t1, t2, t3, t4):
+        offset = ((t2 - t1) + (t3 - t4)) / 2.0
+        delay = (t4 - t1) - (t3 - t2)
+        self._last_delay_ms = delay
+        if self._synced and abs(offset - self._predicted_offset(t4)) > self._STEP_THRESHOLD_MS:
+            # Reference restarted or stepped; require two agreeing samples.
+            self._step_votes += 1
+            if self._step_votes < 2:
+                return
+            self._samples = []
+            self._drift = 0.0
+            self._synced = False
+        self._step_votes = 0
+        self._samples.append((delay, offset, t4))
+        if len(self._samples) > self._SAMPLE_WINDOW:
+            self._samples.pop(0)
+
+        # Clock filter: the lowest-delay sample has the least queuing error.
+        best = min(self._samples)
+        _, best_offset, best_local = best
+        if self._synced and best_local != self._ref_local_ms:
+            span = best_local - self._ref_local_ms
+            if span >= self._MIN_DRIFT_SPAN_MS:
+                measured = (best_offset - self._offset_ms) / span
+                self._drift += self._DRIFT_GAIN * (measured - self._drift)
+        if best_local != self._ref_local_ms or not self._synced:
+            self._offset_ms = best_offset
+            self._ref_local_ms = best_local
+        self._synced = True
+
+    def _predicted_offset(self, local):
+        return self._offset_ms + self._drift * (local - self._ref_local_ms)
+
+    @staticmethod
+    def _ticks_ms():
+        if hasattr(time, "ticks_ms"):
+            return time.ticks_ms()
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def _ticks_diff(newer, older):
+        if hasattr(time, "ticks_diff"):
+            return time.ticks_diff(newer, older)
+        return newer - older
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "code"))
+
+
+class FakeAir:
+    """Shared radio: every frame reaches the addressed endpoints' queues."""
+
+    def __init__(self):
+        self.queues = {}
+        self.endpoints = []
+
+    def transport(self, node_id):
+        air = self
+        queue = self.queues.setdefault(node_id, [])
+
+        class Transport:
+            def send(self, peer_id, payload, **kwargs):
+                for other, inbox in air.queues.items():
+                    if other != node_id and peer_id in ("broadcast", other):
+                        inbox.append((node_id, payload))
+
+            def recv(self):
+                return queue.pop(0) if queue else (None, None)
+
+        return Transport()
+
+    def endpoint(self, node_id, **kwargs):
+        from messaging import MessagingEndpoint
+
+        endpoint = MessagingEndpoint(node_id, self.transport(node_id), **kwargs)
+        self.endpoints.append(endpoint)
+        return endpoint
+
+    def drain(self):
+        """Poll every endpoint until no frame is left in flight."""
+        busy = True
+        while busy:
+            busy = False
+            for endpoint in self.endpoints:
+                while endpoint.poll()[0] is not None:
+                    busy = True
+
+
+@pytest.fixture
+def air():
+    return FakeAir()
@@ -0,0 +1,33 @@
+from messaging import MessageCodec, Schema
+from messaging.binary import canonical_profile_hash
+
+
+def test_profile_hash_matches_across_wire_forms():
+    json_codec = MessageCodec(wire_version=1)
+    binary_codec = MessageCodec(wire_version=2)
+    node_id = "a1b2c3d4e5f6"
+    for profile_hash in ("servo-dist-v1", "1A2B3C4D", "0badf00d"):
+        seen = []
+        for codec in (json_codec, binary_codec):
+            payload = codec.encode_advertise(node_id, profile_hash, [1, 2])
+            seen.append(json_codec.decode(payload)[Schema.F_PROFILE_HASH])
+        assert seen[0] == seen[1] == canonical_profile_hash(profile_hash)
+
+
+def test_large_binary_advertise_falls_back_to_json():
+    codec = MessageCodec(wire_version=2)
+    payload = codec.encode_advertise("a1b2c3d4e5f6", "0badf00d", range(1000, 1300, 2))
+    assert isinstance(payload, str)
+    assert len(payload) <= codec.max_short_packet_bytes
+    assert isinstance(codec.encode_advertise("a1b2c3d4e5f6", "0badf00d", [1, 2]), bytes)
+
+
+def test_decode_accepts_leading_whitespace():
+    codec = MessageCodec()
+    assert codec.decode(' \n{"v":1,"t":"q","n":"a1b2c3d4e5f6","sid":5}')[Schema.F_SERVICE_ID] == 5
+
+
+def test_send_advertise_returns_codec_payload(air):
+    endpoint = air.endpoint("a1b2c3d4e5f6")
+    first = endpoint.send_advertise("broadcast", "0badf00d", [1, 2])
+    assert isinstance(first, str) and endpoint.send_advertise("broadcast", "0badf00d", [1, 2]) == first
@@ -0,0 +1,33 @@
+from messaging import Schema
+from messaging.gossip import RegistryGossip
+
+
+def test_one_pull_answers_every_lagging_neighbour(air):
+    ids = ("a1b2c3d4e5f6", "d4f5aa10e0ab", "0c0ffee0babe")
+    endpoints = [air.endpoint(node_id) for node_id in ids]
+    clock = [0]
+    gossips = []
+    for endpoint in endpoints:
+        gossip = RegistryGossip(endpoint, pull_jitter_ms=100)
+        gossip._now_ms = lambda: clock[0]
+        gossips.append(gossip)
+    endpoints[0].registry.register_advertisement(
+        {
+            Schema.F_NODE_ID: "feedfacecafe",
+            Schema.F_PROFILE_HASH: "0badf00d",
+            Schema.F_SERVICES: [1, 2],
+        }
+    )
+    gossips[0].send_digest()
+    air.drain()
+    assert gossips[1]._pull is not None and gossips[2]._pull is not None
+    for clock[0] in range(0, 101, 5):
+        for gossip in gossips:
+            gossip.poll()
+            air.drain()
+    assert gossips[1].pulls_sent + gossips[2].pulls_sent == 1
+    assert gossips[1].pulls_suppressed + gossips[2].pulls_suppressed == 1
+    for endpoint in endpoints[1:]:
+        node = endpoint.registry.get_node("feedfacecafe")
+        assert node is not None and not node.verified
+        assert list(node.service_ids) == [1, 2]
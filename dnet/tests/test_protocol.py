@@ -0,0 +1,67 @@
+import asyncio
+
+from messaging import Schema
+
+
+def _profile(node_id):
+    return {
+        Schema.F_VERSION: 1,
+        Schema.F_TYPE: Schema.TYPE_PROFILE,
+        Schema.F_NODE_ID: node_id,
+        Schema.F_PROFILE_HASH: "0badf00d",
+        Schema.F_SERVICES: [{Schema.F_SERVICE_ID: 1201}],
+        Schema.F_META: {},
+    }
+
+
+def test_cancelling_first_coalesced_query_keeps_the_others(air):
+    caller = air.endpoint("a1b2c3d4e5f6")
+    provider = air.endpoint("d4f5aa10e0ab")
+
+    async def main():
+        first = asyncio.ensure_future(caller.query(1201, timeout_ms=100))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(caller.query(1201, timeout_ms=100))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not second.done()
+        assert 1201 not in caller._query_cache
+        # The provider only comes up now; its answer must still be gathered.
+        provider.set_local_profile(_profile(provider.node_id))
+        while not second.done():
+            air.drain()
+            await asyncio.sleep(0.005)
+        return second.result(), first.cancelled()
+
+    providers, cancelled = asyncio.run(main())
+    assert cancelled and providers == ["d4f5aa10e0ab"]
+    assert caller.queries_sent == 1 and caller.queries_coalesced == 1
+
+
+def test_cancelled_lone_query_caches_nothing(air):
+    caller = air.endpoint("a1b2c3d4e5f6")
+
+    async def main():
+        task = asyncio.ensure_future(caller.query(1201, timeout_ms=100))
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert caller._inflight_queries == {} and caller._query_cache == {}
+    assert len(caller._requests) == 0
+
+
+def test_local_profile_hash_is_canonical(air):
+    endpoint = air.endpoint("a1b2c3d4e5f6")
+    assert endpoint.local_profile_hash() is None
+    endpoint.set_local_profile(
+        {
+            Schema.F_TYPE: Schema.TYPE_PROFILE,
+            Schema.F_NODE_ID: "a1b2c3d4e5f6",
+            Schema.F_PROFILE_HASH: "0BADF00D",
+            Schema.F_SERVICES: [{Schema.F_SERVICE_ID: 1}],
+        }
+    )
+    assert endpoint.local_profile_hash() == "0badf00d"
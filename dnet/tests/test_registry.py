@@ -0,0 +1,152 @@
+from messaging import Schema, ServiceRegistry
+
+
+def _profile(name="servo", services=(1, 2)):
+    return {
+        Schema.F_TYPE: Schema.TYPE_PROFILE,
+        Schema.F_NODE_ID: "a1b2c3d4e5f6",
+        Schema.F_PROFILE_HASH: "0badf00d",
+        Schema.F_NODE_NAME: name,
+        Schema.F_ROLE: "actuator",
+        Schema.F_SERVICES: [{Schema.F_SERVICE_ID: service_id} for service_id in services],
+        Schema.F_META: {"zone": "lab"},
+    }
+
+
+def _watched():
+    registry = ServiceRegistry(clock=lambda: 1000)
+    events = []
+    registry.watch(lambda event, node, revision: events.append(event))
+    return registry, events
+
+
+def test_repeated_profile_emits_no_event():
+    registry, events = _watched()
+    registry.register_profile(_profile())
+    registry.register_profile(_profile(), seen_at_ms=2000)
+    assert events == [ServiceRegistry.EVENT_ADDED]
+    assert registry.get_node("a1b2c3d4e5f6").last_seen_ms == 2000
+
+
+def test_changed_profile_emits_update():
+    registry, events = _watched()
+    registry.register_profile(_profile())
+    registry.register_profile(_profile(name="servo-2"))
+    registry.register_profile(_profile(name="servo-2", services=(1, 3)))
+    assert events == [ServiceRegistry.EVENT_ADDED] + [ServiceRegistry.EVENT_UPDATED] * 2
+
+
+def test_find_service_lists_digest_node_once():
+    from messaging import service_set
+
+    registry, _ = _watched()
+    registry.register_profile(_profile(services=(1, 2)))
+    advert = {
+        Schema.F_TYPE: Schema.TYPE_ADVERTISE,
+        Schema.F_NODE_ID: "a1b2c3d4e5f6",
+        Schema.F_PROFILE_HASH: "0badf00d",
+        Schema.F_SERVICES: service_set.encode_bloom([1, 2], 40),
+    }
+    registry.register_advertisement(advert, seen_at_ms=1500)
+    other = dict(_profile(services=(1,)), **{Schema.F_NODE_ID: "d4f5aa10e0ab"})
+    registry.register_profile(other, seen_at_ms=1200)
+    found = [node.node_id for node in registry.find_service(1, limit=2)]
+    assert found == ["a1b2c3d4e5f6", "d4f5aa10e0ab"]
+
+
+def test_profile_delta_clears_long_fields():
+    from messaging import MessageCodec
+    from messaging.delta import diff_profiles
+
+    registry, _ = _watched()
+    old = _profile()
+    old[Schema.F_FIRMWARE] = "1.2.0"
+    registry.register_profile(old)
+    new = dict(old)
+    del new[Schema.F_ROLE]
+    del new[Schema.F_FIRMWARE]
+    new[Schema.F_PROFILE_HASH] = "feedf00d"
+    codec = MessageCodec()
+    payload = codec.encode_profile_delta("a1b2c3d4e5f6", **diff_profiles(old, new))
+    assert registry.register_profile_delta(codec.decode(payload))
+    node = registry.get_node("a1b2c3d4e5f6")
+    assert (node.name, node.role, node.firmware) == ("servo", None, None)
+    assert registry.query(role="actuator") == []
+
+
+def test_resighting_keeps_membership_version():
+    registry, _ = _watched()
+    advert = {
+        Schema.F_TYPE: Schema.TYPE_ADVERTISE,
+        Schema.F_NODE_ID: "a1b2c3d4e5f6",
+        Schema.F_PROFILE_HASH: "0badf00d",
+        Schema.F_SERVICES: [1, 2],
+    }
+    registry.register_advertisement(advert, seen_at_ms=1000)
+    first = registry.find_service(1)
+    membership = registry.membership_version
+    registry.register_advertisement(advert, seen_at_ms=2000)
+    assert registry.membership_version == membership
+    assert registry.find_service(1) is first
+    registry.register_advertisement(dict(advert, **{Schema.F_SERVICES: [1]}), seen_at_ms=3000)
+    assert registry.membership_version > membership
+    assert registry.find_service(2) == []
+
+
+def test_malformed_bitmap_frame_is_rejected():
+    import pytest
+
+    from messaging import MessageCodec, MessageValidationError
+
+    codec = MessageCodec()
+    for services in ('{"b":65535,"m":"AQI="}', '{"b":1,"m":"not base64!"}'):
+        frame = '{"v":1,"t":"a","n":"a1b2c3d4e5f6","h":"0badf00d","s":' + services + "}"
+        with pytest.raises(MessageValidationError):
+            codec.decode(frame)
+    assert codec.decode('{"v":1,"t":"a","n":"a1b2c3d4e5f6","h":"0badf00d","s":{"b":65528,"m":"gA=="}}')
+
+
+def test_failed_advert_leaves_no_record():
+    registry, events = _watched()
+    advert = {
+        Schema.F_NODE_ID: "a1b2c3d4e5f6",
+        Schema.F_PROFILE_HASH: "0badf00d",
+        Schema.F_SERVICES: {"b": 65535, "m": "AQI="},
+    }
+    try:
+        registry.register_advertisement(advert)
+    except Exception:
+        pass
+    assert registry.get_node("a1b2c3d4e5f6") is None and events == []
+    assert registry.expire(10 ** 9) == []
+
+
+def test_limited_find_service_follows_resightings():
+    registry, _ = _watched()
+
+    def advert(node_id, seen_at_ms):
+        registry.register_advertisement(
+            {Schema.F_NODE_ID: node_id, Schema.F_PROFILE_HASH: "0badf00d", Schema.F_SERVICES: [5]},
+            seen_at_ms=seen_at_ms,
+        )
+
+    advert("a1b2c3d4e5f6", 1000)
+    advert("d4f5aa10e0ab", 10000)
+    assert [node.node_id for node in registry.find_service(5, limit=1)] == ["d4f5aa10e0ab"]
+    for seen_at_ms in range(11000, 110001, 1000):
+        advert("a1b2c3d4e5f6", seen_at_ms)
+    assert [node.node_id for node in registry.find_service(5, limit=1)] == ["a1b2c3d4e5f6"]
+
+
+def test_readded_node_keeps_one_expiry_entry():
+    registry = ServiceRegistry(ttl_ms=1000)
+    for cycle in range(50):
+        registry.register_profile(_profile(), seen_at_ms=cycle * 2000)
+        registry.remove_node("a1b2c3d4e5f6")
+    registry.register_profile(_profile(), seen_at_ms=100000)
+    assert len(registry._expiry_heap) <= 2 * len(registry.all_nodes()) + 16
+    for now in range(101000, 140000, 2000):
+        registry.register_profile(_profile(), seen_at_ms=now - 500)
+        registry.expire(now)
+    assert len(registry._expiry_heap) <= 2 * len(registry.all_nodes()) + 16
+    assert registry.expire(200000) == ["a1b2c3d4e5f6"]
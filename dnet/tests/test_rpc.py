@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from messaging.rpc import ERR_BAD_ARGS, ERR_FAILED, RpcClient, RpcDispatcher, RpcError, RpcTimeout
+
+
+async def _pump(air):
+    while True:
+        air.drain()
+        await asyncio.sleep(0.001)
+
+
+def _run(air, body):
+    async def main():
+        caller = air.endpoint("a1b2c3d4e5f6")
+        provider = air.endpoint("d4f5aa10e0ab")
+        pump = asyncio.ensure_future(_pump(air))
+        try:
+            return await body(RpcClient(caller, window=1), RpcDispatcher(provider))
+        finally:
+            pump.cancel()
+
+    return asyncio.run(main())
+
+
+def _call_error(client, *args):
+    async def call():
+        try:
+            await client.call("d4f5aa10e0ab", *args)
+        except RpcError as exc:
+            return exc.code
+        return None
+
+    return call()
+
+
+def test_type_error_inside_handler_is_a_failure(air):
+    def handler(value):
+        return value + "x"
+
+    async def body(client, dispatcher):
+        dispatcher.register(7, handler)
+        return await _call_error(client, 7, [1]), await _call_error(client, 7, [1, 2])
+
+    assert _run(air, body) == (ERR_FAILED, ERR_BAD_ARGS)
+
+
+def test_unserialisable_result_gets_error_reply(air):
+    async def body(client, dispatcher):
+        dispatcher.register(7, lambda: object())
+        return await _call_error(client, 7)
+
+    assert _run(air, body) == ERR_FAILED
+
+
+def test_cancelled_queued_call_leaves_the_queue(air):
+    async def body(client, dispatcher):
+        async def slow():
+            await asyncio.sleep(0.05)
+            return 1
+
+        dispatcher.register(7, slow)
+        first = asyncio.ensure_future(client.call("d4f5aa10e0ab", 7))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(client.call("d4f5aa10e0ab", 7))
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert await first == 1
+        return client._waiters, client.in_flight("d4f5aa10e0ab")
+
+    assert _run(air, body) == ({}, 0)
+
+
+def test_queued_call_times_out(air):
+    async def body(client, dispatcher):
+        async def slow():
+            await asyncio.sleep(0.1)
+
+        dispatcher.register(7, slow)
+        first = asyncio.ensure_future(client.call("d4f5aa10e0ab", 7, timeout_ms=200))
+        await asyncio.sleep(0)
+        with pytest.raises(RpcTimeout):
+            await client.call("d4f5aa10e0ab", 7, timeout_ms=20)
+        await first
+        return client._waiters
+
+    assert _run(air, body) == {}
+
+
+def test_oversized_result_gets_error_reply(air):
+    async def body(client, dispatcher):
+        dispatcher.register(7, lambda: "x" * 5000)
+        try:
+            await client.call("d4f5aa10e0ab", 7)
+        except RpcError as exc:
+            return exc.code, exc.detail
+        return None
+
+    code, detail = _run(air, body)
+    assert code == ERR_FAILED and "exceeds" in detail
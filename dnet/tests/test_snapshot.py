@@ -0,0 +1,41 @@
+from messaging import Schema, ServiceRegistry
+from messaging.snapshot import load_snapshot, save_snapshot
+
+
+def test_retained_hash_survives_snapshot(tmp_path):
+    registry = ServiceRegistry(clock=lambda: 1000)
+    registry.register_profile(
+        {
+            Schema.F_TYPE: Schema.TYPE_PROFILE,
+            Schema.F_NODE_ID: "a1b2c3d4e5f6",
+            Schema.F_PROFILE_HASH: "0badf00d",
+            Schema.F_SERVICES: [{Schema.F_SERVICE_ID: 1}],
+            Schema.F_META: {},
+        }
+    )
+    # An advert for a newer profile that has not been fetched yet.
+    registry.register_advertisement(
+        {
+            Schema.F_TYPE: Schema.TYPE_ADVERTISE,
+            Schema.F_NODE_ID: "a1b2c3d4e5f6",
+            Schema.F_PROFILE_HASH: "feedf00d",
+            Schema.F_SERVICES: [1, 2],
+        }
+    )
+    path = str(tmp_path / "registry.snap")
+    save_snapshot(registry, path, now_ms=1000)
+
+    restored = ServiceRegistry(clock=lambda: 1000)
+    assert load_snapshot(restored, path, now_ms=1000) == 1
+    node = restored.get_node("a1b2c3d4e5f6")
+    assert node.profile_hash == "feedf00d"
+    assert node.retained_hash == "0badf00d"
+    assert node.has_profile("0badf00d") and not node.has_profile("feedf00d")
+
+
+def test_long_names_are_cut_on_a_character_boundary():
+    from messaging.snapshot import _encode_str
+
+    encoded = _encode_str("é" * 200)
+    assert encoded[0] == 254 - 254 % 2
+    assert encoded[1:].decode("utf-8") == "é" * 127
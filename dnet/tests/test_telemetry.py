@@ -0,0 +1,17 @@
+from messaging import MessageCodec, Schema
+from messaging.binary import TELEMETRY_TICKS_PERIOD
+from messaging.telemetry import TelemetryReceiver
+
+
+def test_time_base_unwraps_at_ticks_period():
+    codec = MessageCodec()
+    start = TELEMETRY_TICKS_PERIOD - 30
+    frames = [
+        codec.encode_telemetry("a1b2c3d4e5f6", 1, seq, start + seq * 25, 5000, [[seq, 0]])
+        for seq in range(4)
+    ]
+    receiver = TelemetryReceiver(codec)
+    blocks = list(receiver.iter_blocks(frames))
+    assert [codec.decode(frame)[Schema.F_TIME_BASE] for frame in frames][2] == 20
+    assert [float(block.timestamps_ms[0]) for block in blocks] == [start + seq * 25 for seq in range(4)]
+    assert receiver.lost_blocks == 0
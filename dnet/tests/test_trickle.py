@@ -0,0 +1,77 @@
+import random
+
+from messaging import Schema, ServiceRegistry
+from messaging.trickle import AdvertiseScheduler
+
+
+def _simulate(nodes, minutes, step_ms=50):
+    clock = [0]
+    schedulers = []
+    for index in range(nodes):
+        scheduler = AdvertiseScheduler(imin_ms=1000, imax_doublings=5, k=2)
+        scheduler._now_ms = lambda: clock[0]
+        scheduler._last_sent = 0
+        scheduler.reset()
+        scheduler.set_local("node{:02d}".format(index), "h{:02d}".format(index))
+        schedulers.append(scheduler)
+    last_sent = [0] * nodes
+    worst_gap = [0] * nodes
+    while clock[0] < minutes * 60000:
+        clock[0] += step_ms
+        for index, scheduler in enumerate(schedulers):
+            if not scheduler.poll(clock[0]):
+                continue
+            worst_gap[index] = max(worst_gap[index], clock[0] - last_sent[index])
+            last_sent[index] = clock[0]
+            message = {
+                Schema.F_TYPE: Schema.TYPE_ADVERTISE,
+                Schema.F_NODE_ID: scheduler.node_id,
+                Schema.F_PROFILE_HASH: scheduler.profile_hash,
+            }
+            for other in schedulers:
+                if other is not scheduler:
+                    other.observe(message)
+    for index in range(nodes):
+        worst_gap[index] = max(worst_gap[index], clock[0] - last_sent[index])
+    return schedulers, worst_gap
+
+
+def test_longest_advert_gap_stays_below_ttl():
+    random.seed(1)
+    schedulers, worst_gap = _simulate(40, 30)
+    assert max(worst_gap) < ServiceRegistry.DEFAULT_TTL_MS
+
+
+def test_quiet_mesh_backs_off_to_imax():
+    # One advert per Imax (32 s) interval once backed off, plus the ramp
+    # from Imin: about 61 in 30 minutes, against 360 on a fixed 5 s period.
+    ceiling = 30 * 60 * 1000 // (1000 << 5) + 6
+    per_node = {}
+    for nodes in (5, 40):
+        random.seed(1)
+        schedulers, _ = _simulate(nodes, 30)
+        counts = [s.transmissions for s in schedulers]
+        assert max(counts) <= ceiling + 3
+        per_node[nodes] = sum(counts) / float(nodes)
+    # Only copies of a node's own state suppress its adverts, so without
+    # gossip each node sends at the Imax rate whatever the fleet size:
+    # total advert traffic is linear in nodes, not sublinear.
+    assert abs(per_node[40] - per_node[5]) <= 3
+
+
+def test_other_nodes_adverts_do_not_suppress():
+    scheduler = AdvertiseScheduler(node_id="me", profile_hash="h1")
+    other = {Schema.F_TYPE: Schema.TYPE_ADVERTISE, Schema.F_NODE_ID: "peer", Schema.F_PROFILE_HASH: "h2"}
+    for _ in range(5):
+        scheduler.observe(other)
+    assert scheduler._counter == 0
+    scheduler.observe({Schema.F_TYPE: Schema.TYPE_ADVERTISE, Schema.F_NODE_ID: "me", Schema.F_PROFILE_HASH: "h1"})
+    assert scheduler._counter == 1
+
+
+def test_matching_gossip_digest_counts_as_consistent():
+    scheduler = AdvertiseScheduler(node_id="me", profile_hash="h1", digest=lambda: "abc")
+    scheduler.observe({Schema.F_TYPE: Schema.TYPE_GOSSIP_DIGEST, Schema.F_DIGEST: "xyz"})
+    assert scheduler._counter == 0
+    scheduler.observe({Schema.F_TYPE: Schema.TYPE_GOSSIP_DIGEST, Schema.F_DIGEST: "abc"})
+    assert scheduler._counter == 1
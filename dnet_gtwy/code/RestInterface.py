@@ -14,10 +14,17 @@ except Exception:
 from MicroPyServer import MicroPyServer
 
 from dnet.messaging import MessagingEndpoint
+from dnet.messaging import ProfileCache
 from dnet.messaging import Schema
+from dnet.messaging import ServiceRegistry
+from dnet.messaging.gossip import RegistryGossip
+from dnet.messaging.snapshot import Snapshotter, load_snapshot
 from dnet.signalling.LighthouseMesh import LighthouseMesh
 
 
+REGISTRY_SNAPSHOT_PATH = "registry.snap"
+
+
 class RestInterface:
     def __init__(self, mesh=None, endpoint=None, channel=6, host="0.0.0.0", port=80):
         self.channel = int(channel)
@@ -30,10 +37,33 @@ class RestInterface:
         self._max_message_log = 250
         self._message_seq = 0
         print("RestInterface: version={}".format(VERSION))
+        # The gateway is the mesh time reference nodes synchronize against.
+        self.clock = self.mesh.create_clock(server=True)
+        # Holds unicast traffic for duty-cycled nodes until their wake window.
+        self.duty_cycle = self.mesh.create_duty_cycle(self.clock)
         if endpoint is None:
-            transport = self.mesh.create_transport(default_peer="broadcast")
-            endpoint = MessagingEndpoint(node_id=self.mesh.node_id, transport=transport)
+            transport = self.duty_cycle
+            endpoint = MessagingEndpoint(
+                node_id=self.mesh.node_id,
+                transport=transport,
+                registry=ServiceRegistry(clock=self.clock.now_ms),
+                # Fetch each distinct profile hash once, not once per node.
+                profile_cache=ProfileCache(),
+                # Answer queries on behalf of every node the gateway knows.
+                answer_from_registry=True,
+            )
         self.endpoint = endpoint
+        # Warm start: nodes from the last snapshot show as unverified until
+        # they broadcast again.
+        try:
+            restored = load_snapshot(self.endpoint.registry, REGISTRY_SNAPSHOT_PATH)
+            print("RestInterface: restored {} nodes from snapshot".format(restored))
+        except Exception as exc:
+            print("RestInterface: ignoring registry snapshot ({})".format(exc))
+        self.snapshotter = Snapshotter(self.endpoint.registry, REGISTRY_SNAPSHOT_PATH)
+        # Anti-entropy with neighbours so a fresh gateway catches up quickly.
+        self.gossip = RegistryGossip(self.endpoint)
+        self._gossip_task = None
         self.server = MicroPyServer()
         self._mesh_task = None
         self.setup_routes()
@@ -98,6 +128,7 @@ class RestInterface:
         self.server.add_route("/status", self.get_espnow_status, "GET")
         self.server.add_route("/espnow/status", self.get_espnow_status, "GET")
         self.server.add_route("/nodes", self.get_nodes, "GET")
+        self.server.add_route("/nodes/changes", self.get_node_changes, "GET")
         self.server.add_route("/messages", self.get_messages, "GET")
         self.server.add_route("/version", self.get_version, "GET")
 
@@ -111,6 +142,9 @@ class RestInterface:
                 continue
             if message is None:
                 break
+        # Drop nodes that went silent even when no new frames arrived.
+        self.endpoint.registry.expire()
+        self.snapshotter.maybe_save()
 
     def _now_ms(self):
         try:
@@ -118,6 +152,16 @@ class RestInterface:
         except Exception:
             return int(_time.time() * 1000)
 
+    def _node_dict(self, node):
+        # The registry runs on mesh time (ms since the gateway clock
+        # started); report last_seen_ms on the same local clock as the
+        # message log's ts_ms, as before the registry moved to mesh time.
+        data = node.to_dict()
+        age_ms = max(0, self.clock.now_ms() - node.last_seen_ms)
+        data["last_seen_ms"] = self._now_ms() - age_ms
+        data["age_ms"] = age_ms
+        return data
+
     def _coerce_message(self, message):
         try:
             return message.copy()
@@ -147,6 +191,11 @@ class RestInterface:
         except Exception as exc:
             print("RestInterface: message capture failed ({})".format(exc))
 
+        try:
+            self.duty_cycle.service()
+        except Exception as exc:
+            print("RestInterface: duty-cycle flush failed ({})".format(exc))
+
         try:
             msg_type = message.get(Schema.F_TYPE)
         except Exception:
@@ -216,6 +265,8 @@ class RestInterface:
                 },
                 "known_peers": len(self.mesh._known_peers),
                 "rx_queue_depth": len(self.mesh._rx_queue),
+                "mesh_time_ms": self.clock.now_ms(),
+                "duty_cycle": self.duty_cycle.stats(),
             }
             self._send_json_response(data)
         except Exception as exc:
@@ -233,34 +284,64 @@ class RestInterface:
             nodes = self.endpoint.registry.all_nodes()
             profiles = []
             for node_id in sorted(nodes.keys()):
-                node = nodes[node_id]
-                services = node.get("services")
-                if services is None:
-                    service_ids = node.get("service_ids", [])
-                else:
-                    service_ids = [entry[Schema.F_SERVICE_ID] for entry in services]
-                profiles.append(
-                    {
-                        "node_id": node_id,
-                        "profile_hash": node.get("profile_hash"),
-                        "name": node.get("name"),
-                        "role": node.get("role"),
-                        "firmware": node.get("firmware"),
-                        "meta": node.get("meta", {}),
-                        "service_ids": service_ids,
-                        "last_seen_ms": node.get("last_seen_ms"),
-                    }
-                )
+                profiles.append(self._node_dict(nodes[node_id]))
 
             data = {
                 "status": "ok",
                 "count": len(profiles),
                 "nodes": profiles,
+                "revision": self.endpoint.registry.revision,
             }
             self._send_json_response(data)
         except Exception as exc:
             self._send_json_response({"status": "error", "error": str(exc)}, http_code=500)
 
+    def get_node_changes(self, request):
+        """Incremental /nodes sync: GET /nodes/changes?since=<revision>."""
+        print("RestInterface: incoming GET /nodes/changes")
+        try:
+            since = int(self._query_param(request, "since") or 0)
+        except Exception:
+            self._send_json_response({"status": "error", "error": "since must be an integer"}, http_code=400)
+            return
+        try:
+            self._drain_pending_messages()
+            registry = self.endpoint.registry
+            changes = registry.changes_since(since)
+            if changes is None:
+                # Change log overflowed; the client must reload /nodes.
+                self._send_json_response({"status": "ok", "resync": True, "revision": registry.revision})
+                return
+            entries = []
+            for revision, event, node_id in changes:
+                node = registry.get_node(node_id)
+                entries.append(
+                    {
+                        "revision": revision,
+                        "event": event,
+                        "node_id": node_id,
+                        "node": self._node_dict(node) if node is not None and event != registry.EVENT_EXPIRED else None,
+                    }
+                )
+            self._send_json_response(
+                {"status": "ok", "resync": False, "revision": registry.revision, "changes": entries}
+            )
+        except Exception as exc:
+            self._send_json_response({"status": "error", "error": str(exc)}, http_code=500)
+
+    def _query_param(self, request, name):
+        try:
+            target = str(request).split("\r\n", 1)[0].split(" ")[1]
+        except Exception:
+            return None
+        if "?" not in target:
+            return None
+        for pair in target.split("?", 1)[1].split("&"):
+            key, _, value = pair.partition("=")
+            if key == name:
+                return value
+        return None
+
     def _send_json_response(self, data, http_code=200):
         response = json.dumps(data)
         reason = "OK" if int(http_code) < 400 else "ERROR"
@@ -298,6 +379,10 @@ class RestInterface:
                         fallback_exc
                     )
                 )
+        try:
+            self._gossip_task = asyncio.create_task(self.gossip.run())
+        except Exception as exc:
+            print("RestInterface: gossip task not started ({})".format(exc))
         try:
             import wifi  # noqa: F401
             import network
@@ -316,6 +401,7 @@ class RestInterface:
         print("GET /health")
         print("GET /status")
         print("GET /nodes")
+        print("GET /nodes/changes?since=<revision>")
         try:
             # Prefer explicit bind when supported by the server implementation.
             self.server.start(self.host, self.port)
@@ -337,6 +423,13 @@ class RestInterface:
             self._mesh_task = None
         else:
             print("RestInterface: no active mesh task to stop")
+        if self._gossip_task is not None:
+            try:
+                self._gossip_task.cancel()
+                stopped.append("gossip_task")
+            except Exception as exc:
+                print("RestInterface: gossip task cancel failed ({})".format(exc))
+            self._gossip_task = None
 
         if hasattr(self.server, "stop"):
             try:
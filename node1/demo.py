@@ -10,13 +10,20 @@ try:
 except Exception:
     logging = None
 
+from dnet.messaging import AdvertiseScheduler
 from dnet.messaging import MessagingEndpoint
 from dnet.messaging import Schema
+from dnet.messaging.gossip import RegistryGossip
 from dnet.signalling.LighthouseMesh import LighthouseMesh
 
 
 PROFILE_PATH = "/lib/profile.json"
-BROADCAST_INTERVAL_S = 5
+# Trickle: rebroadcast within 1 s of a change, back off to 32 s when quiet,
+# skip our turn once 2 copies of our own advert or matching gossip digests
+# were heard in the interval. Never silent longer than half the registry TTL.
+TRICKLE_IMIN_MS = 1000
+TRICKLE_IMAX_DOUBLINGS = 5
+TRICKLE_K = 2
 MESH_CHANNEL = 6
 
 
@@ -57,13 +64,17 @@ def send_profile_broadcast(endpoint, profile):
     _log_info("broadcasted profile ({} bytes)".format(len(payload)))
 
 
+SCHEDULER = AdvertiseScheduler(
+    imin_ms=TRICKLE_IMIN_MS, imax_doublings=TRICKLE_IMAX_DOUBLINGS, k=TRICKLE_K
+)
+
+
 async def broadcast_loop(endpoint, profile):
-    while True:
-        send_profile_broadcast(endpoint, profile)
-        await asyncio.sleep(BROADCAST_INTERVAL_S)
+    await SCHEDULER.run(lambda: send_profile_broadcast(endpoint, profile))
 
 
 def on_message(peer_id, message):
+    SCHEDULER.observe(message)
     if message.get(Schema.F_TYPE) != Schema.TYPE_PROFILE:
         return
     _log_info("profile from {}: {}".format(peer_id, message))
@@ -72,15 +83,22 @@ def on_message(peer_id, message):
 async def run():
     profile = load_profile()
     _log_info(
-        "demo config channel={} interval_s={}".format(
-            MESH_CHANNEL, BROADCAST_INTERVAL_S
+        "demo config channel={} trickle_imin_ms={} trickle_k={}".format(
+            MESH_CHANNEL, TRICKLE_IMIN_MS, TRICKLE_K
         )
     )
     mesh = LighthouseMesh(channel=MESH_CHANNEL)
     transport = mesh.create_transport(default_peer="broadcast")
     endpoint = MessagingEndpoint(node_id=mesh.node_id, transport=transport)
+    # Answer queries for our services and get_profile requests for us.
+    endpoint.set_local_profile(profile)
+
+    gossip = RegistryGossip(endpoint)
+    SCHEDULER.set_local(endpoint.node_id, endpoint.local_profile_hash())
+    SCHEDULER.digest = gossip.digest
 
     asyncio.create_task(broadcast_loop(endpoint, profile))
+    asyncio.create_task(gossip.run())
     await mesh.run(endpoint=endpoint, on_message=on_message, poll_ms=25)
 
 